@@ -0,0 +1,71 @@
+"""
+Database profiles for Task1/settings.py, selected with environment variables so the same settings module serves
+a single box SQLite deployment and a pooled server database:
+
+    DATABASE_PROFILE        sqlite (default) or postgres
+    DATABASE_NAME           SQLite file or database name
+    DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_PORT
+    DATABASE_CONN_MAX_AGE   seconds a connection is reused for, 0 closes it after every request (default 60)
+    DATABASE_POOL           pgbouncer when connections go through PgBouncer in transaction pooling mode
+    DATABASE_SQLITE_TUNING  0 to keep SQLite's default journaling and locking
+    DATABASE_REPLICAS       comma separated read replicas, SQLite files or Postgres hosts, added as replica1, ...
+"""
+
+import os
+
+# Applied by account.db on every new SQLite connection
+SQLITE_PRAGMAS = {
+    # Readers no longer block the writer and vice versa
+    'journal_mode': 'WAL',
+    # Durable across application crashes, only an OS crash can lose the last commits
+    'synchronous': 'NORMAL',
+    # Wait for a competing writer instead of failing with "database is locked"
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+def database_settings(base_dir, env=os.environ):
+    profile = env.get('DATABASE_PROFILE', 'sqlite')
+    conn_max_age = int(env.get('DATABASE_CONN_MAX_AGE', 60))
+
+    if profile == 'sqlite':
+        primary = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env.get('DATABASE_NAME', os.path.join(base_dir, 'db.sqlite3')),
+            'CONN_MAX_AGE': conn_max_age,
+            # Seconds the sqlite3 module waits on a lock, kept in line with busy_timeout
+            'OPTIONS': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000},
+        }
+        replica_key = 'NAME'
+    elif profile == 'postgres':
+        pgbouncer = env.get('DATABASE_POOL') == 'pgbouncer'
+        primary = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env.get('DATABASE_NAME', 'task1'),
+            'USER': env.get('DATABASE_USER', ''),
+            'PASSWORD': env.get('DATABASE_PASSWORD', ''),
+            'HOST': env.get('DATABASE_HOST', ''),
+            'PORT': env.get('DATABASE_PORT', ''),
+            # With PgBouncer the pool lives there, Django keeps no connection of its own between requests
+            'CONN_MAX_AGE': 0 if pgbouncer else conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            # Server side cursors don't survive transaction pooling
+            'DISABLE_SERVER_SIDE_CURSORS': pgbouncer,
+        }
+        replica_key = 'HOST'
+    else:
+        raise ValueError('Unknown DATABASE_PROFILE {!r}, expected sqlite or postgres'.format(profile))
+
+    databases = {'default': primary}
+    replicas = [replica.strip() for replica in env.get('DATABASE_REPLICAS', '').split(',') if replica.strip()]
+    for number, replica in enumerate(replicas, 1):
+        # Tests read the replicas through the primary's test database, there is no replication to wait for
+        databases['replica{}'.format(number)] = dict(primary, **{replica_key: replica, 'TEST': {'MIRROR': 'default'}})
+    return databases
+
+
+def sqlite_pragmas(env=os.environ):
+    if env.get('DATABASE_SQLITE_TUNING', '1') == '0':
+        return {}
+    return dict(SQLITE_PRAGMAS)
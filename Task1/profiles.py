@@ -0,0 +1,59 @@
+"""
+Deployment profiles for Task1/settings.py, selected with environment variables so API-only workers boot without the
+parts of the stack only a browser uses:
+
+    APP_PROFILE     full (default) or api. api drops the admin, the coreapi docs, sessions, messages, static
+                    files and the browsable API, and keeps DRF from importing coreapi, requests and the other
+                    optional libraries it would otherwise load at import time. Code running in an api worker can't
+                    import those
+    APP_WARM_UP     0 to skip account.warmup.warm_up() in Task1/wsgi.py and asgi.py, which pays the first
+                    request's URLconf, import and serializer costs while the worker boots
+"""
+
+import os
+import sys
+
+PROFILES = ('full', 'api')
+
+# Settings entries (apps, middleware, DRF classes) only the full profile installs
+FULL_ONLY = {
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'rest_framework.authentication.SessionAuthentication',
+    'rest_framework.renderers.BrowsableAPIRenderer',
+}
+
+# Optional dependencies rest_framework.compat imports when installed: the schema generators' libraries and requests
+# for its RequestsClient test client. Together about a third of a second per worker, coreapi alone pulls in
+# requests and pkg_resources
+OPTIONAL_MODULES = ('coreapi', 'coreschema', 'uritemplate', 'yaml', 'requests')
+
+
+def app_profile(env=os.environ):
+    profile = env.get('APP_PROFILE', 'full')
+    if profile not in PROFILES:
+        raise ValueError('Unknown APP_PROFILE {!r}, expected full or api'.format(profile))
+    return profile
+
+
+def for_profile(entries, profile):
+    # The entries the profile installs, in their order
+    return [entry for entry in entries if profile == 'full' or entry not in FULL_ONLY]
+
+
+def warm_up_enabled(env=os.environ):
+    return env.get('APP_WARM_UP', '1') != '0'
+
+
+def skip_optional_imports():
+    # A None entry in sys.modules makes `import name` raise ImportError, so DRF treats these as not installed.
+    # Must run before rest_framework is first imported, modules already loaded are left alone
+    for name in OPTIONAL_MODULES:
+        sys.modules.setdefault(name, None)
@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from .database import database_settings, sqlite_pragmas
+from .profiles import app_profile, for_profile, skip_optional_imports, warm_up_enabled
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -28,7 +31,16 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
-INSTALLED_APPS = [
+# full, or api for workers that only serve the JSON API, see Task1/profiles.py
+APP_PROFILE = app_profile()
+
+if APP_PROFILE == 'api':
+    skip_optional_imports()
+
+# Whether Task1/wsgi.py and asgi.py warm the worker up before it serves requests (account.warmup)
+APP_WARM_UP = warm_up_enabled()
+
+INSTALLED_APPS = for_profile([
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -38,23 +50,154 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'account',
-]
+], APP_PROFILE)
 
 OLD_PASSWORD_FIELD_ENABLED = True
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+    # Add 'account.authentication.SignedTokenAuthentication' (or use it instead of DeviceTokenAuthentication) for
+    # stateless, expiring access/refresh tokens; login issues a token for each class listed here.
+    # CachedTokenAuthentication instead of DeviceTokenAuthentication keeps one permanent authtoken Token per user
+    'DEFAULT_AUTHENTICATION_CLASSES': for_profile([
+        'account.authentication.DeviceTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication'
-    ],
+    ], APP_PROFILE),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Behind reverse proxies set NUM_PROXIES to their number, the login throttle keys on REMOTE_ADDR until then and
+    # never on a client supplied X-Forwarded-For
+    'NUM_PROXIES': None,
+    'DEFAULT_RENDERER_CLASSES': for_profile([
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ], APP_PROFILE),
+
+    # The api profile serves no docs and doesn't import coreapi
+    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema' if APP_PROFILE == 'full'
+    else 'rest_framework.schemas.openapi.AutoSchema',
+}
+
+# Token -> user resolution cache used by account.authentication.CachedTokenAuthentication and
+# DeviceTokenAuthentication.
+# Set USE_SHARED_CACHE to share entries between worker processes through CACHE_ALIAS. An invalidation (logout, password
+# change, deactivation) also drops the shared entries, other processes' local copies live until their TTL.
+ACCOUNT_TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'USE_SHARED_CACHE': False,
+    'CACHE_ALIAS': 'default',
+}
+
+# Per device tokens of account.authentication.DeviceTokenAuthentication: TTL seconds after they were issued or last
+# renewed, renewed on use at most every RENEW_INTERVAL seconds while SLIDING. Expired rows are deleted by
+# `manage.py prune_tokens`, or every PRUNE_INTERVAL seconds by a background thread of the serving process
+ACCOUNT_DEVICE_TOKENS = {
+    'TTL': 30 * 24 * 3600,
+    'SLIDING': True,
+    'RENEW_INTERVAL': 3600,
+    'MAX_DEVICES': 10,
+    'PRUNE_INTERVAL': None,
+    'PRUNE_BATCH_SIZE': 500,
+    'PRUNE_PAUSE': 0.1,
+}
+
+# Lifetimes in seconds of the tokens issued for account.authentication.SignedTokenAuthentication. users/refresh_token/
+# doesn't rotate refresh tokens, one stays usable for REFRESH_TTL unless the user's token_version is bumped
+ACCOUNT_SIGNED_TOKENS = {
+    'ACCESS_TTL': 300,
+    'REFRESH_TTL': 7 * 24 * 3600,
+}
+
+# Password hashing for login/signup/change_password (account.hashing). With POOL_ENABLED hashes run in a process
+# pool of WORKERS processes; once MAX_PENDING jobs are in flight requests get a 503 with Retry-After. Uploads to
+# users/bulk_create_users/ always hash in a pool, the shared one or their own, with at most IMPORT_MAX_PENDING jobs.
+ACCOUNT_HASHING = {
+    'POOL_ENABLED': False,
+    'WORKERS': None,
+    'MAX_PENDING': 32,
+    'RETRY_AFTER': 1,
+    'IMPORT_MAX_PENDING': 8,
+}
+
+# Password hash cost (account.hashers). PROFILE is fast, standard or strong, ITERATIONS overrides it with the count
+# `manage.py calibrate_hasher` picked for this hardware. Stored hashes of another cost are rehashed on login and
+# `manage.py hash_report` shows how many are left.
+ACCOUNT_PASSWORD_HASHING = {
+    'PROFILE': os.environ.get('ACCOUNT_HASH_PROFILE', 'standard'),
+    'ITERATIONS': None,
+}
 
-    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema'
+PASSWORD_HASHERS = [
+    'account.hashers.ProfilePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Avatar processing (account.images). Uploads are only sniffed in the request; WORKERS background threads then
+# write an EXIF free FORMAT copy per VARIANTS entry (name -> longest side in px). WORKERS = 0 processes on commit.
+ACCOUNT_IMAGES = {
+    'WORKERS': 2,
+    'VARIANTS': {'thumb': 64, 'small': 256, 'medium': 512},
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+}
+
+# Login throttling (account.throttling): sliding window limits per client IP and per email. Going over a limit locks
+# that IP/email out for LOCKOUT seconds, doubling on every repeat up to MAX_LOCKOUT. Use BACKEND 'cache' to share
+# the counters between worker processes through CACHE_ALIAS.
+ACCOUNT_LOGIN_THROTTLE = {
+    'BACKEND': 'memory',
+    'CACHE_ALIAS': 'default',
+    'IP_RATE': '20/min',
+    'EMAIL_RATE': '5/min',
+    'LOCKOUT': 30,
+    'MAX_LOCKOUT': 3600,
+}
+
+# users/me/ and users/{id}/ answer conditional GETs from the user's profile_version (account.caching). With
+# PAYLOAD_CACHE the serialized profile is also kept in CACHE_ALIAS for TTL seconds, keyed on that version.
+ACCOUNT_PROFILE_CACHE = {
+    'PAYLOAD_CACHE': False,
+    'CACHE_ALIAS': 'default',
+    'TTL': 300,
+}
+
+# Bloom filter of the users' emails (account.emailfilter), built in the background at boot. Signup and
+# users/email_available/ skip their existence query on a definite miss. Sized for CAPACITY emails, or twice the users
+# there are, at ERROR_RATE false positives; other workers' signups are picked up every REFRESH_INTERVAL seconds
+ACCOUNT_EMAIL_FILTER = {
+    'ENABLED': True,
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.01,
+    'REFRESH_INTERVAL': 5,
+}
+
+# Audit log of logins and account changes (account.audit). Events wait in a buffer of BUFFER_SIZE, a background
+# thread INSERTs them BATCH_SIZE at a time or FLUSH_INTERVAL seconds after the first one, whichever comes first.
+# Events recorded while the buffer is full are dropped and counted in users/metrics/
+ACCOUNT_AUDIT_LOG = {
+    'ENABLED': True,
+    'BUFFER_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+}
+
+# Login fast path (account.backends): last_login is written at most once per LAST_LOGIN_INTERVAL seconds
+ACCOUNT_LOGIN = {
+    'LAST_LOGIN_INTERVAL': 300,
 }
 
-MIDDLEWARE = [
+AUTHENTICATION_BACKENDS = ['account.backends.EmailBackend']
+
+# Spool uploads bigger than this to a temporary file instead of holding them in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+MIDDLEWARE = for_profile([
+    'account.metrics.MetricsMiddleware',
+    'account.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,7 +205,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-]
+], APP_PROFILE)
 
 ROOT_URLCONF = 'Task1.urls'
 
@@ -90,11 +233,20 @@ WSGI_APPLICATION = 'Task1.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+# The profile (SQLite or a pooled server database) comes from the environment, see Task1/database.py
+DATABASES = database_settings(BASE_DIR)
+
+SQLITE_PRAGMAS = sqlite_pragmas()
+
+# Reads of users and tokens are spread over the replicas (account.routers), writes go to the primary. After a
+# user's own write their reads stay on the primary for STICKY_SECONDS, longer than the replication lag. Every worker
+# must see that mark, so with replicas CACHE_ALIAS has to be a shared cache (`manage.py check` warns about locmem).
+DATABASE_ROUTERS = ['account.routers.ReplicaRouter']
+
+ACCOUNT_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 5,
+    'CACHE_ALIAS': 'default',
 }
 
 # Password validation
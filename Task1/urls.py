@@ -1,10 +1,18 @@
-from django.contrib import admin
+from django.apps import apps
+from django.conf import settings
 from django.urls import path, include
-from rest_framework.documentation import include_docs_urls
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('docs/', include_docs_urls('rest_framework.docs')),
     path('', include('account.urls')),
-
 ]
+
+# The api profile installs neither, and their modules are never imported
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
+
+if settings.APP_PROFILE == 'full':
+    from rest_framework.documentation import include_docs_urls
+
+    urlpatterns.insert(-1, path('docs/', include_docs_urls('rest_framework.docs')))
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Task1.settings')
 
 application = get_wsgi_application()
+
+if settings.APP_WARM_UP:
+    from account.warmup import warm_up
+
+    warm_up()
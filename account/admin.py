@@ -1,11 +1,25 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from .bulk import bulk_apply
+from .images import schedule_image_processing
 from .models import User
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext as _, ngettext
 
 
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
+    # Chunked UPDATEs through account.bulk, the selected users are never loaded
+    actions = ['deactivate_users', 'reactivate_users', 'grant_staff', 'revoke_staff']
+
+    def get_queryset(self, request):
+        # Deactivated users stay reachable here so they can be reactivated, the is_active filter narrows the list
+        return User.all_with_inactive.all()
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # save() dropped the previous image's variants, the new one's are rendered like an API upload's
+        if 'image' in form.changed_data:
+            schedule_image_processing(obj)
     list_display = ['email', 'first_name', 'last_name', 'gender']
 
     fieldsets = (
@@ -31,5 +45,27 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def apply(self, request, queryset, action, fields=None):
+        counts = bulk_apply(queryset, action, fields)
+        message = ngettext('%(updated)d user updated, %(revoked_tokens)d tokens revoked.',
+                           '%(updated)d users updated, %(revoked_tokens)d tokens revoked.', counts['updated'])
+        self.message_user(request, message % counts)
+
+    @admin.action(description=_('Deactivate selected users and revoke their tokens'))
+    def deactivate_users(self, request, queryset):
+        self.apply(request, queryset.exclude(pk=request.user.pk), 'deactivate')
+
+    @admin.action(description=_('Reactivate selected users'))
+    def reactivate_users(self, request, queryset):
+        self.apply(request, queryset, 'reactivate')
+
+    @admin.action(description=_('Grant staff status to selected users'))
+    def grant_staff(self, request, queryset):
+        self.apply(request, queryset, 'update', {'is_staff': True})
+
+    @admin.action(description=_('Revoke staff status from selected users'))
+    def revoke_staff(self, request, queryset):
+        self.apply(request, queryset.exclude(pk=request.user.pk), 'update', {'is_staff': False})
+
 
 admin.site.register(User, UserAdmin)
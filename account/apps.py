@@ -1,5 +1,34 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
+from django.core import checks
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_delete
 
 
 class AccountConfig(AppConfig):
     name = 'account'
+
+    def ready(self):
+        from .authentication import device_token_conf, invalidate_deleted_user, invalidate_saved_user
+        from .backends import update_last_login
+        from .db import apply_sqlite_pragmas
+        from .emailfilter import remember_email
+        from .metrics import instrument_connection
+        from .models import User
+        from .pruning import start_scheduler
+        from .routers import check_sticky_cache
+
+        checks.register(check_sticky_cache, checks.Tags.caches)
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='account.db.apply_sqlite_pragmas')
+        connection_created.connect(instrument_connection, dispatch_uid='account.metrics.instrument_connection')
+        post_save.connect(remember_email, sender=User, dispatch_uid='account.emailfilter.remember_email')
+        post_save.connect(invalidate_saved_user, sender=User,
+                          dispatch_uid='account.authentication.invalidate_saved_user')
+        pre_delete.connect(invalidate_deleted_user, sender=User,
+                           dispatch_uid='account.authentication.invalidate_deleted_user')
+        # Same dispatch_uid as django.contrib.auth's receiver, whichever app is ready first ours is the one kept
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(update_last_login, dispatch_uid='update_last_login')
+        if device_token_conf()['PRUNE_INTERVAL']:
+            request_started.connect(start_scheduler, dispatch_uid='account.pruning.start_scheduler')
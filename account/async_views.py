@@ -0,0 +1,225 @@
+"""
+Async views served through Task1/asgi.py. Login, users/me/ and the users list run on the event loop with the async
+ORM, password work is awaited on the hashing pool so the event loop never blocks on PBKDF2
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.translation import gettext as _
+from rest_framework import exceptions, serializers, status
+from rest_framework.authtoken.models import Token
+from rest_framework.settings import api_settings
+
+from .audit import record
+from .authentication import DeviceTokenAuthentication, aauthenticate_device_token, aget_or_create_token, \
+    aissue_device_token, get_token_cache, read_signed_token, user_cache_key
+from .backends import last_login_is_stale
+from .caching import not_modified, set_validators
+from .hashers import needs_rehash
+from .hashing import HashingBusy, ahash_password, averify_password
+from .models import AuditEvent, User
+from .pagination import UserCursorPagination
+from .routers import get_replica_conf, pin_primary, recently_wrote
+from .serializers import PROJECTABLE_FIELDS, UserRowSerializer, parse_fields
+from .throttling import client_ip, get_login_guard
+
+
+def _uses_device_tokens():
+    # Token keys mean DeviceTokens when the sync API authenticates with them too
+    return any(issubclass(authenticator, DeviceTokenAuthentication)
+               for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES)
+
+
+def _error(detail, status_code):
+    return JsonResponse({'detail': detail}, status=status_code)
+
+
+def _busy_response(exc):
+    response = _error(str(exc.detail), exc.status_code)
+    response['Retry-After'] = '%d' % exc.wait
+    return response
+
+
+async def _authenticate(request):
+    """
+    The active user behind `Authorization: Token <key>` or `Bearer <access token>`, or None. Both go through the
+    TokenCache first, like CachedTokenAuthentication and SignedTokenAuthentication
+    """
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2:
+        return None
+    keyword, credentials = header[0].lower(), header[1]
+    cache = get_token_cache()
+
+    if keyword == 'token' and _uses_device_tokens():
+        user = await aauthenticate_device_token(credentials)
+        if user is None:
+            return None
+    elif keyword == 'token':
+        user = cache.get(credentials)
+        if user is None:
+            tokens = Token.objects.select_related('user').filter(key=credentials)
+            token = await tokens.afirst()
+            if token is None and get_replica_conf()['ALIASES']:
+                # A token issued moments ago may not have reached the replicas yet
+                token = await tokens.using(DEFAULT_DB_ALIAS).afirst()
+            if token is None:
+                return None
+            user = token.user
+            cache.set(credentials, user)
+    elif keyword == 'bearer':
+        try:
+            user_id, version = read_signed_token(credentials, 'access')
+        except exceptions.AuthenticationFailed:
+            return None
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = await User.objects.filter(pk=user_id).afirst()
+            if user is None:
+                return None
+            cache.set(key, user)
+        if user.token_version != version:
+            return None
+    else:
+        return None
+
+    if not user.is_active:
+        return None
+    # Lets the middleware see who made the request, like DRF does for the sync views
+    request.user = user
+    if recently_wrote(user):
+        pin_primary()
+    return user
+
+
+def _unauthorized():
+    return _error(_('Authentication credentials were not provided.'), status.HTTP_401_UNAUTHORIZED)
+
+
+async def _record_login(user):
+    # The user_logged_in receivers are sync, so the coalesced last_login write is applied here directly
+    if last_login_is_stale(user):
+        user.last_login = timezone.now()
+        await User.objects.filter(pk=user.pk).aupdate(last_login=user.last_login)
+
+
+async def _rehash(user, password):
+    # The sync check_password's setter, a hash of outdated cost (account.hashers) is replaced once the password
+    # proved right. A busy pool leaves it to the next login
+    if not needs_rehash(user.password):
+        return
+    try:
+        user.password = await ahash_password(password)
+    except HashingBusy:
+        return
+    await User.all_with_inactive.filter(pk=user.pk).aupdate(password=user.password)
+
+
+async def login(request):
+    if request.method != 'POST':
+        return _error(_('Method not allowed'), status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return _error(_('Malformed JSON'), status.HTTP_400_BAD_REQUEST)
+
+    email = data.get('email')
+    password = data.get('password')
+    device = data.get('device', '')
+    if not isinstance(email, str) or not isinstance(password, str) or not email or not password:
+        return _error(_('Both email and password are required'), status.HTTP_400_BAD_REQUEST)
+    if not isinstance(device, str) or len(device) > 64:
+        return _error(_('Invalid device'), status.HTTP_400_BAD_REQUEST)
+
+    wait = get_login_guard().check(client_ip(request), email)
+    if wait is not None:
+        response = _error(_('Too many login attempts, try again later'), status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = '%d' % wait
+        return response
+
+    user = await User.objects.select_related('auth_token').with_email(email).order_by('id').afirst()
+    try:
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            await ahash_password(password)
+            is_correct = False
+        else:
+            is_correct = await averify_password(password, user.password)
+    except HashingBusy as exc:
+        return _busy_response(exc)
+
+    if not is_correct:
+        return _error(_('Unable to authenticate with provided credentials'), status.HTTP_401_UNAUTHORIZED)
+
+    await _rehash(user, password)
+    await _record_login(user)
+    if _uses_device_tokens():
+        token = await aissue_device_token(user, device)
+    else:
+        token = await aget_or_create_token(user)
+    get_token_cache().invalidate_user(user)
+    # on_commit needs the connection, which is only used from sync code
+    await sync_to_async(record)(AuditEvent.LOGIN, user, request, device=device)
+    return JsonResponse({'token': token.key, 'user_id': user.id})
+
+
+async def me(request):
+    # GET of users/me/ with the same body, ETag and Last-Modified as the sync view
+    if request.method != 'GET':
+        return _error(_('Method not allowed'), status.HTTP_405_METHOD_NOT_ALLOWED)
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    response = not_modified(request, user)
+    if response is None:
+        response = JsonResponse(UserRowSerializer(request=request).instance(user))
+    return set_validators(response, user)
+
+
+async def user_list(request):
+    """
+    Admin only keyset paginated users list, ?after=<id> continues after the given id and ?fields= projects like
+    the sync list
+    """
+    if request.method != 'GET':
+        return _error(_('Method not allowed'), status.HTTP_405_METHOD_NOT_ALLOWED)
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    if not user.is_staff:
+        return _error(_('You do not have permission to perform this action.'), status.HTTP_403_FORBIDDEN)
+
+    try:
+        fields = parse_fields(request.GET['fields']) if 'fields' in request.GET else PROJECTABLE_FIELDS
+        after = int(request.GET.get('after', 0))
+        # Clamped into 1..max_page_size, an empty or negative slice can't make a page
+        page_size = max(1, min(int(request.GET.get('page_size', UserCursorPagination.page_size)),
+                               UserCursorPagination.max_page_size))
+    except serializers.ValidationError as exc:
+        return JsonResponse(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return _error(_('after and page_size must be integers'), status.HTTP_400_BAD_REQUEST)
+
+    # One row more than the page tells whether there is a next one
+    queryset = User.objects.filter(pk__gt=after).order_by('id').values(*set(fields + ['id']))[:page_size + 1]
+    rows = [row async for row in queryset]
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        params = request.GET.copy()
+        params['after'] = rows[-1]['id']
+        next_url = request.build_absolute_uri('?' + params.urlencode())
+    return JsonResponse({'next': next_url, 'results': UserRowSerializer(fields, request).rows(rows)})
+
+
+# Token based like the rest of the API, the csrf decorators can't wrap coroutines so flag the views directly
+login.csrf_exempt = True
+me.csrf_exempt = True
+user_list.csrf_exempt = True
@@ -0,0 +1,229 @@
+"""
+Audit log of logins and account changes. Views hand AuditEvents to the process' AuditLog, a bounded in-memory buffer
+a background thread writes out with bulk_create, so a request never waits on the INSERT. Events reach the table (and
+the users/audit/ endpoints) up to FLUSH_INTERVAL seconds later
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Events held in memory at most, once it is full new events are dropped and counted
+    'BUFFER_SIZE': 10000,
+    # Rows per INSERT, the writer flushes as soon as it has this many
+    'BATCH_SIZE': 500,
+    # Seconds an event waits for its batch to fill up, None for no writer thread (flush() by hand)
+    'FLUSH_INTERVAL': 1.0,
+}
+
+
+class AuditLog:
+    """
+    Overflow drops the newest events instead of blocking the request that records them. Events a failed INSERT
+    couldn't write are logged and counted but not retried
+    """
+
+    def __init__(self, buffer_size=DEFAULTS['BUFFER_SIZE'], batch_size=DEFAULTS['BATCH_SIZE'],
+                 flush_interval=DEFAULTS['FLUSH_INTERVAL']):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = queue.Queue(buffer_size)
+        self._counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0}
+        # Requests add and the writer writes concurrently, += on the counters isn't atomic
+        self._counters_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        # Held while a batch is written, so stop() only drains once the writer is done with its batch
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_AUDIT_LOG', {}))
+        return cls(conf['BUFFER_SIZE'], conf['BATCH_SIZE'], conf['FLUSH_INTERVAL'])
+
+    def add(self, event):
+        # Returns whether the event was buffered
+        try:
+            self._buffer.put_nowait(event)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        if self._writer is None and self.flush_interval is not None:
+            self._start_writer()
+        return True
+
+    def flush(self):
+        # Writes every buffered event from the calling thread, returns how many were written
+        written = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take(self.batch_size)
+                if not batch:
+                    return written
+                written += self._write(batch)
+
+    def stop(self, timeout=5):
+        # Stops the writer and writes what is left, called at exit
+        self._stopped.set()
+        writer = self._writer
+        if writer is not None:
+            writer.join(timeout)
+        return self.flush()
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self._counters, pending=self._buffer.qsize())
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def _start_writer(self):
+        with self._writer_lock:
+            if self._writer is None and not self._stopped.is_set():
+                self._writer = threading.Thread(target=self._run, name='account-audit-writer', daemon=True)
+                self._writer.start()
+
+    def _take(self, limit, timeout=None):
+        """
+        Up to `limit` buffered events. With a timeout it waits that long for the first one and then until `timeout`
+        after it for the batch to fill up
+        """
+        batch = []
+        deadline = None
+        while len(batch) < limit:
+            try:
+                if timeout is None:
+                    batch.append(self._buffer.get_nowait())
+                    continue
+                wait = timeout if deadline is None else deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                batch.append(self._buffer.get(timeout=wait))
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+        return batch
+
+    def _write(self, batch):
+        from .models import AuditEvent
+
+        try:
+            AuditEvent.objects.bulk_create(batch)
+        except Exception:
+            logger.exception('Writing %d audit events failed', len(batch))
+            self._count('failed', len(batch))
+            return 0
+        self._count('written', len(batch))
+        return len(batch)
+
+    def _run(self):
+        # The writer lives as long as the process, so like a request each batch drops a connection that is broken
+        # or past CONN_MAX_AGE first, and a failed one doesn't keep it until the next batch
+        try:
+            while not self._stopped.is_set():
+                batch = self._take(self.batch_size, self.flush_interval)
+                if batch:
+                    with self._flush_lock:
+                        close_old_connections()
+                        if not self._write(batch):
+                            close_old_connections()
+        finally:
+            connections.close_all()
+
+
+_audit_log = None
+_audit_log_lock = threading.Lock()
+
+
+def get_audit_log():
+    # The process' AuditLog, or None when ACCOUNT_AUDIT_LOG is disabled
+    global _audit_log
+    if not dict(DEFAULTS, **getattr(settings, 'ACCOUNT_AUDIT_LOG', {}))['ENABLED']:
+        return None
+    if _audit_log is None:
+        with _audit_log_lock:
+            if _audit_log is None:
+                _audit_log = AuditLog.from_settings()
+    return _audit_log
+
+
+def record(event, user, request=None, actor=None, **data):
+    """
+    Buffers an AuditEvent about `user` (or a user id), done by `actor` when that is someone else, once the
+    surrounding transaction commits, so a rolled back change leaves no event
+    """
+    from .models import AuditEvent
+
+    audit_log = get_audit_log()
+    if audit_log is None:
+        return
+    user_id = getattr(user, 'pk', user)
+    actor_id = getattr(actor, 'pk', actor)
+    entry = AuditEvent(created=timezone.now(), event=event, user_id=user_id,
+                       actor_id=actor_id if actor_id != user_id else None,
+                       ip=request.META.get('REMOTE_ADDR') if request is not None else None, data=data)
+    transaction.on_commit(partial(audit_log.add, entry))
+
+
+def parse_audit_filters(params):
+    # Reads user, event, since and until out of a query dict into filter() keyword arguments, ValueError on bad input
+    from .models import AuditEvent
+
+    filters = {}
+    user = params.get('user')
+    if user:
+        if not user.isdigit():
+            raise ValueError('user must be a user id')
+        filters['user_id'] = int(user)
+
+    event = params.get('event')
+    if event:
+        if event not in dict(AuditEvent.EVENT_CHOICES):
+            raise ValueError('event must be one of {}'.format(', '.join(dict(AuditEvent.EVENT_CHOICES))))
+        filters['event'] = event
+
+    for param, lookup in (('since', 'created__gte'), ('until', 'created__lt')):
+        value = params.get(param)
+        if value:
+            parsed = parse_datetime(value) or parse_date(value)
+            if parsed is None:
+                raise ValueError('{} must be an ISO date or datetime'.format(param))
+            filters[lookup] = parsed
+    return filters
+
+
+def shutdown_audit_log():
+    # Registered with atexit, the buffered events are written before the process exits
+    audit_log = _audit_log
+    if audit_log is not None:
+        audit_log.stop()
+
+
+atexit.register(shutdown_audit_log)
+
+
+def _reload_audit_log(*args, **kwargs):
+    global _audit_log
+    if kwargs.get('setting') == 'ACCOUNT_AUDIT_LOG' and _audit_log is not None:
+        _audit_log.stop()
+        _audit_log = None
+
+
+setting_changed.connect(_reload_audit_log)
@@ -0,0 +1,476 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from .models import DeviceToken, User
+from .routers import get_replica_conf, primary
+
+SIGNED_TOKEN_DEFAULTS = {
+    'ACCESS_TTL': 300,
+    'REFRESH_TTL': 7 * 24 * 3600,
+}
+SIGNED_TOKEN_SALT = 'account.authentication.signed-token'
+
+DEVICE_TOKEN_DEFAULTS = {
+    'TTL': 30 * 24 * 3600,
+    'SLIDING': True,
+    'RENEW_INTERVAL': 3600,
+    'MAX_DEVICES': 10,
+    'PRUNE_INTERVAL': None,
+    'PRUNE_BATCH_SIZE': 500,
+    'PRUNE_PAUSE': 0.1,
+}
+
+DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'USE_SHARED_CACHE': False,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'account:token:',
+}
+
+
+class TokenCache:
+    """
+    A bounded LRU of token key -> user row with a per entry TTL, optionally backed by one of Django's caches
+    so that several worker processes can share resolutions. An invalidation drops this process' entries and the
+    shared ones, other processes keep serving their local copy until its TTL runs out
+    """
+
+    def __init__(self, max_size=DEFAULTS['MAX_SIZE'], ttl=DEFAULTS['TTL'], shared_cache=None,
+                 key_prefix=DEFAULTS['KEY_PREFIX']):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_cache = shared_cache
+        self.key_prefix = key_prefix
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_TOKEN_CACHE', {}))
+        shared_cache = caches[conf['CACHE_ALIAS']] if conf['USE_SHARED_CACHE'] else None
+        return cls(max_size=conf['MAX_SIZE'], ttl=conf['TTL'], shared_cache=shared_cache,
+                   key_prefix=conf['KEY_PREFIX'])
+
+    def get(self, key):
+        # Returns a fresh User instance for the token key, or None on a miss
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                row, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return _user_from_row(row)
+                self._remove(key)
+
+        if self.shared_cache is not None:
+            row = self.shared_cache.get(self.key_prefix + key)
+            if row is not None:
+                self._store(key, row, now)
+                with self._lock:
+                    self.shared_hits += 1
+                return _user_from_row(row)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, user, ttl=None):
+        # ttl caps the entry's lifetime below the cache's own TTL, e.g. at the expiry of the token
+        ttl = self.ttl if ttl is None else min(self.ttl, ttl)
+        row = _row_from_user(user)
+        self._store(key, row, time.monotonic(), ttl)
+        if self.shared_cache is not None:
+            self.shared_cache.set(self.key_prefix + key, row, ttl)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+        if self.shared_cache is not None:
+            self.shared_cache.delete(self.key_prefix + key)
+
+    def invalidate_user(self, user):
+        # Drops every cached token of the user, both locally and in the shared cache
+        self.invalidate_users([getattr(user, 'pk', user)])
+
+    def invalidate_users(self, user_ids):
+        # invalidate_user for many users, with one query per token model for the shared cache
+        keys = set()
+        with self._lock:
+            for user_id in user_ids:
+                keys.update(self._keys_by_user.get(user_id, ()))
+            for key in keys:
+                self._remove(key)
+        if self.shared_cache is not None:
+            # The rows SignedTokenAuthentication cached may have come from another process
+            keys.update(user_cache_key(user_id) for user_id in user_ids)
+            keys.update(Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True))
+            keys.update(DeviceToken.objects.filter(user_id__in=user_ids).values_list('key', flat=True))
+            self.shared_cache.delete_many([self.key_prefix + key for key in keys])
+
+    def clear(self):
+        # Drops every local entry and resets the counters
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _store(self, key, row, now, ttl=None):
+        user_id = row[0]
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (row, now + (self.ttl if ttl is None else ttl))
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        # Must be called with the lock held
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[0][0]
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+
+def user_cache_key(user_id):
+    # TokenCache key of the user row behind signed tokens, which have no key of their own
+    return 'user:{}'.format(user_id)
+
+
+def _field_names():
+    return [field.attname for field in User._meta.concrete_fields]
+
+
+def _row_from_user(user):
+    # The primary key comes first so entries can be indexed by user id
+    return tuple(getattr(user, name) for name in _field_names())
+
+
+def _user_from_row(row):
+    # A new instance per request, views mutate request.user so cached instances can't be shared
+    return User.from_db('default', _field_names(), row)
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache.from_settings()
+    return _token_cache
+
+
+def invalidate_saved_user(sender, instance, **kwargs):
+    """
+    post_save receiver for User. Whatever saved it, a view, the admin or a shell, the cached rows of this process and
+    the shared cache are dropped once the change commits, so no request reads the old row from the cache
+    """
+    user_id = instance.pk
+    transaction.on_commit(lambda: get_token_cache().invalidate_user(user_id))
+
+
+def invalidate_deleted_user(sender, instance, **kwargs):
+    # pre_delete receiver for User, before the cascade takes the token keys the shared cache is keyed on
+    get_token_cache().invalidate_user(instance)
+
+
+def _reload_token_cache(*args, **kwargs):
+    global _token_cache
+    if kwargs.get('setting') in ('ACCOUNT_TOKEN_CACHE', 'CACHES'):
+        _token_cache = None
+
+
+setting_changed.connect(_reload_token_cache)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that resolves the token -> user join through the TokenCache instead of hitting the
+    database on every request
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        user = cache.get(key)
+        if user is not None:
+            return user, Token(key=key, user=user)
+
+        try:
+            user, token = super().authenticate_credentials(key)
+        except exceptions.AuthenticationFailed:
+            # A token issued moments ago may not have reached the replicas yet
+            if not get_replica_conf()['ALIASES']:
+                raise
+            with primary():
+                user, token = super().authenticate_credentials(key)
+        cache.set(key, user)
+        return user, token
+
+
+def get_or_create_token(user):
+    # Reuses the token account.backends.EmailBackend loaded along with the user, inserting one on the first login
+    try:
+        return user.auth_token
+    except Token.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return Token.objects.create(user=user)
+    except IntegrityError:
+        # A concurrent login created it first
+        return Token.objects.get(user=user)
+
+
+async def aget_or_create_token(user):
+    # get_or_create_token for the async views, without a transaction since those are sync only
+    try:
+        return user.auth_token
+    except Token.DoesNotExist:
+        pass
+    try:
+        return await Token.objects.acreate(user=user)
+    except IntegrityError:
+        return await Token.objects.aget(user=user)
+
+
+def device_token_conf():
+    return dict(DEVICE_TOKEN_DEFAULTS, **getattr(settings, 'ACCOUNT_DEVICE_TOKENS', {}))
+
+
+def _renewed_expiry(token, now):
+    # A full TTL from now once RENEW_INTERVAL of the token's TTL has passed, else None so most uses write nothing
+    conf = device_token_conf()
+    expires = now + timedelta(seconds=conf['TTL'])
+    if not conf['SLIDING'] or expires - token.expires < timedelta(seconds=conf['RENEW_INTERVAL']):
+        return None
+    return expires
+
+
+def _check_device_token(token, now):
+    if token is None:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if token.expires <= now:
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+
+class DeviceTokenAuthentication(CachedTokenAuthentication):
+    """
+    `Authorization: Token <key>` against DeviceToken, a user holds one per device and each expires TTL after it
+    was issued or last renewed. Use slides the expiry, but only a cache miss past RENEW_INTERVAL writes, and cached
+    entries never outlive their token
+    """
+    model = DeviceToken
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        user = cache.get(key)
+        if user is not None:
+            return user, DeviceToken(key=key, user=user)
+
+        tokens = DeviceToken.objects.select_related('user').filter(key=key)
+        token = tokens.first()
+        if token is None and get_replica_conf()['ALIASES']:
+            # A token issued moments ago may not have reached the replicas yet
+            with primary():
+                token = tokens.first()
+        now = timezone.now()
+        _check_device_token(token, now)
+        expires = _renewed_expiry(token, now)
+        if expires is not None:
+            DeviceToken.objects.filter(pk=token.pk).update(expires=expires)
+            token.expires = expires
+        cache.set(key, token.user, (token.expires - now).total_seconds())
+        return token.user, token
+
+
+async def aauthenticate_device_token(key):
+    # DeviceTokenAuthentication for the async views, the active user or None
+    cache = get_token_cache()
+    user = cache.get(key)
+    if user is not None:
+        return user
+
+    tokens = DeviceToken.objects.select_related('user').filter(key=key)
+    token = await tokens.afirst()
+    if token is None and get_replica_conf()['ALIASES']:
+        token = await tokens.using(DEFAULT_DB_ALIAS).afirst()
+    now = timezone.now()
+    try:
+        _check_device_token(token, now)
+    except exceptions.AuthenticationFailed:
+        return None
+    expires = _renewed_expiry(token, now)
+    if expires is not None:
+        await DeviceToken.objects.filter(pk=token.pk).aupdate(expires=expires)
+        token.expires = expires
+    cache.set(key, token.user, (token.expires - now).total_seconds())
+    return token.user
+
+
+def issue_device_token(user, device=''):
+    """
+    The user's live token for the device, or a new one. A named device's token due for renewal is rotated: the new
+    key replaces it and the old one expires. Clients that name no device share one token, which is renewed in place,
+    rotating it would log the other clients out. Past MAX_DEVICES live tokens the ones expiring first are expired
+    """
+    now = timezone.now()
+    token = DeviceToken.objects.filter(user=user, device=device, expires__gt=now).order_by('-expires').first()
+    if token is not None:
+        expires = _renewed_expiry(token, now)
+        if expires is None:
+            return token
+        if not device:
+            DeviceToken.objects.filter(pk=token.pk).update(expires=expires)
+            token.expires = expires
+            return token
+    conf = device_token_conf()
+    new_token = DeviceToken.objects.create(key=DeviceToken.generate_key(), user=user, device=device,
+                                           expires=now + timedelta(seconds=conf['TTL']))
+    live = DeviceToken.objects.filter(user=user, expires__gt=now).order_by('-expires')
+    retired = list(live.values_list('key', flat=True)[conf['MAX_DEVICES']:])
+    if token is not None:
+        retired.append(token.key)
+    if retired:
+        DeviceToken.objects.filter(key__in=retired).update(expires=now)
+        _invalidate_keys(retired)
+    return new_token
+
+
+async def aissue_device_token(user, device=''):
+    # issue_device_token for the async views
+    now = timezone.now()
+    token = await DeviceToken.objects.filter(user=user, device=device, expires__gt=now).order_by('-expires').afirst()
+    if token is not None:
+        expires = _renewed_expiry(token, now)
+        if expires is None:
+            return token
+        if not device:
+            await DeviceToken.objects.filter(pk=token.pk).aupdate(expires=expires)
+            token.expires = expires
+            return token
+    conf = device_token_conf()
+    new_token = await DeviceToken.objects.acreate(key=DeviceToken.generate_key(), user=user, device=device,
+                                                  expires=now + timedelta(seconds=conf['TTL']))
+    live = DeviceToken.objects.filter(user=user, expires__gt=now).order_by('-expires')
+    retired = [key async for key in live.values_list('key', flat=True)[conf['MAX_DEVICES']:]]
+    if token is not None:
+        retired.append(token.key)
+    if retired:
+        await DeviceToken.objects.filter(key__in=retired).aupdate(expires=now)
+        _invalidate_keys(retired)
+    return new_token
+
+
+def _invalidate_keys(keys):
+    cache = get_token_cache()
+    for key in keys:
+        cache.invalidate(key)
+
+
+def _signed_token_conf():
+    return dict(SIGNED_TOKEN_DEFAULTS, **getattr(settings, 'ACCOUNT_SIGNED_TOKENS', {}))
+
+
+def issue_token_pair(user):
+    # A short lived access token and a long lived refresh token, both bound to the user's current token_version
+    return {
+        'access': signing.dumps([user.pk, user.token_version, 'access'], salt=SIGNED_TOKEN_SALT),
+        'refresh': signing.dumps([user.pk, user.token_version, 'refresh'], salt=SIGNED_TOKEN_SALT),
+    }
+
+
+def read_signed_token(token, token_type):
+    """
+    Checks the signature and expiry of a token, pure CPU, returning (user id, token version) or raising
+    AuthenticationFailed
+    """
+    max_age = _signed_token_conf()['ACCESS_TTL' if token_type == 'access' else 'REFRESH_TTL']
+    try:
+        user_id, version, kind = signing.loads(token, salt=SIGNED_TOKEN_SALT, max_age=max_age)
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if kind != token_type:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    return user_id, version
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Stateless alternative to TokenAuthentication: `Authorization: Bearer <access token>`, where the token is signed
+    with SECRET_KEY and expires after ACCESS_TTL. The user row comes from the TokenCache, so a valid token costs no
+    query on a hit, and a token_version bump (password change, deactivation) revokes older tokens. Other processes
+    honour the revocation once their cached row expires, after the TokenCache TTL at most
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        user_id, version = read_signed_token(token, 'access')
+        user = self.get_user(user_id)
+        if user is None or not user.is_active or user.token_version != version:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        return user, token
+
+    def get_user(self, user_id):
+        cache = get_token_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = User.objects.filter(pk=user_id).first()
+            if user is not None:
+                cache.set(key, user)
+        return user
+
+    def authenticate_header(self, request):
+        return self.keyword
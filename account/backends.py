@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.utils import timezone
+
+from .models import User
+
+DEFAULTS = {
+    'LAST_LOGIN_INTERVAL': 300,
+}
+
+
+class EmailBackend(ModelBackend):
+    """
+    ModelBackend that matches the email case insensitively and loads the user together with its auth token in a
+    single query, so issuing the token after a successful login doesn't go back to the database
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = User._default_manager.select_related('auth_token').with_email(username).order_by('id').first()
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    Replaces django.contrib.auth's user_logged_in receiver, last_login is only written once it is older than
+    LAST_LOGIN_INTERVAL seconds and then only that column
+    """
+    if not last_login_is_stale(user):
+        return
+    user.last_login = timezone.now()
+    user.save(update_fields=['last_login'])
+
+
+def last_login_is_stale(user):
+    interval = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_LOGIN', {}))['LAST_LOGIN_INTERVAL']
+    return user.last_login is None or timezone.now() - user.last_login >= timedelta(seconds=interval)
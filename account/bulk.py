@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .authentication import get_token_cache
+from .models import DeviceToken
+from .storage import release
+
+ACTIONS = ('deactivate', 'reactivate', 'update')
+# Fields the update action may set, none of them is unique or feeds a token
+PATCHABLE_FIELDS = ('first_name', 'last_name', 'gender', 'is_staff')
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def targets(queryset, action):
+    # The users of the queryset the action would change, deactivating the inactive ones is a no-op and vice versa
+    if action == 'deactivate':
+        return queryset.filter(is_active=True)
+    if action == 'reactivate':
+        return queryset.filter(is_active=False)
+    return queryset
+
+
+def bulk_apply(queryset, action, fields=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Applies the action to the users of `queryset` (a User.all_with_inactive queryset) chunk_size ids at a time, each
+    chunk a single UPDATE ... WHERE id IN (...) in its own transaction together with revoking the tokens of the
+    users it deactivated. No model instance is loaded. Returns the number of users updated and tokens revoked
+    """
+    if action not in ACTIONS:
+        raise ValueError('Unknown action {}, expected one of {}'.format(action, ', '.join(ACTIONS)))
+    queryset = targets(queryset, action)
+    counts = {'updated': 0, 'revoked_tokens': 0}
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        with transaction.atomic():
+            # The filter is evaluated again in the UPDATE, users changed since the SELECT are left alone
+            updated, revoked = _apply_chunk(queryset.filter(pk__in=ids), action, fields, timezone.now())
+        counts['updated'] += updated
+        counts['revoked_tokens'] += revoked
+        get_token_cache().invalidate_users(ids)
+    return counts
+
+
+def _apply_chunk(chunk, action, fields, now):
+    # Every action changes the serialized profile, so the ETags of users/me/ and users/{id}/ move on as well
+    values = {'profile_version': F('profile_version') + 1, 'profile_modified': now}
+    if action == 'update':
+        return chunk.update(**dict(fields, **values)), 0
+    if action == 'reactivate':
+        return chunk.update(is_active=True, deactivated_at=None, **values), 0
+
+    # Deactivating mirrors UserRelatedView.deactivate: the avatar reference is dropped and every token revoked
+    images = list(chunk.exclude(image='').exclude(image=None).values_list('image', flat=True))
+    # Before the users' UPDATE, which takes them out of the chunk's is_active filter
+    revoked = DeviceToken.objects.filter(user__in=chunk, expires__gt=now).update(expires=now)
+    updated = chunk.update(is_active=False, deactivated_at=now, image=None, image_variants={}, image_width=None,
+                           image_height=None, token_version=F('token_version') + 1, **values)
+    for name in images:
+        release(name)
+    return updated, revoked
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .serializers import UserRowSerializer
+
+DEFAULTS = {
+    'PAYLOAD_CACHE': False,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'account:profile:',
+    'TTL': 300,
+}
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'ACCOUNT_PROFILE_CACHE', {}))
+
+
+def user_etag(user):
+    return '"{}-{}"'.format(user.pk, user.profile_version)
+
+
+def _representation(request, user):
+    conf = _conf()
+    if not conf['PAYLOAD_CACHE']:
+        return UserRowSerializer(request=request).instance(user)
+
+    # Keyed on the version, so an update makes the old entry unreachable instead of having to delete it. Image URLs
+    # are absolute, hence the host
+    cache = caches[conf['CACHE_ALIAS']]
+    key = '{}{}:{}:{}'.format(conf['KEY_PREFIX'], user.pk, user.profile_version, request.get_host())
+    data = cache.get(key)
+    if data is None:
+        data = UserRowSerializer(request=request).instance(user)
+        cache.set(key, data, conf['TTL'])
+    return data
+
+
+def not_modified(request, user):
+    # A 304 when the client's If-None-Match or If-Modified-Since still matches the user's profile_version
+    last_modified = user.profile_modified or user.date_joined
+    return get_conditional_response(request, etag=user_etag(user), last_modified=int(last_modified.timestamp()))
+
+
+def set_validators(response, user):
+    response['ETag'] = user_etag(user)
+    response['Last-Modified'] = http_date((user.profile_modified or user.date_joined).timestamp())
+    # The payload is per user and may change any time, clients keep it but revalidate before every use
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def profile_response(request, user):
+    # Response for a GET of a single user, the serializer only runs when the client's copy is out of date
+    response = not_modified(request, user)
+    if response is None:
+        response = Response(_representation(request, user))
+    return set_validators(response, user)
@@ -0,0 +1,205 @@
+"""
+Per process Bloom filter of every user's lowercased email. A miss proves no user has the email, so signup and
+users/email_available/ skip their existence query; a hit only means one might, and the database decides. The
+email's unique constraint stays the source of truth for what another worker created in between
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Sized for at least this many emails, or twice the users there are when it is built
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.01,
+    # Seconds between catching up on the users other processes created or renamed, None to never
+    'REFRESH_INTERVAL': 5,
+    'CHUNK_SIZE': 10000,
+}
+
+# The catch up re-reads users joined or modified this long before the last one started, date_joined and
+# profile_modified are set before their transaction commits
+CATCH_UP_SLACK = timedelta(seconds=60)
+
+
+def bloom_parameters(capacity, error_rate):
+    # (bits, hashes) of the smallest filter holding `capacity` items at `error_rate` false positives
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+class EmailFilter:
+    """
+    Until build() finished every email "might" be taken, so a filter that is still loading, or failed to, only
+    costs the queries it would have saved
+    """
+
+    def __init__(self, capacity=DEFAULTS['CAPACITY'], error_rate=DEFAULTS['ERROR_RATE'],
+                 refresh_interval=DEFAULTS['REFRESH_INTERVAL'], chunk_size=DEFAULTS['CHUNK_SIZE']):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.chunk_size = chunk_size
+        self.ready = False
+        self.items = 0
+        self._synced_at = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._catch_up_lock = threading.Lock()
+        self._counters = {'negatives': 0, 'positives': 0}
+        self._allocate(capacity)
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_EMAIL_FILTER', {}))
+        return cls(conf['CAPACITY'], conf['ERROR_RATE'], conf['REFRESH_INTERVAL'], conf['CHUNK_SIZE'])
+
+    def add(self, email):
+        with self._lock:
+            # Under the lock, build() may be swapping in a bigger bit array
+            positions = self._positions(email)
+            bits = self._bits
+            for position in positions:
+                bits[position >> 3] |= 1 << (position & 7)
+            self.items += 1
+
+    def might_contain(self, email):
+        if not self.ready:
+            return True
+        self._maybe_catch_up()
+        bits = self._bits
+        found = all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(email))
+        self._counters['positives' if found else 'negatives'] += 1
+        return found
+
+    def build(self):
+        # Streams every email from the users table, inactive users' included since they still hold theirs
+        from .models import User
+
+        self.ready = False
+        started = timezone.now()
+        self._allocate(max(self.capacity, 2 * User.all_with_inactive.count()))
+        for email in User.all_with_inactive.values_list('email', flat=True).iterator(chunk_size=self.chunk_size):
+            self.add(email)
+        self._synced_at = started
+        self._checked_at = time.monotonic()
+        self.ready = True
+
+    def start(self):
+        # Builds in a daemon thread, so a worker with millions of users isn't held up at boot
+        thread = threading.Thread(target=self._build_in_background, name='account-email-filter', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        return dict(self._counters, items=self.items, bits=self.bits, hashes=self.hashes, bytes=len(self._bits),
+                    ready=self.ready)
+
+    def _allocate(self, capacity):
+        bits, hashes = bloom_parameters(capacity, self.error_rate)
+        with self._lock:
+            self.bits, self.hashes = bits, hashes
+            self._bits = bytearray((bits + 7) // 8)
+            self.items = 0
+
+    def _positions(self, email):
+        # Double hashing, the k positions are h1 + i * h2 of one 128 bit digest
+        digest = hashlib.blake2b(email.lower().encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def _maybe_catch_up(self):
+        """
+        Adds the emails other processes created or changed since the last sync, at most once per refresh_interval.
+        New users come from the active_user_joined_idx partial index, changed emails through the profile_modified
+        that User.save() and deactivation set, user_profile_modified_idx covering inactive users too
+        """
+        if self.refresh_interval is None or time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        if not self._catch_up_lock.acquire(blocking=False):
+            return
+        try:
+            from .models import User
+
+            self._checked_at = time.monotonic()
+            started = timezone.now()
+            since = self._synced_at - CATCH_UP_SLACK
+            for queryset in (User.objects.filter(date_joined__gte=since),
+                             User.all_with_inactive.filter(profile_modified__gte=since)):
+                for email in queryset.values_list('email', flat=True):
+                    self.add(email)
+            self._synced_at = started
+        finally:
+            self._catch_up_lock.release()
+
+    def _build_in_background(self):
+        try:
+            started = time.perf_counter()
+            self.build()
+            logger.info('Email filter built with %d emails in %.1fs', self.items, time.perf_counter() - started)
+        except Exception:
+            logger.exception('Building the email filter failed')
+        finally:
+            connections.close_all()
+
+
+_email_filter = None
+_email_filter_lock = threading.Lock()
+
+
+def get_email_filter():
+    """
+    The process' EmailFilter, or None when ACCOUNT_EMAIL_FILTER is disabled. It is empty and not ready until
+    start_email_filter() built it
+    """
+    global _email_filter
+    if not dict(DEFAULTS, **getattr(settings, 'ACCOUNT_EMAIL_FILTER', {}))['ENABLED']:
+        return None
+    if _email_filter is None:
+        with _email_filter_lock:
+            if _email_filter is None:
+                _email_filter = EmailFilter.from_settings()
+    return _email_filter
+
+
+def start_email_filter():
+    # Called by account.warmup at boot
+    email_filter = get_email_filter()
+    if email_filter is not None:
+        return email_filter.start()
+
+
+def email_might_exist(email):
+    email_filter = get_email_filter()
+    return email_filter is None or email_filter.might_contain(email)
+
+
+def remember_email(sender, instance, update_fields=None, **kwargs):
+    # post_save receiver for User, the emails of new and renamed users are added as they are saved
+    if update_fields is not None and 'email' not in update_fields:
+        return
+    email_filter = get_email_filter()
+    if email_filter is not None and instance.email:
+        email_filter.add(instance.email)
+
+
+def _reload_email_filter(*args, **kwargs):
+    global _email_filter
+    if kwargs.get('setting') == 'ACCOUNT_EMAIL_FILTER':
+        _email_filter = None
+
+
+setting_changed.connect(_reload_email_filter)
@@ -0,0 +1,103 @@
+import csv
+import io
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date, parse_datetime
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# A compressed export is a .gz download, not a transfer encoding clients should undo on the way in
+GZIP_CONTENT_TYPE = 'application/gzip'
+# Never export the password hash
+EXPORT_FIELDS = ['id', 'email', 'first_name', 'last_name', 'gender', 'image', 'is_active', 'is_staff',
+                 'is_superuser', 'date_joined', 'last_login']
+DEFAULT_CHUNK_SIZE = 2000
+# Rows are encoded into buffers of about this many bytes before being yielded
+BUFFER_SIZE = 64 * 1024
+
+
+def parse_filters(params):
+    """
+    Reads is_active, gender, email_domain, joined_after and joined_before out of a query dict / options mapping
+    into filter() keyword arguments, raising ValueError on bad input
+    """
+    filters = {}
+    is_active = params.get('is_active')
+    if is_active not in (None, ''):
+        value = str(is_active).lower()
+        if value not in ('true', 'false', '1', '0'):
+            raise ValueError('is_active must be true or false')
+        filters['is_active'] = value in ('true', '1')
+
+    gender = params.get('gender')
+    if gender:
+        filters['gender'] = gender
+
+    email_domain = params.get('email_domain')
+    if email_domain:
+        filters['email__iendswith'] = '@' + email_domain.lstrip('@')
+
+    for param, lookup in (('joined_after', 'date_joined__gte'), ('joined_before', 'date_joined__lt')):
+        value = params.get(param)
+        if value:
+            parsed = parse_datetime(value) or parse_date(value)
+            if parsed is None:
+                raise ValueError('{} must be an ISO date or datetime'.format(param))
+            filters[lookup] = parsed
+    return filters
+
+
+def iter_export(queryset, fmt='ndjson', chunk_size=DEFAULT_CHUNK_SIZE, compress=False):
+    # Yields the encoded export in BUFFER_SIZE pieces, only chunk_size rows are ever fetched at once
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format {}, expected one of {}'.format(fmt, ', '.join(FORMATS)))
+
+    rows = queryset.order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    chunks = _buffered(_encode_csv(rows) if fmt == 'csv' else _encode_ndjson(rows))
+    return _gzip(chunks) if compress else chunks
+
+
+def _encode_ndjson(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+
+def _encode_csv(rows):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+
+
+def _buffered(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _gzip(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_filename(fmt, compress=False):
+    return 'users.{}{}'.format(fmt, '.gz' if compress else '')
@@ -0,0 +1,117 @@
+"""
+Password hash cost per deployment. PASSWORD_HASHERS prefers ProfilePBKDF2PasswordHasher, whose iteration count comes
+from the ACCOUNT_PASSWORD_HASHING profile; a stored hash with any other count is rehashed on its user's next
+successful login (account.hashing), so changing the profile migrates hashes as users come back
+"""
+
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.crypto import get_random_string
+
+# PBKDF2-SHA256 iterations per profile. standard is Django 4.2's own count, fast is for hardware where logins can't
+# afford it, strong doubles it
+PROFILES = {
+    'fast': 200000,
+    'standard': 600000,
+    'strong': 1200000,
+}
+
+DEFAULTS = {
+    'PROFILE': 'standard',
+    # Overrides the profile's count, e.g. with the one `manage.py calibrate_hasher` picked
+    'ITERATIONS': None,
+}
+
+# PBKDF2 under this many iterations isn't offered, whatever the calibration measured
+MIN_ITERATIONS = 100000
+
+
+def profile_iterations(conf=None):
+    conf = dict(DEFAULTS, **(conf if conf is not None else getattr(settings, 'ACCOUNT_PASSWORD_HASHING', {})))
+    if conf['ITERATIONS']:
+        return conf['ITERATIONS']
+    if conf['PROFILE'] not in PROFILES:
+        raise ValueError('Unknown password hashing profile {!r}, expected one of {}'.format(
+            conf['PROFILE'], ', '.join(PROFILES)))
+    return PROFILES[conf['PROFILE']]
+
+
+class ProfilePBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the iterations of the configured profile. Same algorithm name, so it reads
+    every hash the stock hasher wrote and must_update() flags those with another count
+    """
+
+    @property
+    def iterations(self):
+        return profile_iterations()
+
+
+def needs_rehash(encoded):
+    # Mirrors the rehash decision of django.contrib.auth.hashers.check_password
+    preferred = hashers.get_hasher('default')
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def hash_cost(encoded):
+    # (algorithm, cost) of a stored hash, cost being what its hasher's decode() reports about the work it does
+    if not encoded or not hashers.is_password_usable(encoded):
+        return 'unusable', ''
+    algorithm = encoded.split('$', 1)[0]
+    try:
+        decoded = hashers.identify_hasher(encoded).decode(encoded)
+    except (ValueError, ImportError, AssertionError):
+        # Unknown algorithm or its library isn't installed here
+        return algorithm, '?'
+    cost = ['{}={}'.format(name, decoded[name])
+            for name in ('iterations', 'work_factor', 'time_cost', 'memory_cost', 'block_size', 'parallelism')
+            if name in decoded]
+    return algorithm, ' '.join(cost)
+
+
+def hash_report(queryset, chunk_size=2000):
+    """
+    Streams the password column of `queryset` and counts users per (algorithm, cost), together with how many will
+    be rehashed on their next login
+    """
+    distribution = Counter()
+    outdated = 0
+    for encoded in queryset.order_by().values_list('password', flat=True).iterator(chunk_size=chunk_size):
+        distribution[hash_cost(encoded)] += 1
+        if hashers.is_password_usable(encoded) and needs_rehash(encoded):
+            outdated += 1
+    return {'total': sum(distribution.values()), 'outdated': outdated, 'distribution': distribution}
+
+
+def time_hash(iterations, samples=3):
+    # Best of `samples` PBKDF2-SHA256 hashes at `iterations`, in seconds
+    hasher = hashers.PBKDF2PasswordHasher()
+    password, salt = get_random_string(16), hasher.salt()
+    best = None
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.encode(password, salt, iterations)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target_seconds, samples=3, probe_iterations=50000):
+    """
+    The PBKDF2 iteration count whose hash takes about `target_seconds` on this machine. The cost is linear in the
+    iterations, so one probe gives the estimate and a second run at the estimate corrects for the probe's overhead.
+    Returns (iterations, measured seconds)
+    """
+    per_iteration = time_hash(probe_iterations, samples) / probe_iterations
+    iterations = max(MIN_ITERATIONS, int(target_seconds / per_iteration))
+    measured = time_hash(iterations, samples)
+    # Rounded to a thousand, the count ends up in settings
+    iterations = max(MIN_ITERATIONS, int(round(iterations * target_seconds / measured, -3)))
+    return iterations, time_hash(iterations, samples)
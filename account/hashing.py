@@ -0,0 +1,220 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, status
+
+from . import metrics
+from .hashers import needs_rehash
+
+DEFAULTS = {
+    'POOL_ENABLED': False,
+    'WORKERS': None,
+    'MAX_PENDING': 32,
+    'RETRY_AFTER': 1,
+    # Of the MAX_PENDING jobs, imports keep at most this many in flight so logins and signups get the rest
+    'IMPORT_MAX_PENDING': 8,
+}
+
+
+class HashingBusy(exceptions.APIException):
+    # Raised instead of queueing when every slot of the hashing pool is taken, DRF turns `wait` into Retry-After
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many password operations in progress, try again later')
+    default_code = 'hashing_busy'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+def _init_worker(settings_module):
+    # Workers may be spawned rather than forked, so they need their own configured Django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def _verify(raw_password, encoded):
+    # Runs in a worker, the setter (rehash + save) needs the database so it stays in the parent process
+    return hashers.check_password(raw_password, encoded)
+
+
+def make_hashing_executor(workers=None):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'Task1.settings'),),
+    )
+
+
+class HashingPool:
+    """
+    A process pool for PBKDF2 and friends with a bounded number of pending jobs, once `max_pending` jobs are in
+    flight new submissions fail fast with HashingBusy instead of piling up in an unbounded queue
+    """
+
+    def __init__(self, workers=None, max_pending=DEFAULTS['MAX_PENDING'], retry_after=DEFAULTS['RETRY_AFTER'],
+                 import_max_pending=DEFAULTS['IMPORT_MAX_PENDING']):
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Always leaves a slot for the requests, unless there is only one
+        self._import_slots = threading.BoundedSemaphore(max(1, min(import_max_pending, max_pending - 1)))
+        self._executor = make_hashing_executor(workers)
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_HASHING', {}))
+        return cls(workers=conf['WORKERS'], max_pending=conf['MAX_PENDING'], retry_after=conf['RETRY_AFTER'],
+                   import_max_pending=conf['IMPORT_MAX_PENDING'])
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy(wait=self.retry_after)
+        return self._submit(fn, *args)
+
+    def map(self, fn, items):
+        """
+        For batch work like imports, which waits for free slots rather than failing half way through. Every batch
+        together holds at most import_max_pending slots, the others stay free for submit()
+        """
+        futures = []
+        for item in items:
+            self._import_slots.acquire()
+            self._slots.acquire()
+            try:
+                future = self._submit(fn, item)
+            except BaseException:
+                self._import_slots.release()
+                raise
+            future.add_done_callback(lambda f: self._import_slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _submit(self, fn, *args):
+        # The caller holds a slot, released once the job is done
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_hashing_pool = None
+_hashing_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    # Returns the shared pool, or None when hashing runs inline in the calling thread
+    global _hashing_pool
+    if not dict(DEFAULTS, **getattr(settings, 'ACCOUNT_HASHING', {}))['POOL_ENABLED']:
+        return None
+    with _hashing_pool_lock:
+        if _hashing_pool is None:
+            _hashing_pool = HashingPool.from_settings()
+        return _hashing_pool
+
+
+_import_pool = None
+
+
+def get_import_pool():
+    """
+    Where imports hash: the shared pool when it is enabled, else a pool of their own, so that a big upload is still
+    hashed across processes rather than on the request thread
+    """
+    global _import_pool
+    pool = get_hashing_pool()
+    if pool is not None:
+        return pool
+    with _hashing_pool_lock:
+        if _import_pool is None:
+            _import_pool = HashingPool.from_settings()
+        return _import_pool
+
+
+def _reload_hashing_pool(*args, **kwargs):
+    global _hashing_pool, _import_pool
+    if kwargs.get('setting') != 'ACCOUNT_HASHING':
+        return
+    for pool in (_hashing_pool, _import_pool):
+        if pool is not None:
+            pool.shutdown(wait=False)
+    _hashing_pool = _import_pool = None
+
+
+setting_changed.connect(_reload_hashing_pool)
+
+_thread_executor = None
+
+
+def get_thread_executor():
+    """
+    Runs the async views' hashes when the pool is disabled. Not the event loop's default executor, where a burst of
+    logins would queue ahead of everything else handed to it (asgiref's thread_sensitive=False calls, getaddrinfo)
+    """
+    global _thread_executor
+    with _hashing_pool_lock:
+        if _thread_executor is None:
+            _thread_executor = ThreadPoolExecutor(thread_name_prefix='account-hashing')
+        return _thread_executor
+
+
+def hash_password(raw_password):
+    pool = get_hashing_pool()
+    with metrics.timed('hash_seconds'):
+        if pool is None:
+            return hashers.make_password(raw_password)
+        return pool.submit(hashers.make_password, raw_password).result()
+
+
+def hash_passwords(raw_passwords):
+    # Hashes a batch across processes, within the import share of get_import_pool()
+    with metrics.timed('hash_seconds'):
+        return get_import_pool().map(hashers.make_password, raw_passwords)
+
+
+def verify_password(raw_password, encoded, setter=None):
+    # Same contract as django.contrib.auth.hashers.check_password
+    pool = get_hashing_pool()
+    with metrics.timed('hash_seconds'):
+        if pool is None:
+            return hashers.check_password(raw_password, encoded, setter)
+        is_correct = pool.submit(_verify, raw_password, encoded).result()
+    _upgrade(raw_password, encoded, setter, is_correct)
+    return is_correct
+
+
+async def ahash_password(raw_password):
+    pool = get_hashing_pool()
+    with metrics.timed('hash_seconds'):
+        if pool is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_thread_executor(), hashers.make_password, raw_password)
+        return await asyncio.wrap_future(pool.submit(hashers.make_password, raw_password))
+
+
+async def averify_password(raw_password, encoded):
+    # Verification only, callers on the async path decide themselves whether to rehash
+    pool = get_hashing_pool()
+    with metrics.timed('hash_seconds'):
+        if pool is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_thread_executor(), hashers.check_password, raw_password, encoded)
+        return await asyncio.wrap_future(pool.submit(_verify, raw_password, encoded))
+
+
+def _upgrade(raw_password, encoded, setter, is_correct):
+    if is_correct and setter is not None and needs_rehash(encoded):
+        setter(raw_password)
@@ -0,0 +1,153 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': 2,
+    'VARIANTS': {'thumb': 64, 'small': 256, 'medium': 512},
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+}
+
+# Leading bytes of the formats we accept, checked instead of decoding the upload inside the request
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def _conf():
+    return dict(DEFAULTS, **getattr(settings, 'ACCOUNT_IMAGES', {}))
+
+
+def sniff_format(upload):
+    # Returns the image format from the file header, or None, leaving the file position untouched
+    position = upload.tell()
+    header = upload.read(12)
+    upload.seek(position)
+    for signature, fmt in SIGNATURES:
+        if header.startswith(signature):
+            return fmt
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def variant_name(name, variant, fmt):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return os.path.join(os.path.dirname(name), 'variants', '{}_{}.{}'.format(stem, variant, fmt.lower()))
+
+
+def variant_names(name):
+    conf = _conf()
+    return [variant_name(name, variant, conf['FORMAT']) for variant in conf['VARIANTS']]
+
+
+def process_image(name):
+    """
+    Decodes the stored original once, writes an EXIF free resized copy per configured variant and records the
+    dimensions and variant names on every user still pointing at that image
+    """
+    from PIL import Image, ImageOps
+
+    from .authentication import get_token_cache
+    from .models import User
+
+    conf = _conf()
+    with User._meta.get_field('image').storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    width, height = image.size
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    variants = {}
+    for variant, size in sorted(conf['VARIANTS'].items(), key=lambda item: item[1]):
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        # A fresh encode carries no EXIF block, so location and camera data are dropped here
+        resized.save(buffer, conf['FORMAT'], quality=conf['QUALITY'])
+        target = variant_name(name, variant, conf['FORMAT'])
+        if default_storage.exists(target):
+            default_storage.delete(target)
+        variants[variant] = default_storage.save(target, ContentFile(buffer.getvalue()))
+
+    # Content addressed names make the variants a property of the blob, so every user sharing it gets them
+    users = User.all_with_inactive.filter(image=name)
+    user_ids = list(users.values_list('id', flat=True))
+    users.update(image_width=width, image_height=height, image_variants=variants,
+                 profile_version=F('profile_version') + 1, profile_modified=timezone.now())
+    cache = get_token_cache()
+    for user_id in user_ids:
+        cache.invalidate_user(user_id)
+    return variants
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_conf()['WORKERS'], thread_name_prefix='account-images')
+        return _executor
+
+
+def _reload_executor(*args, **kwargs):
+    global _executor
+    if kwargs.get('setting') == 'ACCOUNT_IMAGES' and _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+setting_changed.connect(_reload_executor)
+
+
+def shutdown_image_workers(wait=True):
+    # Lets a process exit (or a test finish) only once every queued upload has been processed
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def _process_logged(name):
+    # Nobody waits on the future, so failures would vanish without this
+    try:
+        process_image(name)
+    except Exception:
+        logger.exception('Processing image %s failed', name)
+
+
+def schedule_image_processing(user):
+    # Queues the variants once the upload is committed, WORKERS = 0 processes inline on commit instead
+    if not user.image:
+        return
+    name = user.image.name
+
+    def submit():
+        if _conf()['WORKERS'] == 0:
+            process_image(name)
+        else:
+            _get_executor().submit(_process_logged, name)
+
+    transaction.on_commit(submit)
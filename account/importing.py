@@ -0,0 +1,138 @@
+import csv
+import itertools
+import json
+from contextlib import contextmanager, nullcontext
+
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from .hashing import make_hashing_executor
+from .models import User
+from .serializers import ImportUserSerializer
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 1000
+# Row errors a bulk_create_users response lists at most, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def guess_format(name):
+    # Picks the input format from a file name, defaulting to csv
+    if name and name.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(stream, fmt='csv'):
+    # Lazily yields (line number, row dict) from a text stream so the whole file is never held in memory
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format {}, expected one of {}'.format(fmt, ', '.join(FORMATS)))
+
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            row = exc
+        yield line_number, row
+
+
+def import_users(rows, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, hash_many=None):
+    """
+    Validates, hashes and inserts the rows chunk by chunk, yielding a (created, errors) pair per chunk where
+    errors is a list of {'line': ..., 'errors': ...} dicts, bad rows never abort the rest of their chunk.
+    hash_many(passwords) returns their hashes, by default from a process pool of `workers` started for this import
+    """
+    with _hasher(workers) if hash_many is None else nullcontext(hash_many) as hash_many:
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield _import_chunk(chunk, hash_many)
+
+
+@contextmanager
+def _hasher(workers):
+    # workers=0 hashes inline, handy for tests and tiny files
+    if workers == 0:
+        yield lambda passwords: [make_password(password) for password in passwords]
+        return
+    executor = make_hashing_executor(workers)
+    try:
+        yield lambda passwords: list(executor.map(make_password, passwords,
+                                                  chunksize=max(1, len(passwords) // 32)))
+    finally:
+        executor.shutdown()
+
+
+def _import_chunk(chunk, hash_many):
+    errors = []
+    valid = []
+    seen = set()
+    for line_number, row in chunk:
+        if not isinstance(row, dict):
+            errors.append({'line': line_number, 'errors': {'non_field_errors': ['Malformed row']}})
+            continue
+        serializer = ImportUserSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append({'line': line_number, 'errors': serializer.errors})
+            continue
+        data = serializer.validated_data
+        data['email'] = User.objects.normalize_email(data['email'])
+        # Emails are compared case insensitively, like logins look them up
+        if data['email'].lower() in seen:
+            errors.append({'line': line_number, 'errors': {'email': ['Duplicate email in this file']}})
+            continue
+        seen.add(data['email'].lower())
+        valid.append((line_number, data))
+
+    # Deactivated users keep their email, so they count as well
+    existing = set()
+    if seen:
+        existing = set(email.lower() for email in
+                       User.all_with_inactive.with_email(*seen).values_list('email', flat=True))
+    if existing:
+        for line_number, data in valid:
+            if data['email'].lower() in existing:
+                errors.append({'line': line_number, 'errors': {'email': ['User with this email already exists']}})
+        valid = [(line_number, data) for line_number, data in valid if data['email'].lower() not in existing]
+
+    hashes = hash_many([data['password'] for line_number, data in valid])
+
+    users = []
+    for (line_number, data), encoded in zip(valid, hashes):
+        data['password'] = encoded
+        users.append((line_number, User(**data)))
+
+    created = _insert(users, errors)
+    errors.sort(key=lambda error: error['line'])
+    return created, errors
+
+
+def _insert(users, errors):
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create([user for line_number, user in users])
+        return len(users)
+    except IntegrityError:
+        pass
+
+    # Someone inserted one of the emails since the existence check, fall back to row by row for this chunk
+    created = 0
+    for line_number, user in users:
+        try:
+            with transaction.atomic():
+                user.save(force_insert=True)
+            created += 1
+        except IntegrityError as exc:
+            errors.append({'line': line_number, 'errors': {'non_field_errors': [str(exc)]}})
+    return created
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.hashers import PROFILES, calibrate, profile_iterations, time_hash
+
+
+class Command(BaseCommand):
+    help = ('Picks the PBKDF2 iteration count whose hash takes --target-ms on this machine, run it on the hardware '
+            'that serves logins and put the count in ACCOUNT_PASSWORD_HASHING["ITERATIONS"]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=250, help='Wanted time per hash')
+        parser.add_argument('--samples', type=int, default=3, help='Hashes timed per measurement, the best counts')
+
+    def handle(self, *args, **options):
+        if options['target_ms'] <= 0 or options['samples'] < 1:
+            raise CommandError('--target-ms and --samples must be positive')
+
+        self.stdout.write('{:<12} {:>12} {:>10}'.format('profile', 'iterations', 'ms'))
+        for name, iterations in PROFILES.items():
+            self.stdout.write('{:<12} {:>12} {:>10.1f}'.format(
+                name, iterations, time_hash(iterations, options['samples']) * 1000))
+        self.stdout.write('Current setting: {} iterations'.format(profile_iterations()))
+
+        iterations, seconds = calibrate(options['target_ms'] / 1000, samples=options['samples'])
+        self.stdout.write(self.style.SUCCESS('{} iterations take {:.1f}ms, set ACCOUNT_PASSWORD_HASHING = '
+                                             '{{"ITERATIONS": {}}}'.format(iterations, seconds * 1000, iterations)))
@@ -0,0 +1,47 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.exporting import DEFAULT_CHUNK_SIZE, FORMATS, iter_export, parse_filters
+from account.models import User
+
+
+class Command(BaseCommand):
+    help = 'Streams the users table as NDJSON or CSV with constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', '-o', help='File to write, defaults to stdout')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output on the fly')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Rows fetched from the database per round trip')
+        parser.add_argument('--is-active', dest='is_active', choices=['true', 'false'])
+        parser.add_argument('--gender', choices=[choice for choice, label in User.GENDER_CHOICES])
+        parser.add_argument('--email-domain', dest='email_domain', help='Only users with an email at this domain')
+        parser.add_argument('--joined-after', dest='joined_after', help='ISO date or datetime, inclusive')
+        parser.add_argument('--joined-before', dest='joined_before', help='ISO date or datetime, exclusive')
+
+    def handle(self, *args, **options):
+        try:
+            queryset = User.all_with_inactive.filter(**parse_filters(options))
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        rows = queryset.count()
+        chunks = iter_export(queryset, options['format'], chunk_size=options['chunk_size'],
+                             compress=options['gzip'])
+        begin = time.perf_counter()
+        if options['output']:
+            with open(options['output'], 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+        else:
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+        elapsed = time.perf_counter() - begin
+
+        self.stderr.write('{} rows exported in {:.2f}s ({:.0f} rows/s)'.format(
+            rows, elapsed, rows / elapsed if elapsed else 0))
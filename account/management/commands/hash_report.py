@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from account.hashers import hash_report, profile_iterations
+from account.models import User
+
+
+class Command(BaseCommand):
+    help = ('Streams the users table and reports how many password hashes use each algorithm and cost, and how many '
+            'will be rehashed on their next login')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched from the database per round trip')
+
+    def handle(self, *args, **options):
+        report = hash_report(User.all_with_inactive.all(), chunk_size=options['chunk_size'])
+        total = report['total']
+        self.stdout.write('Preferred: pbkdf2_sha256 iterations={}'.format(profile_iterations()))
+        self.stdout.write('{:<24} {:<32} {:>10} {:>8}'.format('algorithm', 'cost', 'users', 'share'))
+        for (algorithm, cost), count in report['distribution'].most_common():
+            self.stdout.write('{:<24} {:<32} {:>10} {:>8.1%}'.format(algorithm, cost, count, count / total))
+        self.stdout.write(self.style.SUCCESS('{} of {} users will be rehashed on their next login'.format(
+            report['outdated'], total)))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.importing import DEFAULT_CHUNK_SIZE, FORMATS, guess_format, import_users, iter_rows
+
+
+class Command(BaseCommand):
+    help = 'Streams users from a CSV or JSONL file into the database in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or JSONL file, one user per row')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to a guess from the file extension')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Rows validated and inserted per transaction')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Password hashing processes, 0 hashes inline (defaults to the CPU count)')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        created = failed = 0
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as stream:
+                results = import_users(iter_rows(stream, fmt), chunk_size=options['chunk_size'],
+                                       workers=options['workers'])
+                for chunk_created, errors in results:
+                    created += chunk_created
+                    failed += len(errors)
+                    for error in errors:
+                        self.stderr.write('line {}: {}'.format(error['line'], json.dumps(error['errors'])))
+                    if options['verbosity'] > 1:
+                        self.stdout.write('{} users created so far'.format(created))
+        except OSError as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(self.style.SUCCESS('{} users created, {} rows rejected'.format(created, failed)))
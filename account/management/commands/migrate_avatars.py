@@ -0,0 +1,70 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from account.images import process_image, variant_names
+from account.models import StoredBlob, User
+from account.storage import avatar_storage
+
+
+class Command(BaseCommand):
+    help = 'Moves existing avatars into the content addressed storage, merging identical files into one blob'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help='Also delete files under uploads/ that no user refers to')
+
+    def handle(self, *args, **options):
+        names = (User.all_with_inactive.exclude(image='').exclude(image=None)
+                 .values_list('image', flat=True).distinct().order_by('image'))
+        migrated = 0
+        blobs = set()
+        for name in names.iterator():
+            if StoredBlob.objects.filter(name=name).exists():
+                continue
+            if not avatar_storage.exists(name):
+                self.stderr.write('{} is missing, skipped'.format(name))
+                continue
+            blob_name = self.migrate(name)
+            migrated += 1
+            blobs.add(blob_name)
+            self.stdout.write('{} -> {}'.format(name, blob_name))
+
+        freed = self.delete_orphans() if options['delete_orphans'] else 0
+
+        self.stdout.write(self.style.SUCCESS('{} files migrated into {} blobs, {:.1f} KiB of orphans freed'.format(
+            migrated, len(blobs), freed / 1024.0)))
+
+    def migrate(self, name):
+        with transaction.atomic():
+            count = User.all_with_inactive.filter(image=name).count()
+            with avatar_storage.open(name, 'rb') as original:
+                # Hashes and copies the file into place, adding the first reference
+                blob_name = avatar_storage.save(name, original)
+            StoredBlob.objects.filter(name=blob_name).update(refcount=F('refcount') + count - 1)
+            User.all_with_inactive.filter(image=name).update(image=blob_name, image_variants={})
+            if blob_name != name:
+                transaction.on_commit(lambda: self.delete_file(name))
+        process_image(blob_name)
+        return blob_name
+
+    def delete_file(self, name):
+        avatar_storage.delete(name)
+        for variant in variant_names(name):
+            default_storage.delete(variant)
+
+    def delete_orphans(self):
+        # Only plain files directly under uploads/, blobs live in the two character sub directories
+        referenced = set(StoredBlob.objects.values_list('name', flat=True))
+        freed = 0
+        directories, files = avatar_storage.listdir('uploads')
+        for filename in files:
+            name = os.path.join('uploads', filename)
+            if name not in referenced and not User.all_with_inactive.filter(image=name).exists():
+                freed += avatar_storage.size(name)
+                avatar_storage.delete(name)
+                self.stdout.write('deleted orphan {}'.format(name))
+        return freed
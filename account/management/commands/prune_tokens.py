@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from account.authentication import device_token_conf
+from account.pruning import prunable, prune_tokens
+
+
+class Command(BaseCommand):
+    help = ('Deletes expired and revoked device tokens and the tokens of deactivated users, --batch-size rows per '
+            'DELETE so logins only ever wait for one batch')
+
+    def add_arguments(self, parser):
+        conf = device_token_conf()
+        parser.add_argument('--batch-size', type=int, default=conf['PRUNE_BATCH_SIZE'])
+        parser.add_argument('--pause', type=float, default=conf['PRUNE_PAUSE'], help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the tokens that would be pruned')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write('{} tokens would be pruned'.format(sum(queryset.count() for queryset in prunable())))
+            return
+
+        pruned = 0
+        for deleted in prune_tokens(options['batch_size'], options['pause']):
+            pruned += deleted
+            self.stdout.write('{} tokens pruned'.format(pruned))
+        self.stdout.write(self.style.SUCCESS('{} tokens pruned'.format(pruned)))
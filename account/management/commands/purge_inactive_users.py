@@ -0,0 +1,69 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from account.exporting import iter_export
+from account.models import User
+from account.storage import release
+
+
+class Command(BaseCommand):
+    help = ('Archives users deactivated more than --days ago as NDJSON and deletes them, in short transactions of '
+            '--batch-size users so concurrent writers only ever wait for one batch')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help='Only purge users deactivated at least this many days ago')
+        parser.add_argument('--archive', help='NDJSON file the purged users are appended to')
+        parser.add_argument('--no-archive', action='store_true', help='Delete without keeping an archive')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the users that would be purged')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Users deactivated before deactivated_at existed fall back to their join date
+        candidates = User.all_with_inactive.filter(is_active=False).filter(
+            Q(deactivated_at__lt=cutoff) | Q(deactivated_at__isnull=True, date_joined__lt=cutoff))
+
+        if options['dry_run']:
+            self.stdout.write('{} users would be purged'.format(candidates.count()))
+            return
+        if not options['archive'] and not options['no_archive']:
+            raise CommandError('Pass --archive FILE, or --no-archive to delete without one')
+
+        archive = open(options['archive'], 'ab') if options['archive'] else None
+        purged = 0
+        last_id = 0
+        try:
+            while True:
+                ids = list(candidates.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+                           [:options['batch_size']])
+                if not ids:
+                    break
+                last_id = ids[-1]
+                purged += self.purge(candidates.filter(pk__in=ids), archive)
+                self.stdout.write('{} users purged'.format(purged))
+                time.sleep(options['pause'])
+        finally:
+            if archive is not None:
+                archive.close()
+
+        self.stdout.write(self.style.SUCCESS('{} inactive users purged'.format(purged)))
+
+    def purge(self, batch, archive):
+        with transaction.atomic():
+            # The filter is evaluated again in here, a user reactivated meanwhile is neither archived nor deleted
+            if archive is not None:
+                for chunk in iter_export(batch.order_by('pk'), 'ndjson'):
+                    archive.write(chunk)
+                # On disk before the rows are gone
+                archive.flush()
+            for name in batch.exclude(image='').exclude(image=None).values_list('image', flat=True):
+                release(name)
+            deleted, per_model = batch.delete()
+        return per_model.get(User._meta.label, 0)
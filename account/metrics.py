@@ -0,0 +1,197 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+# Histogram buckets: SUB_BUCKETS log-linear steps per power of two, from 2 ** MIN_EXPONENT s (~61us) to
+# 2 ** MAX_EXPONENT s (64s). Recording is O(1) through math.frexp, like an HDR histogram with fixed precision
+SUB_BUCKETS = 4
+MIN_EXPONENT = -14
+MAX_EXPONENT = 6
+BOUNDS = [2.0 ** (exponent + step / SUB_BUCKETS)
+          for exponent in range(MIN_EXPONENT, MAX_EXPONENT)
+          for step in range(1, SUB_BUCKETS + 1)]
+
+METRICS = (
+    ('request_seconds', 'Wall time of the request'),
+    ('db_seconds', 'Time spent executing database queries'),
+    ('db_queries', 'Database queries executed'),
+    ('hash_seconds', 'Time spent hashing or verifying passwords'),
+    ('serializer_seconds', 'Time spent in serializer validation and representation'),
+)
+
+_current = contextvars.ContextVar('account_metrics', default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(BOUNDS + [math.inf], self.counts):
+            total += count
+            yield bound, total
+
+
+def bucket_index(value):
+    if value <= BOUNDS[0]:
+        return 0
+    mantissa, exponent = math.frexp(value)
+    # value = mantissa * 2 ** exponent with 0.5 <= mantissa < 1, so it lies in the octave [2 ** (exponent - 1), ..)
+    step = math.ceil((math.log2(mantissa) + 1) * SUB_BUCKETS)
+    index = (exponent - 1 - MIN_EXPONENT) * SUB_BUCKETS + step - 1
+    return min(max(index, 0), len(BOUNDS))
+
+
+class Registry:
+    """
+    Histograms per (metric, route), guarded by one lock since recording is a handful of list operations
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, sample):
+        with self._lock:
+            for metric, value in sample.items():
+                histogram = self._histograms.get((metric, route))
+                if histogram is None:
+                    histogram = self._histograms[(metric, route)] = Histogram()
+                histogram.record(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self, extra_counters=()):
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            snapshot = [(key, list(histogram.cumulative()), histogram.count, histogram.sum)
+                        for key, histogram in histograms]
+        for metric, help_text in METRICS:
+            name = 'account_' + metric
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (sample_metric, route), buckets, count, total in snapshot:
+                if sample_metric != metric:
+                    continue
+                for bound, cumulative in buckets:
+                    lines.append('{}_bucket{{route="{}",le="{}"}} {}'.format(
+                        name, route, '+Inf' if bound == math.inf else repr(bound), cumulative))
+                lines.append('{}_sum{{route="{}"}} {}'.format(name, route, repr(total)))
+                lines.append('{}_count{{route="{}"}} {}'.format(name, route, count))
+        for name, help_text, value in extra_counters:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def add(metric, value):
+    # Adds to the current request's sample, a no-op outside of an instrumented request
+    sample = _current.get()
+    if sample is not None:
+        sample[metric] = sample.get(metric, 0) + value
+
+
+@contextmanager
+def timed(metric):
+    """
+    Adds the wall time of the block to the current request's metric, nested blocks of the same metric are only
+    counted once, by the outermost one
+    """
+    sample = _current.get()
+    active = '_active_' + metric
+    if sample is None or sample.get(active):
+        yield
+        return
+    sample[active] = True
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample[metric] = sample.get(metric, 0) + time.perf_counter() - begin
+        sample[active] = False
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    begin = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        add('db_seconds', time.perf_counter() - begin)
+        add('db_queries', 1)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+    connection_created receiver, times the queries of every connection. Async views run their queries on
+    asgiref's worker thread, whose connections the middleware can't reach from the event loop, so the wrapper is
+    installed once per connection rather than per request
+    """
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+class MetricsMiddleware:
+    """
+    Records wall time, query count and time, password hashing time and serializer time of every request into the
+    registry, keyed by the resolved URL name (api-list, api-login, api-me, ...). Runs natively under both WSGI and
+    ASGI, so async views are not pushed through a sync adapter
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = {}
+        token = _current.set(sample)
+        begin = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, sample, begin)
+        return response
+
+    async def __acall__(self, request):
+        sample = {}
+        token = _current.set(sample)
+        begin = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, sample, begin)
+        return response
+
+    def observe(self, request, sample, begin):
+        sample['request_seconds'] = time.perf_counter() - begin
+        sample.setdefault('db_queries', 0)
+        match = getattr(request, 'resolver_match', None)
+        route = (match.url_name or match.view_name) if match is not None else 'unmatched'
+        registry.observe(route, {metric: value for metric, value in sample.items() if not metric.startswith('_')})
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+from django.utils import timezone
+
+
+def copy_legacy_tokens(apps, schema_editor):
+    # Keys issued by rest_framework.authtoken keep working as device tokens with a fresh TTL
+    Token = apps.get_model('authtoken', 'Token')
+    DeviceToken = apps.get_model('account', 'DeviceToken')
+    # The default TTL of account.authentication.DEVICE_TOKEN_DEFAULTS
+    expires = timezone.now() + timedelta(days=30)
+    tokens = (DeviceToken(key=token.key, user_id=token.user_id, device='legacy', expires=expires)
+              for token in Token.objects.filter(user__is_active=True).iterator())
+    DeviceToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_user_active_manager'),
+        ('authtoken', '0002_auto_20160226_1747'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceToken',
+            fields=[
+                ('key', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('device', models.CharField(blank=True, default='', max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'device', 'expires'], name='device_token_user_idx')],
+            },
+        ),
+        migrations.RunPython(copy_legacy_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0008_device_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('event', models.CharField(choices=[('login', 'Login'), ('password_change', 'Password change'), ('profile_update', 'Profile update'), ('deactivate', 'Deactivation'), ('bulk', 'Bulk operation')], max_length=32)),
+                ('user_id', models.IntegerField(null=True)),
+                ('actor_id', models.IntegerField(null=True)),
+                ('ip', models.GenericIPAddressField(null=True)),
+                ('data', models.JSONField(default=dict)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created', 'id'], name='audit_created_idx'), models.Index(fields=['user_id', 'created'], name='audit_user_idx')],
+            },
+        ),
+    ]
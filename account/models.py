@@ -1,10 +1,37 @@
-from django.db import models
+import secrets
+
+from django.core.exceptions import ValidationError
+from django.db import models, router
+from django.db.models.functions import Lower
 from django.contrib.auth.models import BaseUserManager, \
     PermissionsMixin, AbstractUser
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .hashing import hash_password, verify_password
+from .storage import get_avatar_storage
+
+
+# Columns of the serialized profile (account.serializers.PROJECTABLE_FIELDS), saving a change to any of them bumps
+# profile_version
+PROFILE_FIELDS = ('email', 'first_name', 'last_name', 'gender', 'image', 'image_variants')
+
+
+class UserQuerySet(models.QuerySet):
 
+    def with_email(self, *emails):
+        # Case insensitive match on LOWER(email), which the unique user_email_ci_idx index serves
+        queryset = self.alias(email_lower=Lower('email'))
+        if len(emails) == 1:
+            return queryset.filter(email_lower=emails[0].lower())
+        return queryset.filter(email_lower__in=[email.lower() for email in emails])
 
-class MyAccountManager(BaseUserManager):
+
+class MyAccountManager(BaseUserManager.from_queryset(UserQuerySet)):
+
+    @classmethod
+    def normalize_email(cls, email):
+        # The whole address is lowercased, emails are unique regardless of case (user_email_ci_idx)
+        return super().normalize_email(email).lower()
 
     def create_user(self, email, first_name, last_name, gender, image=None, password=None):
         # Creates and save a new user
@@ -38,6 +65,13 @@ class MyAccountManager(BaseUserManager):
         return user
 
 
+class ActiveUserManager(MyAccountManager):
+    # The default manager, deactivated users are only reachable through User.all_with_inactive
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_active=True)
+
+
 class User(AbstractUser):
     # Choices for the gender field.
     male = 'M'
@@ -49,19 +83,219 @@ class User(AbstractUser):
     password = models.CharField(_('password'), max_length=128, null=False)
     first_name = models.CharField(max_length=50, null=False)
     last_name = models.CharField(max_length=50, null=False)
-    image = models.ImageField(upload_to='uploads/', null=True)
+    image = models.ImageField(upload_to='uploads/', null=True, storage=get_avatar_storage)
+    # Filled in by account.images once the upload has been processed off the request
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_variants = models.JSONField(default=dict, editable=False)
+    # Baked into signed access tokens, bumping it revokes every token issued before
+    token_version = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped whenever the serialized profile changes, drives the ETag/Last-Modified of users/me/ and users/{id}/
+    profile_version = models.PositiveIntegerField(default=0, editable=False)
+    profile_modified = models.DateTimeField(null=True, editable=False)
+    # Set by UserRelatedView.deactivate, purge_inactive_users deletes users deactivated long enough ago
+    deactivated_at = models.DateTimeField(null=True, editable=False)
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, null=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['password', 'first_name', 'last_name', 'gender']
 
-    objects = MyAccountManager()
+    objects = ActiveUserManager()
+    all_with_inactive = MyAccountManager()
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Maen@ and maen@ are the same login, so they can't be two users. Also serves the case insensitive lookups
+            models.UniqueConstraint(Lower('email'), name='user_email_ci_idx'),
+        ]
+        indexes = [
+            # Only active rows, the list walks them by id and the export filters them by date_joined, neither
+            # grows with the deactivated users
+            models.Index(fields=['id'], condition=models.Q(is_active=True), name='active_user_id_idx'),
+            models.Index(fields=['date_joined'], condition=models.Q(is_active=True), name='active_user_joined_idx'),
+            # account.emailfilter catches up on changed emails through it
+            models.Index(fields=['profile_modified'], name='user_profile_modified_idx'),
+        ]
 
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # What the profile looked like when loaded, save() compares against it
+        user._loaded_profile = user._profile_values()
+        return user
+
+    def save(self, *args, **kwargs):
+        # Every save that changes the profile moves its ETag on, whether it comes from the API, the admin or a shell
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields')
+        if not adding and self._image_replaced(update_fields):
+            # The variants and dimensions describe the previous image, the new one's come with its processing
+            self.image_variants = {}
+            self.image_width = self.image_height = None
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'image_variants', 'image_width', 'image_height'}
+        super().save(*args, **kwargs)
+        if not adding and self._profile_changed(kwargs.get('update_fields')):
+            self.touch_profile()
+        self._loaded_profile = self._profile_values()
+
+    def _profile_values(self, names=PROFILE_FIELDS):
+        # Deferred fields are left out rather than loaded
+        deferred = self.get_deferred_fields()
+        values = {}
+        for name in names:
+            if name in deferred:
+                continue
+            value = getattr(self, name)
+            if name == 'image':
+                value = value.name or ''
+            elif isinstance(value, dict):
+                value = dict(value)
+            values[name] = value
+        return values
+
+    def validate_unique(self, exclude=None):
+        # The email is checked by validate_constraints(), against deactivated users as well
+        super().validate_unique(exclude={*(exclude or ()), 'email'})
+
+    def validate_constraints(self, exclude=None):
+        # Django checks through the default manager, which hides deactivated users while their emails stay taken in
+        # user_email_ci_idx. That constraint is checked against all_with_inactive here instead
+        exclude = set(exclude or ())
+        errors = {}
+        try:
+            super().validate_constraints(exclude=exclude | {'email'})
+        except ValidationError as e:
+            errors = e.update_error_dict(errors)
+        if 'email' not in exclude and self.email:
+            taken = User.all_with_inactive.using(router.db_for_write(User, instance=self)).with_email(self.email)
+            if not self._state.adding and self.pk is not None:
+                taken = taken.exclude(pk=self.pk)
+            if taken.exists():
+                errors.setdefault('email', []).append(self.unique_error_message(User, ('email',)))
+        if errors:
+            raise ValidationError(errors)
+
+    def _image_replaced(self, update_fields=None):
+        if update_fields is not None and 'image' not in update_fields:
+            return False
+        loaded = getattr(self, '_loaded_profile', None)
+        if loaded is None or 'image' not in loaded or 'image' in self.get_deferred_fields():
+            return False
+        # An upload is only named once stored, uncommitted means a new file
+        return not self.image._committed or (self.image.name or '') != loaded['image']
+
+    def _profile_changed(self, update_fields=None):
+        loaded = getattr(self, '_loaded_profile', None)
+        if loaded is None:
+            # Built by hand rather than loaded, e.g. User(pk=...).save(), nothing to compare with
+            return True
+        names = PROFILE_FIELDS if update_fields is None else [name for name in PROFILE_FIELDS if name in update_fields]
+        return any(name not in loaded or loaded[name] != value for name, value in self._profile_values(names).items())
+
+    def revoke_tokens(self):
+        User.all_with_inactive.filter(pk=self.pk).update(token_version=models.F('token_version') + 1)
+        self.token_version += 1
+        # Expired rather than deleted, the keys are still needed to drop them from a shared TokenCache and
+        # prune_tokens deletes them later on
+        DeviceToken.objects.filter(user_id=self.pk, expires__gt=timezone.now()).update(expires=timezone.now())
+
+    def touch_profile(self):
+        now = timezone.now()
+        User.all_with_inactive.filter(pk=self.pk).update(
+            profile_version=models.F('profile_version') + 1, profile_modified=now)
+        self.profile_version += 1
+        self.profile_modified = now
+
+    def set_password(self, raw_password):
+        # Hashing goes through account.hashing so it can be moved off the request thread
+        self.password = hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        def setter(raw_password):
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+
+        return verify_password(raw_password, self.password, setter)
+
     def has_perm(self, perm, obj=None):
         return self.is_staff and self.is_superuser
 
     def has_module_perms(self, app_label):
         return True
+
+
+class StoredBlob(models.Model):
+    # One row per content addressed avatar file, refcount is the number of users pointing at it
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class DeviceToken(models.Model):
+    """
+    An API token of one of the user's devices, a user holds one per device. It expires TTL after it was last
+    renewed, see account.authentication.DeviceTokenAuthentication
+    """
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.ForeignKey(User, related_name='device_tokens', on_delete=models.CASCADE)
+    device = models.CharField(max_length=64, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    # prune_tokens walks this index to delete the expired rows in small batches
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'device', 'expires'], name='device_token_user_idx')]
+
+    def __str__(self):
+        return '{} ({})'.format(self.user_id, self.device or 'default')
+
+    @staticmethod
+    def generate_key():
+        return secrets.token_hex(20)
+
+
+class AuditEvent(models.Model):
+    """
+    A login or change to an account, written in batches by account.audit. The users are referenced by id only so
+    the events outlive them and inserting a batch never checks a foreign key
+    """
+    LOGIN = 'login'
+    PASSWORD_CHANGE = 'password_change'
+    PROFILE_UPDATE = 'profile_update'
+    DEACTIVATE = 'deactivate'
+    BULK = 'bulk'
+    EVENT_CHOICES = (
+        (LOGIN, 'Login'),
+        (PASSWORD_CHANGE, 'Password change'),
+        (PROFILE_UPDATE, 'Profile update'),
+        (DEACTIVATE, 'Deactivation'),
+        (BULK, 'Bulk operation'),
+    )
+
+    created = models.DateTimeField(default=timezone.now)
+    event = models.CharField(max_length=32, choices=EVENT_CHOICES)
+    # The account the event is about, None for bulk operations
+    user_id = models.IntegerField(null=True)
+    # Who did it when that isn't the user themselves, e.g. an admin
+    actor_id = models.IntegerField(null=True)
+    ip = models.GenericIPAddressField(null=True)
+    data = models.JSONField(default=dict)
+
+    class Meta:
+        # The query endpoints page through these newest first
+        indexes = [
+            models.Index(fields=['created', 'id'], name='audit_created_idx'),
+            models.Index(fields=['user_id', 'created'], name='audit_user_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {} {}'.format(self.created, self.event, self.user_id)
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UserCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key, every page is an index range scan no matter how deep it is
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class AuditCursorPagination(CursorPagination):
+    # Newest first, pages walk the audit_created_idx index backwards
+    ordering = ('-created', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+
+from django.core.signals import request_started
+from django.db import connections
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .authentication import device_token_conf
+from .models import DeviceToken
+
+logger = logging.getLogger(__name__)
+
+
+def prunable():
+    """
+    Expired device tokens, revoked ones included since revoking expires them, and the authtoken tokens of
+    deactivated users, which can never authenticate again
+    """
+    return (
+        DeviceToken.objects.filter(expires__lte=timezone.now()),
+        Token.objects.filter(user__is_active=False),
+    )
+
+
+def prune_tokens(batch_size=None, pause=None):
+    """
+    Deletes the prunable tokens batch_size keys at a time, each batch a short DELETE of its own with `pause` seconds
+    in between so logins never wait long for the write lock. Yields the number of rows deleted by each batch
+    """
+    conf = device_token_conf()
+    batch_size = batch_size or conf['PRUNE_BATCH_SIZE']
+    pause = conf['PRUNE_PAUSE'] if pause is None else pause
+    for queryset in prunable():
+        while True:
+            keys = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                break
+            deleted, per_model = queryset.model.objects.filter(pk__in=keys).delete()
+            yield deleted
+            if len(keys) < batch_size:
+                break
+            time.sleep(pause)
+
+
+class PruneScheduler(threading.Thread):
+    # Runs prune_tokens every `interval` seconds in the background of a serving process
+
+    def __init__(self, interval):
+        super().__init__(name='account-prune-tokens', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                deleted = sum(prune_tokens())
+                if deleted:
+                    logger.info('Pruned %d tokens', deleted)
+            except Exception:
+                logger.exception('Pruning tokens failed')
+            finally:
+                connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(**kwargs):
+    # request_started receiver, connected when PRUNE_INTERVAL is set so that only processes serving requests prune
+    global _scheduler
+    request_started.disconnect(start_scheduler, dispatch_uid='account.pruning.start_scheduler')
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PruneScheduler(device_token_conf()['PRUNE_INTERVAL'])
+            _scheduler.start()
+    return _scheduler
@@ -0,0 +1,179 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULTS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'account:primary:',
+}
+
+# Cache backends whose entries only the process that wrote them sees, useless for marks other workers must read
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+# Only these models are spread over the replicas, everything else stays on the primary
+ROUTED_MODELS = {('account', 'user'), ('account', 'devicetoken'), ('authtoken', 'token')}
+
+_use_primary = contextvars.ContextVar('account_use_primary', default=False)
+_conf = None
+
+
+def get_replica_conf():
+    global _conf
+    if _conf is None:
+        _conf = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_REPLICAS', {}))
+    return _conf
+
+
+def _reload_replica_conf(*args, **kwargs):
+    global _conf
+    if kwargs.get('setting') == 'ACCOUNT_REPLICAS':
+        _conf = None
+
+
+setting_changed.connect(_reload_replica_conf)
+
+
+def check_sticky_cache(app_configs=None, **kwargs):
+    # System check: with replicas, read-your-writes only holds if every worker sees the marks mark_written() leaves
+    conf = get_replica_conf()
+    if not conf['ALIASES']:
+        return []
+    cache_conf = settings.CACHES.get(conf['CACHE_ALIAS'])
+    if cache_conf is None:
+        return [checks.Error(
+            'ACCOUNT_REPLICAS CACHE_ALIAS {!r} is not one of CACHES.'.format(conf['CACHE_ALIAS']),
+            id='account.E001',
+        )]
+    if cache_conf.get('BACKEND') in PROCESS_LOCAL_CACHES:
+        return [checks.Warning(
+            'ACCOUNT_REPLICAS CACHE_ALIAS {!r} uses {}, which worker processes don\'t share.'.format(
+                conf['CACHE_ALIAS'], cache_conf['BACKEND']),
+            hint='A user whose write was handled by one worker can read stale data from a replica through another. '
+                 'Point CACHE_ALIAS at a shared cache such as memcached, redis or the database cache.',
+            id='account.W001',
+        )]
+    return []
+
+
+class ReplicaRouter:
+    """
+    Sends reads of users and tokens to a random replica and every write to the primary. Reads go to the primary too
+    while the current request is pinned to it, see pin_primary()
+    """
+
+    def _routed(self, model):
+        return (model._meta.app_label, model._meta.model_name) in ROUTED_MODELS
+
+    def db_for_read(self, model, **hints):
+        aliases = get_replica_conf()['ALIASES']
+        if not aliases or not self._routed(model):
+            return None
+        if _use_primary.get():
+            return 'default'
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return 'default' if self._routed(model) else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default'} | set(get_replica_conf()['ALIASES'])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        if db in get_replica_conf()['ALIASES']:
+            return False
+        return None
+
+
+def pin_primary():
+    # Reads for the rest of the request go to the primary, ReplicaRoutingMiddleware unpins once it is over
+    _use_primary.set(True)
+
+
+@contextmanager
+def primary():
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def _sticky_key(user):
+    return '{}{}'.format(get_replica_conf()['KEY_PREFIX'], user.pk)
+
+
+def mark_written(user):
+    # The user's reads go to the primary for STICKY_SECONDS, past the replication lag of their own write
+    conf = get_replica_conf()
+    if conf['ALIASES']:
+        caches[conf['CACHE_ALIAS']].set(_sticky_key(user), True, conf['STICKY_SECONDS'])
+
+
+def recently_wrote(user):
+    conf = get_replica_conf()
+    if not conf['ALIASES'] or not user.is_authenticated:
+        return False
+    return bool(caches[conf['CACHE_ALIAS']].get(_sticky_key(user)))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Pins requests with unsafe methods to the primary, and remembers their authenticated user so the reads that
+    follow their own writes are served from the primary as well
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        unsafe = request.method not in SAFE_METHODS
+        token = _use_primary.set(unsafe)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        if self.wrote(request, response, unsafe):
+            mark_written(request.user)
+        return response
+
+    async def __acall__(self, request):
+        unsafe = request.method not in SAFE_METHODS
+        token = _use_primary.set(unsafe)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        if self.wrote(request, response, unsafe):
+            await sync_to_async(mark_written)(request.user)
+        return response
+
+    def wrote(self, request, response, unsafe):
+        if not unsafe or response.status_code >= 400 or not get_replica_conf()['ALIASES']:
+            return False
+        # DRF assigns the user it authenticated to the Django request as well, so do the async views
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_authenticated
@@ -1,21 +1,186 @@
 from django.contrib.auth import get_user_model, authenticate
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.utils.encoding import filepath_to_uri
+from django.utils.functional import lazy
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 from rest_framework import exceptions
-from .models import User
+from rest_framework.utils.field_mapping import get_unique_error_message
+from rest_framework.validators import UniqueValidator
+from . import metrics
+from .bulk import ACTIONS, PATCHABLE_FIELDS
+from .emailfilter import email_might_exist
+from .exporting import parse_filters
+from .images import schedule_image_processing, sniff_format
+from .models import AuditEvent, User
+from .storage import release
 
 
-class UserSerializer(serializers.ModelSerializer):
+class StreamedImageField(serializers.FileField):
+    # Checks the header bytes instead of letting Pillow decode the whole upload inside the request
+    default_error_messages = {
+        'invalid_image': _('Upload a valid image. The file you uploaded was either not an image or a corrupted image.'),
+    }
+
+    def to_internal_value(self, data):
+        data = super().to_internal_value(data)
+        if sniff_format(data) is None:
+            self.fail('invalid_image')
+        return data
+
+
+class TimedSerializerMixin:
+    # Feeds serializer_seconds of the request metrics, validation includes any password check it runs
+
+    def run_validation(self, data=serializers.empty):
+        with metrics.timed('serializer_seconds'):
+            return super().run_validation(data)
+
+    def to_representation(self, instance):
+        with metrics.timed('serializer_seconds'):
+            return super().to_representation(instance)
+
+
+class ImageVariantsMixin(serializers.Serializer):
+    image_variants = serializers.SerializerMethodField()
+
+    def get_image_variants(self, obj):
+        # URLs of the resized copies, empty until the background processing has run
+        request = self.context.get('request')
+        return {variant: _image_url(name, request) for variant, name in obj.image_variants.items()}
+
+
+class UniqueEmailValidator(UniqueValidator):
+    """
+    Case insensitive like the user_email_ci_idx constraint, with the model's own error message. Skips the query when
+    account.emailfilter knows no user has the email
+    """
+    message = lazy(get_unique_error_message, str)(User._meta.get_field('email'))
+
+    def __call__(self, value, serializer_field):
+        if email_might_exist(value):
+            super().__call__(value, serializer_field)
+
+    def filter_queryset(self, value, queryset, field_name):
+        return queryset.with_email(value)
+
+
+class UserSerializer(TimedSerializerMixin, ImageVariantsMixin, serializers.ModelSerializer):
+    image = StreamedImageField(required=False, allow_null=True)
+
     class Meta:
         model = get_user_model()
-        fields = ['id', 'email', 'password', 'first_name', 'last_name', 'gender', 'image']
-        extra_kwargs = {'password': {'write_only': True, 'min_length': 6}}
+        fields = ['id', 'email', 'password', 'first_name', 'last_name', 'gender', 'image', 'image_variants']
+        extra_kwargs = {'password': {'write_only': True, 'min_length': 6},
+                        'email': {'validators': [UniqueEmailValidator(queryset=User.all_with_inactive.all())]}}
+
+
+# Fields a client may pick with ?fields= on the users list, the columns behind them are account.models.PROFILE_FIELDS
+PROJECTABLE_FIELDS = ['id', 'email', 'first_name', 'last_name', 'gender', 'image', 'image_variants']
+
+
+def parse_fields(value):
+    # Turns 'id,email' into ['id', 'email'], rejecting anything UserSerializer wouldn't return
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in PROJECTABLE_FIELDS]
+    if not fields or unknown:
+        raise serializers.ValidationError(
+            {'fields': _('Expected a comma separated subset of {}').format(', '.join(PROJECTABLE_FIELDS))})
+    return fields
+
+
+class UserRowSerializer:
+    """
+    Read only UserSerializer output built straight from values() rows. The fields and the media URL prefix are
+    worked out once, not per object and field, and no model or DRF field is instantiated
+    """
+
+    def __init__(self, fields=PROJECTABLE_FIELDS, request=None):
+        self.fields = list(fields)
+        self.image = 'image' in self.fields
+        self.image_variants = 'image_variants' in self.fields
+        self.media_prefix = media_url_prefix(request)
+        self.request = request
+
+    def url(self, name):
+        if not name:
+            return None
+        if self.media_prefix is None:
+            return _image_url(name, self.request)
+        return self.media_prefix + filepath_to_uri(name).lstrip('/')
+
+    def to_representation(self, row):
+        item = {field: row[field] for field in self.fields}
+        if self.image:
+            item['image'] = self.url(item['image'])
+        if self.image_variants:
+            item['image_variants'] = {variant: self.url(name) for variant, name in item['image_variants'].items()}
+        return item
+
+    def rows(self, rows):
+        with metrics.timed('serializer_seconds'):
+            return [self.to_representation(row) for row in rows]
+
+    def instance(self, user):
+        # Same output for an already loaded user, e.g. request.user
+        row = {field: getattr(user, field) for field in self.fields}
+        if self.image:
+            row['image'] = user.image.name
+        with metrics.timed('serializer_seconds'):
+            return self.to_representation(row)
+
+
+def media_url_prefix(request=None):
+    """
+    What FileSystemStorage puts in front of every file name, made absolute like the image fields do. None for other
+    storages, whose URLs are then built per file
+    """
+    if not isinstance(default_storage, FileSystemStorage):
+        return None
+    prefix = default_storage.base_url
+    return request.build_absolute_uri(prefix) if request is not None else prefix
 
 
-class UpdateUserSerializer(serializers.ModelSerializer):
+def _image_url(name, request):
+    if not name:
+        return None
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class UpdateUserSerializer(TimedSerializerMixin, ImageVariantsMixin, serializers.ModelSerializer):
+    image = StreamedImageField(required=False, allow_null=True)
+
     class Meta:
         model = User
         exclude = ['password']
+        # The default manager hides deactivated users, whose emails are still taken
+        extra_kwargs = {'email': {'validators': [UniqueEmailValidator(queryset=User.all_with_inactive.all())]}}
+
+    def validate_email(self, value):
+        return User.objects.normalize_email(value)
+
+    def update(self, instance, validated_data):
+        previous_image = instance.image.name
+        # The storage retains the new blob while the row is saved, so that reference and the release of the old one
+        # commit together with the row. Content uploaded again retains its blob once more, the previous name is
+        # released whenever an image was sent even if it comes back unchanged
+        try:
+            with transaction.atomic():
+                # save() bumps profile_version if the profile changed
+                instance = super().update(instance, validated_data)
+                if 'image' in validated_data:
+                    release(previous_image)
+        except IntegrityError:
+            # Same as CreateUserSerializer.create, the email filter let the validator skip its query
+            email = validated_data.get('email')
+            if not email or not User.all_with_inactive.with_email(email).exclude(pk=instance.pk).exists():
+                raise
+            raise serializers.ValidationError({'email': [UniqueEmailValidator.message]}, code='unique')
+        if validated_data.get('image'):
+            schedule_image_processing(instance)
+        return instance
 
 
 class CreateUserSerializer(UserSerializer):
@@ -27,7 +192,16 @@ class CreateUserSerializer(UserSerializer):
     def create(self, validated_data):
         validated_data.pop('confirm_password', None)
         # self.data.pop('confirm_password')
-        return User.objects.create_user(**validated_data)
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(**validated_data)
+        except IntegrityError:
+            # Taken by a concurrent signup, or by one this process' email filter hadn't caught up with yet
+            if not User.all_with_inactive.with_email(validated_data['email']).exists():
+                raise
+            raise serializers.ValidationError({'email': [UniqueEmailValidator.message]}, code='unique')
+        schedule_image_processing(user)
+        return user
 
     def validate(self, attrs):
         password = attrs.get('password')
@@ -39,13 +213,23 @@ class CreateUserSerializer(UserSerializer):
         return attrs
 
 
-class AuthTokenSerializer(serializers.Serializer):
+class ImportUserSerializer(serializers.ModelSerializer):
+    # Uniqueness is checked once per chunk by account.importing instead of one query per row
+    class Meta:
+        model = User
+        fields = ['email', 'password', 'first_name', 'last_name', 'gender']
+        extra_kwargs = {'email': {'validators': []}, 'password': {'min_length': 6}}
+
+
+class AuthTokenSerializer(TimedSerializerMixin, serializers.Serializer):
     email = serializers.CharField(label=_("email"))
     password = serializers.CharField(
         label=_("password"),
         style={'input_type': 'password'},
         trim_whitespace=False
     )
+    # Names the device the token is for, each device of a user gets its own token
+    device = serializers.CharField(label=_("device"), max_length=64, required=False, allow_blank=True, default='')
 
     def validate(self, attrs):
         email = attrs.get('email')
@@ -64,7 +248,11 @@ class AuthTokenSerializer(serializers.Serializer):
         return attrs
 
 
-class PasswordChangeSerializer(serializers.Serializer):
+class RefreshTokenSerializer(TimedSerializerMixin, serializers.Serializer):
+    refresh = serializers.CharField(allow_blank=False, required=True, trim_whitespace=True)
+
+
+class PasswordChangeSerializer(TimedSerializerMixin, serializers.Serializer):
     old_password = serializers.CharField(max_length=128, allow_blank=False, required=True)
     new_password = serializers.CharField(max_length=128, allow_blank=False, required=True)
     confirm_password = serializers.CharField(max_length=128, allow_blank=False, required=True)
@@ -73,7 +261,8 @@ class PasswordChangeSerializer(serializers.Serializer):
         old_password = attrs.get('old_password')
         new_password = attrs.get('new_password')
         confirm_password = attrs.get('confirm_password')
-        user = self.context.get('request').user
+        # The view passes the user as the primary has it, request.user may be a cached copy
+        user = self.context.get('user') or self.context.get('request').user
         if not user.check_password(old_password):
             raise serializers.ValidationError(_("Old password doesn't match"))
 
@@ -81,3 +270,56 @@ class PasswordChangeSerializer(serializers.Serializer):
             raise serializers.ValidationError(_("Passwords doesn't match"))
 
         return attrs
+
+
+class BulkPatchSerializer(serializers.ModelSerializer):
+    # Validates the fields of a bulk update against the model, nothing is ever saved through it
+
+    class Meta:
+        model = User
+        fields = PATCHABLE_FIELDS
+
+
+class BulkActionSerializer(TimedSerializerMixin, serializers.Serializer):
+    action = serializers.ChoiceField(choices=ACTIONS)
+    # The users are picked by id, by the export filters, or both
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    filters = serializers.DictField(child=serializers.CharField(), required=False)
+    fields = serializers.DictField(required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate_filters(self, value):
+        try:
+            return parse_filters(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+
+    def validate(self, attrs):
+        # Without a selection the action would apply to every user
+        if not attrs.get('ids') and not attrs.get('filters'):
+            raise serializers.ValidationError(_('Select the users with ids or filters'))
+
+        if attrs['action'] != 'update':
+            if attrs.get('fields'):
+                raise serializers.ValidationError({'fields': _('Only the update action takes fields')})
+            return attrs
+        unknown = set(attrs.get('fields', {})) - set(PATCHABLE_FIELDS)
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': _('Only {} can be set in bulk').format(', '.join(PATCHABLE_FIELDS))})
+        patch = BulkPatchSerializer(data=attrs.get('fields', {}), partial=True)
+        if not patch.is_valid():
+            raise serializers.ValidationError({'fields': patch.errors})
+        if not patch.validated_data:
+            raise serializers.ValidationError(
+                {'fields': _('Set at least one of {}').format(', '.join(PATCHABLE_FIELDS))})
+        attrs['fields'] = patch.validated_data
+        return attrs
+
+
+class AuditEventSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = AuditEvent
+        fields = ('id', 'created', 'event', 'user_id', 'actor_id', 'ip', 'data')
+        read_only_fields = fields
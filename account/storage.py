@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every upload once under the SHA-256 of its content, e.g. uploads/ab/ab12...ef.jpg, hashing while the
+    upload is streamed to disk. Identical uploads share a blob whose references are counted in StoredBlob
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content is hashed, never suffix it
+        return name
+
+    def _save(self, name, content):
+        directory, base = os.path.split(name)
+        extension = os.path.splitext(base)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temporary_path = tempfile.mkstemp(dir=full_directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as temporary:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary.write(chunk)
+            hexdigest = digest.hexdigest()
+            blob_name = '/'.join(filter(None, [directory, hexdigest[:2], hexdigest + extension]))
+            full_path = self.path(blob_name)
+            if os.path.exists(full_path):
+                os.remove(temporary_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(temporary_path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        retain(blob_name, size=os.path.getsize(full_path))
+        return blob_name
+
+
+avatar_storage = ContentAddressedStorage()
+
+
+def get_avatar_storage():
+    return avatar_storage
+
+
+def retain(name, size=0):
+    # Adds a reference to the blob, run inside the same transaction as the row that points at it
+    from .models import StoredBlob
+
+    blobs = StoredBlob.objects.filter(name=name)
+    if blobs.update(refcount=F('refcount') + 1):
+        return
+    try:
+        with transaction.atomic():
+            StoredBlob.objects.create(name=name, size=size, refcount=1)
+    except IntegrityError:
+        # A concurrent first upload of the same content created the row in between, count on top of it
+        blobs.update(refcount=F('refcount') + 1)
+
+
+def release(name):
+    """
+    Drops a reference to the blob, the file and its resized variants are deleted after commit once nothing
+    refers to it anymore
+    """
+    from .models import StoredBlob
+
+    if not name:
+        return
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None:
+            return
+        if blob.refcount > 1:
+            StoredBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+            return
+        blob.delete()
+    transaction.on_commit(lambda: _delete_blob(name))
+
+
+def _delete_blob(name):
+    from .images import variant_names
+    from .models import StoredBlob
+
+    # The same content may have been uploaded again since the last reference was dropped
+    if StoredBlob.objects.filter(name=name).exists():
+        return
+    avatar_storage.delete(name)
+    for variant in variant_names(name):
+        default_storage.delete(variant)
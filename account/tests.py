@@ -1,6 +1,52 @@
-from django.test import TestCase, Client
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, transaction
+from django.db.models.query import QuerySet
+from django.test import AsyncClient, RequestFactory, TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import PBKDF2SHA1PasswordHasher, make_password
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from Task1.database import database_settings, sqlite_pragmas
+from Task1.profiles import app_profile, for_profile, warm_up_enabled
+from . import metrics
+from .audit import AuditLog, get_audit_log
+from .authentication import SignedTokenAuthentication, TokenCache, get_token_cache, issue_device_token, user_cache_key
+from .bulk import bulk_apply
+from .emailfilter import EmailFilter, get_email_filter
+from .hashers import MIN_ITERATIONS, calibrate, profile_iterations
+from .hashing import HashingBusy, HashingPool
+from .importing import import_users, iter_rows
+from .models import AuditEvent, DeviceToken, StoredBlob
+from .renderers import FastJSONRenderer
+from .routers import ReplicaRouter, check_sticky_cache, primary, recently_wrote
+from .serializers import PROJECTABLE_FIELDS, CreateUserSerializer, UserRowSerializer, UserSerializer
+from .storage import retain
+from .throttling import LoginGuard, MemoryBackend, get_login_guard
+from .views import UserRelatedView
+from .warmup import warm_up
 
 '''
     User Model Test Cases
@@ -42,6 +88,22 @@ class ModelTests(TestCase):
 
         self.assertEqual(user.email, email.lower())
 
+    def test_email_unique_regardless_of_case(self):
+        # Test signing up with another case of a taken email is rejected, also by the database itself
+        User = get_user_model()
+        User.objects.create_user(email='Maen@gmail.com', first_name='Maen', last_name='Ibreigheith', gender='M',
+                                 password='pass123')
+        serializer = CreateUserSerializer(data={'email': 'maen@GMAIL.com', 'first_name': 'Maen',
+                                                'last_name': 'Ibreigheith', 'gender': 'M', 'password': 'pass123',
+                                                'confirm_password': 'pass123'})
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['email'], ['user with this email already exists.'])
+        self.assertEqual(User.objects.get().email, 'maen@gmail.com')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.bulk_create([User(email='MAEN@gmail.com', first_name='Maen', last_name='Ibreigheith',
+                                           gender='M')])
+
     def test_user_invalid_email(self):
         # Test creating user with no email raises error
 
@@ -104,3 +166,1812 @@ class AdminSiteTests(TestCase):
         self.assertContains(res, self.user.email)
         self.assertContains(res, self.user.first_name)
         self.assertContains(res, self.user.gender)
+
+    def test_bulk_deactivate_action(self):
+        # Test the admin action deactivates the selected users but never the admin running it
+        url = reverse('admin:account_user_changelist')
+        self.client.post(url, {'action': 'deactivate_users',
+                               '_selected_action': [self.user.pk, self.admin_user.pk]})
+
+        self.assertFalse(get_user_model().all_with_inactive.get(pk=self.user.pk).is_active)
+        self.assertTrue(get_user_model().objects.get(pk=self.admin_user.pk).is_active)
+
+
+    def test_deactivated_users_email_is_rejected(self):
+        # Test the change form reports an email still held by a deactivated user instead of failing on save
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        # The admin form requires an image, an unchanged one is kept as it is
+        get_user_model().all_with_inactive.filter(pk=self.admin_user.pk).update(image='uploads/avatar.jpg')
+        url = reverse('admin:account_user_change', args=[self.admin_user.id])
+        data = {'email': 'Seif@gmail.com', 'first_name': 'Maen', 'last_name': 'Ibreigheith', 'gender': 'M',
+                'is_active': 'on', 'is_staff': 'on', 'is_superuser': 'on'}
+
+        res = self.client.post(url, data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('email', res.context['adminform'].form.errors)
+        self.assertEqual(get_user_model().objects.get(pk=self.admin_user.pk).email, 'm3n@hotmail.com')
+
+'''
+    Token Authentication Cache Test Cases
+'''
+
+
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.token = issue_device_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        get_token_cache().clear()
+
+    def test_token_resolution_is_cached(self):
+        # Test the second request resolves the token without touching the database
+        url = reverse('api-me')
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['email'], self.user.email)
+        self.assertEqual(get_token_cache().stats()['hits'], 1)
+
+    def test_deactivation_invalidates_cached_token(self):
+        # Test a deactivated user can't keep using a cached token
+        url = reverse('api-me')
+        self.client.get(url)
+        self.client.delete(url)
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_invalidation_drops_shared_signed_token_row(self):
+        # Test invalidating a user also drops the row another process cached for their signed tokens
+        shared_cache = caches['default']
+        other_process = TokenCache(shared_cache=shared_cache)
+        other_process.set(user_cache_key(self.user.pk), self.user)
+
+        TokenCache(shared_cache=shared_cache).invalidate_user(self.user)
+
+        self.assertIsNone(shared_cache.get(other_process.key_prefix + user_cache_key(self.user.pk)))
+
+    def test_admin_deactivation_drops_cached_token(self):
+        # Test a user deactivated through the admin can't keep using a cached token
+        admin = get_user_model().objects.create_superuser(email='m3n@gmail.com', first_name='Maen',
+                                                          last_name='Ibreigheith', gender='M', password='pass123')
+        # The admin form requires an image
+        get_user_model().objects.filter(pk=self.user.pk).update(image='uploads/avatar.jpg')
+        url = reverse('api-me')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        client = Client()
+        client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = client.post(reverse('admin:account_user_change', args=[self.user.id]),
+                              {'email': self.user.email, 'first_name': 'Seif', 'last_name': 'Obied', 'gender': 'M'})
+        self.assertEqual(res.status_code, 302)
+
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_writes_start_from_current_row(self):
+        # Test a write through a cached token doesn't put back what changed behind the cache's back
+        url = reverse('api-me')
+        self.client.get(url)
+        get_user_model().objects.filter(pk=self.user.pk).update(token_version=5)
+
+        self.client.patch(url, {'first_name': 'Saif'})
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.token_version), ('Saif', 5))
+
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.patch(url, {'first_name': 'Seif'}).status_code, 401)
+        self.assertFalse(get_user_model().all_with_inactive.get(pk=self.user.pk).is_active)
+
+    def test_lru_evicts_oldest_entry(self):
+        # Test the cache never grows past its max size
+        cache = TokenCache(max_size=1, ttl=60)
+        cache.set('a', self.user)
+        cache.set('b', self.user)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b').pk, self.user.pk)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+'''
+    Password Hashing Pool Test Cases
+'''
+
+
+class HashingPoolTests(TestCase):
+
+    def setUp(self):
+        get_login_guard().backend.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+
+    def test_pool_rejects_when_full(self):
+        # Test submissions past max_pending fail fast instead of queueing
+        pool = HashingPool(workers=1, max_pending=1, retry_after=3)
+        try:
+            future = pool.submit(time.sleep, 0.5)
+            with self.assertRaises(HashingBusy) as ctx:
+                pool.submit(time.sleep, 0)
+            self.assertEqual(ctx.exception.wait, 3)
+            future.result()
+        finally:
+            pool.shutdown()
+
+    def test_map_leaves_slots_for_requests(self):
+        # Test a batch holds at most its share of the slots, so a login can still submit while it runs
+        pool = HashingPool(workers=1, max_pending=2, import_max_pending=1)
+        try:
+            batch = threading.Thread(target=pool.map, args=(time.sleep, [0.3, 0.3]))
+            batch.start()
+            time.sleep(0.1)
+            pool.submit(time.sleep, 0).result()
+            batch.join()
+        finally:
+            pool.shutdown()
+
+    @override_settings(ACCOUNT_HASHING={'POOL_ENABLED': True, 'WORKERS': 1})
+    def test_login_with_pool_enabled(self):
+        # Test login verifies the password through the pool
+        res = self.client.post(reverse('api-login'), {'email': self.user.email, 'password': 'pass123'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['user_id'], self.user.id)
+
+    def test_async_login(self):
+        # Test the async login view issues a token and rejects a wrong password
+        url = reverse('async-login')
+        res = self.client.post(url, {'email': self.user.email, 'password': 'pass123'}, format='json')
+        wrong = self.client.post(url, {'email': self.user.email, 'password': 'wrong'}, format='json')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['token'], DeviceToken.objects.get(user=self.user).key)
+        self.assertEqual(wrong.status_code, 401)
+
+
+'''
+    Bulk User Import Test Cases
+'''
+
+
+class ImportUsersTests(TestCase):
+
+    def setUp(self):
+        get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+
+    def test_import_reports_row_errors_without_aborting(self):
+        # Test bad and duplicate rows are reported while the good rows are still created
+        stream = io.StringIO(
+            'email,password,first_name,last_name,gender\n'
+            'a@gmail.com,pass123,A,A,M\n'
+            'seif@gmail.com,pass123,Seif,Obied,M\n'
+            'b@gmail.com,pass123,B,B,X\n'
+            'c@GMAIL.com,pass123,C,C,F\n'
+        )
+        results = list(import_users(iter_rows(stream, 'csv'), chunk_size=2, workers=0))
+
+        self.assertEqual(sum(created for created, errors in results), 2)
+        self.assertEqual([error['line'] for created, errors in results for error in errors], [3, 4])
+        self.assertTrue(get_user_model().objects.get(email='c@gmail.com').check_password('pass123'))
+
+    def test_import_users_command(self):
+        # Test the management command reads a JSONL file
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write('{"email": "a@gmail.com", "password": "pass123", "first_name": "A", '
+                    '"last_name": "A", "gender": "F"}\n')
+            f.write('not json\n')
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_users', f.name, workers=0, stdout=out, stderr=err)
+        os.unlink(f.name)
+
+        self.assertIn('1 users created, 1 rows rejected', out.getvalue())
+        self.assertIn('line 2', err.getvalue())
+        self.assertTrue(get_user_model().objects.filter(email='a@gmail.com').exists())
+
+    def test_bulk_create_users_endpoint(self):
+        # Test the upload hashes without a pool of its own and caps the listed errors while counting them all
+        admin = get_user_model().objects.create_superuser(email='m3n@gmail.com', first_name='Maen',
+                                                          last_name='Ibreigheith', gender='M', password='pass123')
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile('users.csv', b'email,password,first_name,last_name,gender\n'
+                                                 b'a@gmail.com,pass123,A,A,M\n'
+                                                 b'seif@gmail.com,pass123,Seif,Obied,M\n'
+                                                 b'b@gmail.com,pass123,B,B,X\n')
+        with mock.patch('account.importing.make_hashing_executor', side_effect=AssertionError('pool started')), \
+                mock.patch('account.views.MAX_REPORTED_ERRORS', 1):
+            res = client.post(reverse('api-bulk-create-users'), {'file': upload}, format='multipart')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual((res.data['created'], res.data['rejected']), (1, 2))
+        self.assertEqual([error['line'] for error in res.data['errors']], [3])
+        self.assertTrue(get_user_model().objects.get(email='a@gmail.com').check_password('pass123'))
+
+
+'''
+    Users List Pagination Test Cases
+'''
+
+
+class UserListPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='m3n@hotmail.com',
+            first_name='Maen',
+            last_name='Ibreigheith',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(self.admin_user)
+        for i in range(3):
+            get_user_model().objects.create_user(
+                email='user{}@gmail.com'.format(i),
+                first_name='User',
+                last_name=str(i),
+                gender='F',
+                password='pass123'
+            )
+
+    def test_list_is_cursor_paginated(self):
+        # Test the list walks the users by id one page at a time
+        res = self.client.get(reverse('api-list'), {'page_size': 2})
+        next_page = self.client.get(res.data['next'])
+
+        ids = [user['id'] for user in res.data['results'] + next_page.data['results']]
+        self.assertEqual(ids, sorted(get_user_model().objects.values_list('id', flat=True)))
+        self.assertIsNone(next_page.data['next'])
+
+    def test_list_fields_projection(self):
+        # Test ?fields= only returns the requested columns
+        res = self.client.get(reverse('api-list'), {'fields': 'email,image'})
+
+        self.assertEqual(res.data['results'][0], {'email': self.admin_user.email, 'image': None})
+
+    def test_list_rejects_unknown_fields(self):
+        # Test write only or unknown fields can't be projected
+        res = self.client.get(reverse('api-list'), {'fields': 'id,password'})
+
+        self.assertEqual(res.status_code, 400)
+
+
+'''
+    Users Export Test Cases
+'''
+
+
+class ExportUsersTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='m3n@hotmail.com',
+            first_name='Maen',
+            last_name='Ibreigheith',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(self.admin_user)
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='F',
+            password='pass123'
+        )
+
+    def test_export_ndjson_with_filters(self):
+        # Test the export streams one JSON object per matching user and never the password
+        res = self.client.get(reverse('api-export'), {'gender': 'F'})
+        rows = [json.loads(line) for line in b''.join(res.streaming_content).splitlines()]
+
+        self.assertEqual([row['email'] for row in rows], [self.user.email])
+        self.assertNotIn('password', rows[0])
+
+    def test_export_gzip_csv(self):
+        # Test the CSV export can be compressed on the fly
+        res = self.client.get(reverse('api-export'), {'output': 'csv', 'gzip': '1'})
+        lines = gzip.decompress(b''.join(res.streaming_content)).decode().splitlines()
+
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        self.assertNotIn('Content-Encoding', res)
+        self.assertTrue(lines[0].startswith('id,email'))
+        self.assertEqual(len(lines), 3)
+
+    def test_export_rejects_bad_filter(self):
+        # Test invalid filters are reported instead of streaming an empty file
+        res = self.client.get(reverse('api-export'), {'joined_after': 'yesterday'})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_export_users_command(self):
+        # Test the management command writes the export to a file
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.ndjson')
+            call_command('export_users', output=path, is_active='true', stderr=io.StringIO())
+            with open(path) as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+
+'''
+    Image Processing Test Cases
+'''
+
+
+def make_jpeg(size=(800, 600)):
+    image = Image.new('RGB', size, 'red')
+    exif = Image.Exif()
+    exif[0x010f] = 'Camera Maker'
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('avatar.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageProcessingTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root.name,
+            ACCOUNT_IMAGES={'WORKERS': 0, 'VARIANTS': {'thumb': 64}},
+        )
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def test_upload_generates_variants_off_request(self):
+        # Test the upload is processed after commit into an EXIF free thumbnail
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch(reverse('api-me'), {'image': make_jpeg()}, format='multipart')
+
+        self.assertEqual(res.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.image_width, self.user.image_height), (800, 600))
+        with default_storage.open(self.user.image_variants['thumb']) as f:
+            thumb = Image.open(f)
+            self.assertEqual(thumb.format, 'WEBP')
+            self.assertEqual(max(thumb.size), 64)
+            self.assertNotIn(0x010f, thumb.getexif())
+
+        res = self.client.get(reverse('api-me'))
+        self.assertTrue(res.data['image_variants']['thumb'].endswith('_thumb.webp'))
+
+    def test_clearing_image_drops_variants(self):
+        # Test the previous image's variants and dimensions are not served once it is removed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('api-me'), {'image': make_jpeg()}, format='multipart')
+        self.client.force_authenticate(get_user_model().objects.get(pk=self.user.pk))
+
+        res = self.client.patch(reverse('api-me'), {'image': ''}, format='multipart')
+
+        self.assertEqual(res.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.image_variants, {})
+        self.assertEqual((self.user.image_width, self.user.image_height), (None, None))
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(reverse('api-me')).data['image_variants'], {})
+
+    def test_upload_rejects_non_images(self):
+        # Test a file without an image header is rejected without decoding it
+        upload = SimpleUploadedFile('avatar.jpg', b'not an image', content_type='image/jpeg')
+
+        res = self.client.patch(reverse('api-me'), {'image': upload}, format='multipart')
+
+        self.assertEqual(res.status_code, 400)
+
+
+'''
+    Content Addressed Storage Test Cases
+'''
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root.name,
+            ACCOUNT_IMAGES={'WORKERS': 0, 'VARIANTS': {'thumb': 64}},
+        )
+        self.settings_override.enable()
+        self.users = [
+            get_user_model().objects.create_user(
+                email='user{}@gmail.com'.format(i),
+                first_name='User',
+                last_name=str(i),
+                gender='M',
+                password='pass123'
+            )
+            for i in range(2)
+        ]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def upload(self, user, upload):
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.patch(reverse('api-me'), {'image': upload}, format='multipart')
+
+    def test_identical_uploads_share_one_blob(self):
+        # Test the same content uploaded twice is stored once with two references
+        content = make_jpeg().read()
+        for user in self.users:
+            self.upload(user, SimpleUploadedFile('avatar.jpg', content))
+
+        names = {user.image.name for user in get_user_model().objects.filter(pk__in=[u.pk for u in self.users])}
+        self.assertEqual(len(names), 1)
+        self.assertEqual(StoredBlob.objects.get(name=names.pop()).refcount, 2)
+
+    def test_reuploading_same_content_keeps_one_reference(self):
+        # Test uploading the avatar a user already has doesn't leak a reference, so clearing it deletes the blob
+        content = make_jpeg().read()
+        for _ in range(3):
+            self.upload(self.users[0], SimpleUploadedFile('avatar.jpg', content))
+        name = get_user_model().objects.get(pk=self.users[0].pk).image.name
+        self.assertEqual(StoredBlob.objects.get(name=name).refcount, 1)
+
+        self.upload(self.users[0], '')
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_concurrent_first_upload_adds_a_reference(self):
+        # Test losing the race to create a blob's row counts a reference instead of failing
+        StoredBlob.objects.create(name='uploads/ab/ab.jpg', size=3, refcount=1)
+        update = QuerySet.update
+        calls = []
+
+        def lose_race(queryset, **kwargs):
+            # The first UPDATE runs before the other upload's INSERT is visible
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=lose_race):
+            retain('uploads/ab/ab.jpg', size=3)
+
+        self.assertEqual(StoredBlob.objects.get(name='uploads/ab/ab.jpg').refcount, 2)
+
+    def test_blob_is_collected_after_last_reference(self):
+        # Test replacing and deactivating drop references until the file is deleted
+        content = make_jpeg().read()
+        for user in self.users:
+            self.upload(user, SimpleUploadedFile('avatar.jpg', content))
+        name = get_user_model().objects.get(pk=self.users[0].pk).image.name
+
+        self.upload(self.users[0], make_jpeg(size=(10, 10)))
+        self.assertTrue(default_storage.exists(name))
+
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete(reverse('api-me'))
+
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_migrate_avatars_command(self):
+        # Test duplicate legacy files are merged into a single blob
+        content = make_jpeg().read()
+        for i, user in enumerate(self.users):
+            name = 'uploads/legacy_{}.jpg'.format(i)
+            default_storage.save(name, ContentFile(content))
+            get_user_model().objects.filter(pk=user.pk).update(image=name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('migrate_avatars', stdout=io.StringIO())
+
+        names = set(get_user_model().objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(StoredBlob.objects.get(name=names.pop()).refcount, 2)
+        self.assertFalse(default_storage.exists('uploads/legacy_0.jpg'))
+
+
+'''
+    Login Throttling Test Cases
+'''
+
+
+@override_settings(ACCOUNT_LOGIN_THROTTLE={'IP_RATE': '100/min', 'EMAIL_RATE': '2/min', 'LOCKOUT': 30})
+class LoginThrottleTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+
+    def test_email_is_locked_out_before_hashing(self):
+        # Test attempts over the email limit are rejected without checking the password
+        url = reverse('api-login')
+        for _ in range(2):
+            self.client.post(url, {'email': self.user.email, 'password': 'wrong'})
+
+        with mock.patch('account.models.verify_password') as verify:
+            res = self.client.post(url, {'email': self.user.email.upper(), 'password': 'pass123'})
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res['Retry-After'], '30')
+        verify.assert_not_called()
+
+    @override_settings(ACCOUNT_LOGIN_THROTTLE={'IP_RATE': '2/min', 'EMAIL_RATE': '100/min', 'LOCKOUT': 30})
+    def test_forwarded_for_does_not_change_ip_key(self):
+        # Test a client can't dodge the per IP limit by sending a new X-Forwarded-For with every attempt
+        url = reverse('api-login')
+        for i in range(2):
+            self.client.post(url, {'email': 'guess%d@gmail.com' % i, 'password': 'wrong'},
+                             HTTP_X_FORWARDED_FOR='10.0.0.%d' % i)
+
+        res = self.client.post(url, {'email': 'guess9@gmail.com', 'password': 'wrong'}, HTTP_X_FORWARDED_FOR='10.0.0.9')
+
+        self.assertEqual(res.status_code, 429)
+
+    def test_lockout_grows_exponentially(self):
+        # Test every repeated violation doubles the lockout
+        guard = LoginGuard(MemoryBackend(), ip_rate='1/min', email_rate='1/min', lockout=10, max_lockout=25)
+
+        self.assertIsNone(guard.check('1.2.3.4'))
+        self.assertEqual(guard.check('1.2.3.4'), 10)
+        with mock.patch('account.throttling.time.time', return_value=time.time() + 11):
+            self.assertEqual(guard.check('1.2.3.4'), 20)
+        with mock.patch('account.throttling.time.time', return_value=time.time() + 32):
+            self.assertEqual(guard.check('1.2.3.4'), 25)
+
+    def test_sliding_window_weights_previous_window(self):
+        # Test half of the previous window still counts halfway through the current one
+        backend = MemoryBackend()
+        for _ in range(4):
+            backend.hit('k', 60, 30)
+
+        self.assertEqual(backend.hit('k', 60, 90), 1 + 4 * 0.5)
+
+
+'''
+    Signed Token Authentication Test Cases
+'''
+
+
+class SignedTokenTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(UserRelatedView, 'authentication_classes', [SignedTokenAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        get_token_cache().clear()
+        get_login_guard().backend.reset()
+        res = self.client.post(reverse('api-login'), {'email': self.user.email, 'password': 'pass123'})
+        self.tokens = res.data
+
+    def test_login_issues_signed_tokens_only(self):
+        # Test login hands out an access/refresh pair and no database token
+        self.assertIn('access', self.tokens)
+        self.assertIn('refresh', self.tokens)
+        self.assertNotIn('token', self.tokens)
+        self.assertFalse(Token.objects.exists())
+
+    def test_access_token_is_verified_without_queries(self):
+        # Test a cached user is authenticated from the token alone
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.tokens['access'])
+        self.client.get(reverse('api-me'))
+
+        with self.assertNumQueries(0):
+            res = self.client.get(reverse('api-me'))
+
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_refresh_token_cannot_authenticate(self):
+        # Test only access tokens are accepted on API calls
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.tokens['refresh'])
+
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 401)
+
+    def test_expired_access_token_is_rejected(self):
+        # Test access tokens stop working after ACCESS_TTL
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.tokens['access'])
+
+        with override_settings(ACCOUNT_SIGNED_TOKENS={'ACCESS_TTL': -1}):
+            res = self.client.get(reverse('api-me'))
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        # Test bumping the token version invalidates both access and refresh tokens
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.tokens['access'])
+        self.client.put(reverse('api-change-password'), {
+            'old_password': 'pass123', 'new_password': 'pass456', 'confirm_password': 'pass456'})
+
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 401)
+        res = self.client.post(reverse('api-refresh-token'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(res.status_code, 401)
+
+    def test_refresh_issues_new_pair(self):
+        # Test a refresh token trades for a working access token
+        res = self.client.post(reverse('api-refresh-token'), {'refresh': self.tokens['refresh']})
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + res.data['access'])
+
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 200)
+
+
+'''
+    Request Metrics Test Cases
+'''
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        get_login_guard().backend.reset()
+        self.client = APIClient()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='m3n@hotmail.com',
+            first_name='Maen',
+            last_name='Ibreigheith',
+            gender='M',
+            password='pass123'
+        )
+
+    def test_bucket_index(self):
+        # Test values land in the first bucket whose upper bound holds them
+        for value in (1e-6, 0.001, 0.25, 0.3, 1.0, 10.0, 1e6):
+            index = metrics.bucket_index(value)
+            if index < len(metrics.BOUNDS):
+                self.assertLessEqual(value, metrics.BOUNDS[index])
+            if index > 0:
+                self.assertGreater(value, metrics.BOUNDS[index - 1])
+
+    def test_login_is_recorded_per_route(self):
+        # Test the middleware records wall, database and hashing time under the route name
+        self.client.post(reverse('api-login'), {'email': self.admin_user.email, 'password': 'pass123'})
+        self.client.force_authenticate(self.admin_user)
+
+        res = self.client.get(reverse('api-metrics'))
+        body = res.content.decode()
+
+        self.assertEqual(res['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertIn('account_request_seconds_count{route="api-login"} 1', body)
+        self.assertIn('account_hash_seconds_count{route="api-login"} 1', body)
+        self.assertIn('account_db_queries_count{route="api-login"} 1', body)
+        self.assertIn('account_serializer_seconds_count{route="api-login"} 1', body)
+
+    def test_metrics_is_admin_only(self):
+        # Test regular users can't read the metrics
+        user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(user)
+
+        self.assertEqual(self.client.get(reverse('api-metrics')).status_code, 403)
+
+
+'''
+    Database Tuning Test Cases
+'''
+
+
+class DatabaseTuningTests(TestCase):
+
+    def test_pragmas_applied_on_new_connections(self):
+        # Test every new SQLite connection gets the configured pragmas
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_database_profiles(self):
+        # Test the environment picks the SQLite or the pooled Postgres profile
+        sqlite = database_settings('/srv', env={})['default']
+        self.assertEqual(sqlite['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(sqlite['NAME'], '/srv/db.sqlite3')
+        self.assertEqual(sqlite['CONN_MAX_AGE'], 60)
+
+        postgres = database_settings('/srv', env={'DATABASE_PROFILE': 'postgres', 'DATABASE_POOL': 'pgbouncer',
+                                                  'DATABASE_HOST': 'db'})['default']
+        self.assertEqual(postgres['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual(postgres['HOST'], 'db')
+        self.assertEqual(postgres['CONN_MAX_AGE'], 0)
+        self.assertTrue(postgres['DISABLE_SERVER_SIDE_CURSORS'])
+
+        replicas = database_settings('/srv', env={'DATABASE_REPLICAS': '/srv/a.sqlite3, /srv/b.sqlite3'})
+        self.assertEqual(replicas['replica2']['NAME'], '/srv/b.sqlite3')
+        self.assertEqual(replicas['replica2']['TEST'], {'MIRROR': 'default'})
+
+        with self.assertRaises(ValueError):
+            database_settings('/srv', env={'DATABASE_PROFILE': 'oracle'})
+        self.assertEqual(sqlite_pragmas(env={'DATABASE_SQLITE_TUNING': '0'}), {})
+
+
+'''
+    Login Fast Path Test Cases
+'''
+
+
+class LoginFastPathTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        get_login_guard().backend.reset()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.payload = {'email': 'seif@gmail.com', 'password': 'pass123'}
+
+    def test_login_statements(self):
+        # Test a repeated login is a SELECT of the user joined with its token and a SELECT of the device's live token
+        with self.assertNumQueries(5):
+            # SELECT user, UPDATE last_login, SELECT live token, INSERT token, SELECT tokens past MAX_DEVICES
+            first = self.client.post(reverse('api-login'), self.payload)
+        with self.assertNumQueries(2):
+            # SELECT user, SELECT live token
+            second = self.client.post(reverse('api-login'), self.payload)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.data['token'], first.data['token'])
+        self.assertEqual(DeviceToken.objects.filter(user=self.user).count(), 1)
+
+    def test_last_login_coalesced(self):
+        # Test last_login is only written again once it is older than LAST_LOGIN_INTERVAL
+        self.client.post(reverse('api-login'), self.payload)
+        self.user.refresh_from_db()
+        first = self.user.last_login
+        self.assertIsNotNone(first)
+
+        self.client.post(reverse('api-login'), self.payload)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_login, first)
+
+        with override_settings(ACCOUNT_LOGIN={'LAST_LOGIN_INTERVAL': 0}):
+            self.client.post(reverse('api-login'), self.payload)
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.last_login, first)
+
+    def test_email_is_case_insensitive(self):
+        # Test the email matches whatever its case
+        res = self.client.post(reverse('api-login'), {'email': 'Seif@Gmail.com', 'password': 'pass123'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['user_id'], self.user.id)
+
+    def test_wrong_password(self):
+        # Test a wrong password neither logs in nor writes anything
+        with self.assertNumQueries(1):
+            res = self.client.post(reverse('api-login'), {'email': 'seif@gmail.com', 'password': 'wrong'})
+
+        self.assertEqual(res.status_code, 401)
+        self.assertFalse(DeviceToken.objects.exists())
+
+
+'''
+    Read Replica Routing Test Cases
+'''
+
+
+@override_settings(ACCOUNT_REPLICAS={'ALIASES': ['replica1']})
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_go_to_replicas(self):
+        # Test user and token reads use a replica and writes the primary
+        self.assertEqual(self.router.db_for_read(get_user_model()), 'replica1')
+        self.assertEqual(self.router.db_for_read(Token), 'replica1')
+        self.assertEqual(self.router.db_for_write(get_user_model()), 'default')
+        self.assertIsNone(self.router.db_for_read(StoredBlob))
+        self.assertFalse(self.router.allow_migrate('replica1', 'account'))
+
+    def test_pinned_reads_go_to_primary(self):
+        # Test reads inside primary() use the primary
+        with primary():
+            self.assertEqual(self.router.db_for_read(get_user_model()), 'default')
+        self.assertEqual(self.router.db_for_read(get_user_model()), 'replica1')
+
+    @override_settings(ACCOUNT_REPLICAS={'ALIASES': []})
+    def test_no_replicas(self):
+        # Test nothing is routed without replicas
+        self.assertIsNone(self.router.db_for_read(get_user_model()))
+
+    def test_check_warns_about_process_local_cache(self):
+        # Test the system check flags a stickiness cache other workers can't see, and accepts a shared one
+        self.assertEqual([message.id for message in check_sticky_cache()], ['account.W001'])
+
+        shared = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'account_cache'}
+        with override_settings(CACHES=dict(settings.CACHES, shared=shared),
+                               ACCOUNT_REPLICAS={'ALIASES': ['replica1'], 'CACHE_ALIAS': 'shared'}):
+            self.assertEqual(check_sticky_cache(), [])
+        with override_settings(ACCOUNT_REPLICAS={'ALIASES': ['replica1'], 'CACHE_ALIAS': 'missing'}):
+            self.assertEqual([message.id for message in check_sticky_cache()], ['account.E001'])
+
+
+class ReadYourWritesTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(self.user)
+
+    # The test database has no replica aliases, 'default' stands in for one
+    @override_settings(ACCOUNT_REPLICAS={'ALIASES': ['default']})
+    def test_reads_after_own_write_are_pinned(self):
+        # Test the user's reads after their own PATCH /users/me/ are served by the primary
+        with mock.patch('account.views.pin_primary') as pin:
+            self.client.get(reverse('api-me'))
+            self.assertFalse(pin.called)
+
+            res = self.client.patch(reverse('api-me'), {'first_name': 'Ahmad'})
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(recently_wrote(self.user))
+
+            pin.reset_mock()
+            self.client.get(reverse('api-me'))
+            self.assertTrue(pin.called)
+
+    def test_no_stickiness_without_replicas(self):
+        # Test writes aren't tracked when every read goes to the primary anyway
+        self.client.patch(reverse('api-me'), {'first_name': 'Ahmad'})
+
+        self.assertFalse(recently_wrote(self.user))
+
+
+'''
+    Conditional GET Test Cases
+'''
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_profile_is_not_modified(self):
+        # Test polling with the ETag returns an empty 304 until the profile changes
+        res = self.client.get(reverse('api-me'))
+        etag = res['ETag']
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Cache-Control'], 'private, no-cache')
+
+        with mock.patch.object(UserRowSerializer, 'to_representation') as to_representation:
+            res = self.client.get(reverse('api-me'), HTTP_IF_NONE_MATCH=etag)
+            self.assertFalse(to_representation.called)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res['ETag'], etag)
+        self.assertEqual(res.content, b'')
+
+        self.client.patch(reverse('api-me'), {'first_name': 'Ahmad'})
+        # force_authenticate keeps handing out the instance it was given, a token would resolve the saved row
+        self.client.force_authenticate(get_user_model().objects.get(pk=self.user.pk))
+        res = self.client.get(reverse('api-me'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res.data['first_name'], 'Ahmad')
+
+    def test_retrieve_if_modified_since(self):
+        # Test users/{id}/ honours If-Modified-Since from Last-Modified
+        admin = get_user_model().objects.create_superuser(
+            email='m3n@gmail.com',
+            first_name='Maen',
+            last_name='Ibreigheith',
+            gender='M',
+            password='pass123'
+        )
+        self.client.force_authenticate(admin)
+        url = reverse('api-detail', args=[self.user.id])
+
+        res = self.client.get(url)
+        res = self.client.get(url, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_deactivation_changes_etag(self):
+        # Test deactivating bumps the profile version
+        version = self.user.profile_version
+        self.client.delete(reverse('api-me'))
+        self.user.refresh_from_db()
+
+        self.assertEqual(self.user.profile_version, version + 1)
+
+    def test_admin_edit_changes_etag(self):
+        # Test a profile edited through the admin moves the ETag on, a save changing nothing doesn't
+        admin = get_user_model().objects.create_superuser(
+            email='m3n@gmail.com',
+            first_name='Maen',
+            last_name='Ibreigheith',
+            gender='M',
+            password='pass123'
+        )
+        # The admin form requires an image, an unchanged one is kept as it is
+        get_user_model().objects.filter(pk=self.user.pk).update(image='uploads/avatar.jpg')
+        etag = self.client.get(reverse('api-me'))['ETag']
+        client = Client()
+        client.force_login(admin)
+        url = reverse('admin:account_user_change', args=[self.user.id])
+        data = {'email': self.user.email, 'first_name': 'Ahmad', 'last_name': 'Obied', 'gender': 'M',
+                'is_active': 'on'}
+
+        res = client.post(url, data)
+        self.assertEqual(res.status_code, 302)
+        self.client.force_authenticate(get_user_model().objects.get(pk=self.user.pk))
+        res = self.client.get(reverse('api-me'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['first_name'], 'Ahmad')
+
+        version = get_user_model().objects.get(pk=self.user.pk).profile_version
+        client.post(url, data)
+        self.assertEqual(get_user_model().objects.get(pk=self.user.pk).profile_version, version)
+
+    @override_settings(ACCOUNT_PROFILE_CACHE={'PAYLOAD_CACHE': True})
+    def test_payload_cache(self):
+        # Test the serialized payload is reused for the same version
+        caches['default'].clear()
+        first = self.client.get(reverse('api-me'))
+        with mock.patch.object(UserRowSerializer, 'to_representation') as to_representation:
+            second = self.client.get(reverse('api-me'))
+            self.assertFalse(to_representation.called)
+
+        self.assertEqual(second.data, first.data)
+
+
+'''
+    Query Plan Test Cases
+'''
+
+
+class QueryPlanTests(TestCase):
+    # ACCOUNT_PLAN_ROWS=1000000 checks the plans at production size, ANALYZE runs first so SQLite's planner
+    # weighs the indexes against real statistics
+    rows = int(os.environ.get('ACCOUNT_PLAN_ROWS', 2000))
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.hashers import make_password
+        from django.db import connection
+
+        password = make_password('pass123')
+        User = get_user_model()
+        for start in range(0, cls.rows, 10000):
+            User.objects.bulk_create(
+                User(email='user{}@example.com'.format(i), first_name='First', last_name='Last',
+                     gender='M' if i % 2 else 'F', is_active=bool(i % 10), password=password)
+                for i in range(start, min(start + 10000, cls.rows))
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_email_lookup_uses_functional_index(self):
+        # Test case insensitive email lookups search the LOWER(email) index
+        plan = get_user_model().objects.with_email('User7@Example.COM').explain()
+
+        self.assertIn('USING INDEX user_email_ci_idx', plan)
+        self.assertEqual(get_user_model().objects.with_email('User7@Example.COM').get().email, 'user7@example.com')
+
+    def test_active_by_date_joined_uses_partial_index(self):
+        # Test the export filter searches the date_joined index of active users
+        since = timezone.now() - timedelta(days=1)
+        plan = get_user_model().objects.filter(date_joined__gte=since).explain()
+
+        self.assertIn('USING INDEX active_user_joined_idx', plan)
+
+    def test_modified_since_uses_index(self):
+        # Test the email filter's catch up on changed emails searches the profile_modified index
+        since = timezone.now() - timedelta(seconds=60)
+        plan = get_user_model().all_with_inactive.filter(profile_modified__gte=since).explain()
+
+        self.assertIn('USING INDEX user_profile_modified_idx', plan)
+
+    def test_active_by_id_uses_partial_index(self):
+        # Test paging by id through mostly deactivated users searches the index of the active ones, in order. With
+        # few inactive rows the rowid scan wins and the index isn't needed
+        from django.db import connection
+
+        User = get_user_model()
+        first_inactive = User.all_with_inactive.order_by('id').values_list('id', flat=True)[self.rows // 20]
+        User.all_with_inactive.filter(id__gte=first_inactive).update(is_active=False)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        plan = User.objects.filter(id__gt=1).order_by('id')[:100].explain()
+
+        self.assertIn('USING INDEX active_user_id_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+'''
+    Inactive Users Test Cases
+'''
+
+
+class InactiveUsersTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.delete(reverse('api-me'))
+
+    def test_default_manager_hides_inactive(self):
+        # Test deactivated users are only visible through all_with_inactive
+        User = get_user_model()
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertIsNotNone(User.all_with_inactive.get(pk=self.user.pk).deactivated_at)
+
+    def test_email_stays_taken(self):
+        # Test signing up again with a deactivated user's email is a validation error
+        res = self.client.post(reverse('api-create-user'), {
+            'email': 'seif@gmail.com', 'first_name': 'Seif', 'last_name': 'Obied', 'gender': 'M',
+            'password': 'pass123', 'confirm_password': 'pass123'})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('email', res.data)
+
+    def test_purge_inactive_users(self):
+        # Test long deactivated users are archived and deleted, recent ones are kept
+        User = get_user_model()
+        recent = User.objects.create_user(email='m3n@gmail.com', first_name='Maen', last_name='Ibreigheith',
+                                          gender='M', password='pass123')
+        User.objects.filter(pk=recent.pk).update(is_active=False, deactivated_at=timezone.now())
+        User.all_with_inactive.filter(pk=self.user.pk).update(deactivated_at=timezone.now() - timedelta(days=400))
+        Token.objects.create(user=self.user)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, 'purged.ndjson')
+            call_command('purge_inactive_users', archive=archive, batch_size=1, pause=0, stdout=io.StringIO())
+            with open(archive) as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertEqual([row['email'] for row in rows], ['seif@gmail.com'])
+        self.assertFalse(User.all_with_inactive.filter(pk=self.user.pk).exists())
+        self.assertFalse(Token.objects.filter(user_id=self.user.pk).exists())
+        self.assertTrue(User.all_with_inactive.filter(pk=recent.pk).exists())
+
+    def test_purge_needs_an_archive_choice(self):
+        # Test purging without --archive or --no-archive fails instead of exiting successfully
+        User = get_user_model()
+        User.all_with_inactive.filter(pk=self.user.pk).update(deactivated_at=timezone.now() - timedelta(days=400))
+
+        with self.assertRaises(CommandError):
+            call_command('purge_inactive_users', stdout=io.StringIO())
+        self.assertTrue(User.all_with_inactive.filter(pk=self.user.pk).exists())
+
+
+'''
+    Async Views Test Cases
+'''
+
+
+class AsyncViewsTests(TestCase):
+
+    def setUp(self):
+        get_login_guard().backend.reset()
+        get_token_cache().clear()
+        metrics.registry.reset()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.token = issue_device_token(self.user)
+        self.async_client = AsyncClient()
+        self.auth = {'Authorization': 'Token ' + self.token.key}
+
+    async def test_me_matches_sync_view(self):
+        # Test async users/me/ returns the sync body and validators, and a 304 for an unchanged profile
+        res = await self.async_client.get(reverse('async-me'), headers=self.auth)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        expected = await sync_to_async(client.get)(reverse('api-me'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), expected.json())
+        self.assertEqual(res['ETag'], expected['ETag'])
+
+        headers = dict(self.auth, **{'If-None-Match': res['ETag']})
+        res = await self.async_client.get(reverse('async-me'), headers=headers)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+
+    async def test_me_requires_authentication(self):
+        # Test unknown tokens and deactivated users are rejected
+        res = await self.async_client.get(reverse('async-me'), headers={'Authorization': 'Token nope'})
+        self.assertEqual(res.status_code, 401)
+
+        await get_user_model().objects.filter(pk=self.user.pk).aupdate(is_active=False)
+        get_token_cache().clear()
+        res = await self.async_client.get(reverse('async-me'), headers=self.auth)
+        self.assertEqual(res.status_code, 401)
+
+    async def test_list_is_keyset_paginated(self):
+        # Test the async list is admin only and walks the users by id with ?after=
+        res = await self.async_client.get(reverse('async-list'), headers=self.auth)
+        self.assertEqual(res.status_code, 403)
+
+        admin = await sync_to_async(get_user_model().objects.create_superuser)(
+            email='m3n@gmail.com',
+            first_name='Maen',
+            last_name='Ibreigheith',
+            gender='M',
+            password='pass123'
+        )
+        admin_token = await sync_to_async(issue_device_token)(admin)
+        admin_auth = {'Authorization': 'Token ' + admin_token.key}
+
+        res = await self.async_client.get(reverse('async-list'), {'page_size': 1, 'fields': 'id,email'},
+                                         headers=admin_auth)
+        self.assertEqual(res.json()['results'], [{'id': self.user.id, 'email': 'seif@gmail.com'}])
+        res = await self.async_client.get(res.json()['next'], headers=admin_auth)
+        self.assertEqual(res.json(), {'next': None, 'results': [{'id': admin.id, 'email': 'm3n@gmail.com'}]})
+
+        # Sizes below one are clamped rather than slicing an empty or negative page
+        for page_size in (0, -3):
+            res = await self.async_client.get(reverse('async-list'), {'page_size': page_size, 'fields': 'id'},
+                                             headers=admin_auth)
+            self.assertEqual(res.json()['results'], [{'id': self.user.id}])
+
+        res = await self.async_client.get(reverse('async-list'), {'fields': 'password'}, headers=admin_auth)
+        self.assertEqual(res.status_code, 400)
+
+    async def test_login_coalesces_last_login(self):
+        # Test async logins set last_login once per interval and are recorded by the metrics middleware
+        url = reverse('async-login')
+        body = {'email': 'SEIF@gmail.com', 'password': 'pass123'}
+        first = await self.async_client.post(url, body, content_type='application/json')
+        user = await get_user_model().objects.aget(pk=self.user.pk)
+        second = await self.async_client.post(url, body, content_type='application/json')
+
+        self.assertEqual(first.json()['token'], self.token.key)
+        self.assertEqual(second.status_code, 200)
+        self.assertIsNotNone(user.last_login)
+        self.assertEqual((await get_user_model().objects.aget(pk=self.user.pk)).last_login, user.last_login)
+        self.assertIn('account_db_queries_count{route="async-login"} 2',
+                      metrics.registry.render())
+
+
+'''
+    Read Fast Path Test Cases
+'''
+
+
+class ReadFastPathTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        get_user_model().objects.filter(pk=self.user.pk).update(
+            image='uploads/ab/ab12 cd.jpg', image_variants={'thumb': 'uploads/ab/ab12 cd_thumb.webp'})
+        self.user.refresh_from_db()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_row_serializer_matches_user_serializer(self):
+        # Test rows and instances come out exactly like UserSerializer, image URLs included
+        request = RequestFactory().get('/')
+        expected = UserSerializer(self.user, context={'request': request}).data
+        serializer = UserRowSerializer(request=request)
+        row = get_user_model().objects.values(*PROJECTABLE_FIELDS).get(pk=self.user.pk)
+
+        self.assertEqual(serializer.rows([row]), [expected])
+        self.assertEqual(serializer.instance(self.user), expected)
+        self.assertEqual(expected['image'], 'http://testserver/uploads/ab/ab12%20cd.jpg')
+
+    def test_reads_use_fast_renderer(self):
+        # Test list and me GET are rendered by FastJSONRenderer with the bytes JSONRenderer would produce
+        self.user.is_staff = True
+        self.user.save()
+
+        for url in (reverse('api-list'), reverse('api-me')):
+            res = self.client.get(url)
+            self.assertIsInstance(res.accepted_renderer, FastJSONRenderer)
+            self.assertEqual(res.content, JSONRenderer().render(res.data))
+
+        res = self.client.patch(reverse('api-me'), {'first_name': 'Ahmad'})
+        self.assertNotIsInstance(res.accepted_renderer, FastJSONRenderer)
+
+    def test_fast_renderer_falls_back_to_drf_encoder(self):
+        # Test dates, lazy strings and line separators are encoded like JSONRenderer does
+        data = {'when': timezone.now(), 'detail': gettext_lazy('Invalid token.'), 'name': 'a\u2028b', 1: None}
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+'''
+    Device Token Test Cases
+'''
+
+
+class DeviceTokenTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        get_login_guard().backend.reset()
+        get_token_cache().clear()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+
+    def login(self, device=''):
+        return self.client.post(reverse('api-login'), {'email': 'seif@gmail.com', 'password': 'pass123',
+                                                       'device': device}).data['token']
+
+    def test_tokens_are_per_device(self):
+        # Test each device gets its own token and logging in again on one reuses it
+        phone = self.login('phone')
+        laptop = self.login('laptop')
+
+        self.assertNotEqual(phone, laptop)
+        self.assertEqual(self.login('phone'), phone)
+        self.assertEqual(DeviceToken.objects.filter(user=self.user).count(), 2)
+
+    def test_expired_token_is_rejected(self):
+        # Test a token past its expiry no longer authenticates
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.login())
+        DeviceToken.objects.update(expires=timezone.now())
+
+        res = self.client.get(reverse('api-me'))
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_use_slides_expiry(self):
+        # Test a token is renewed on use once RENEW_INTERVAL has passed, and not written before that
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.login())
+        token = DeviceToken.objects.get()
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 200)
+        self.assertEqual(DeviceToken.objects.get().expires, token.expires)
+
+        DeviceToken.objects.update(expires=token.expires - timedelta(hours=2))
+        get_token_cache().clear()
+        self.client.get(reverse('api-me'))
+
+        self.assertGreaterEqual(DeviceToken.objects.get().expires, token.expires)
+
+    def test_login_rotates_token_due_for_renewal(self):
+        # Test logging in on a device with a token past RENEW_INTERVAL issues a new key and expires the old one
+        old = self.login('phone')
+        DeviceToken.objects.update(expires=timezone.now() + timedelta(days=1))
+
+        new = self.login('phone')
+
+        self.assertNotEqual(new, old)
+        self.assertLessEqual(DeviceToken.objects.get(key=old).expires, timezone.now())
+
+    def test_login_without_device_renews_shared_token(self):
+        # Test a second client without a device name renews the shared token instead of logging the first one out
+        old = self.login()
+        DeviceToken.objects.update(expires=timezone.now() + timedelta(days=1))
+
+        new = self.login()
+
+        self.assertEqual(new, old)
+        self.assertGreater(DeviceToken.objects.get(key=old).expires, timezone.now() + timedelta(days=29))
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + old)
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 200)
+
+    @override_settings(ACCOUNT_DEVICE_TOKENS={'MAX_DEVICES': 1})
+    def test_max_devices(self):
+        # Test a login past MAX_DEVICES expires the oldest device's token
+        phone = self.login('phone')
+        laptop = self.login('laptop')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + phone)
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + laptop)
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 200)
+
+    def test_password_change_expires_tokens(self):
+        # Test changing the password expires every device token of the user
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.login())
+        self.client.put(reverse('api-change-password'), {
+            'old_password': 'pass123', 'new_password': 'pass456', 'confirm_password': 'pass456'})
+
+        self.assertEqual(self.client.get(reverse('api-me')).status_code, 401)
+        self.assertFalse(DeviceToken.objects.filter(expires__gt=timezone.now()).exists())
+
+    def test_prune_tokens(self):
+        # Test expired device tokens and the legacy tokens of deactivated users are deleted in batches
+        self.login('phone')
+        self.login('laptop')
+        live = self.login('tablet')
+        DeviceToken.objects.exclude(key=live).update(expires=timezone.now())
+        inactive = get_user_model().objects.create_user(email='m3n@gmail.com', first_name='Maen',
+                                                        last_name='Ibreigheith', gender='M', password='pass123')
+        Token.objects.create(user=inactive)
+        Token.objects.create(user=self.user)
+        get_user_model().objects.filter(pk=inactive.pk).update(is_active=False)
+
+        out = io.StringIO()
+        call_command('prune_tokens', dry_run=True, stdout=out)
+        self.assertIn('3 tokens would be pruned', out.getvalue())
+
+        call_command('prune_tokens', batch_size=1, pause=0, stdout=out)
+        self.assertEqual(list(DeviceToken.objects.values_list('key', flat=True)), [live])
+        self.assertEqual(list(Token.objects.values_list('user_id', flat=True)), [self.user.pk])
+
+
+'''
+    Startup Profile Test Cases
+'''
+
+
+class StartupProfileTests(TestCase):
+
+    def test_profiles(self):
+        # Test the api profile drops what only the full profile needs and unknown profiles are refused
+        apps = ['django.contrib.admin', 'django.contrib.auth', 'account']
+        self.assertEqual(app_profile(env={}), 'full')
+        self.assertEqual(for_profile(apps, 'full'), apps)
+        self.assertEqual(for_profile(apps, app_profile(env={'APP_PROFILE': 'api'})),
+                         ['django.contrib.auth', 'account'])
+        self.assertFalse(warm_up_enabled(env={'APP_WARM_UP': '0'}))
+
+        with self.assertRaises(ValueError):
+            app_profile(env={'APP_PROFILE': 'minimal'})
+
+    def test_api_profile_boot(self):
+        # Test an api worker boots without the admin, docs, sessions, coreapi or Pillow and still serves the API
+        script = ('import json, sys\n'
+                  'from django.urls import resolve\n'
+                  'from Task1.wsgi import application\n'
+                  'print(json.dumps([resolve("/users/me/").url_name,'
+                  ' [name for name in sys.argv[1:] if sys.modules.get(name) is not None]]))\n')
+        heavy = ['coreapi', 'requests', 'PIL', 'django.contrib.sessions.backends.base', 'rest_framework.documentation']
+        env = dict(os.environ, APP_PROFILE='api', DJANGO_SETTINGS_MODULE='Task1.settings')
+        output = subprocess.run([sys.executable, '-c', script] + heavy, env=env, check=True, capture_output=True,
+                                text=True, cwd=settings.BASE_DIR).stdout
+
+        self.assertEqual(json.loads(output), ['api-me', []])
+
+    @override_settings(ACCOUNT_EMAIL_FILTER={'ENABLED': False})
+    def test_warm_up(self):
+        # Test the warm up runs against the full profile's URLconf
+        self.assertGreater(warm_up(), 0)
+
+
+'''
+    Bulk Operations Test Cases
+'''
+
+
+class BulkOperationsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        get_token_cache().clear()
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(email='m3n@gmail.com', first_name='Maen',
+                                                   last_name='Ibreigheith', gender='M', password='pass123')
+        self.client.force_authenticate(self.admin)
+        self.user = User.objects.create_user(email='seif@acme.com', first_name='Seif', last_name='Obied',
+                                             gender='M', password='pass123')
+        self.other = User.objects.create_user(email='sara@acme.com', first_name='Sara', last_name='Obied',
+                                              gender='F', password='pass123')
+        self.token = issue_device_token(self.user)
+
+    def test_deactivate_by_domain(self):
+        # Test deactivating a domain revokes the users' tokens, one UPDATE per chunk and no model loaded
+        user_client = APIClient()
+        user_client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.assertEqual(user_client.get(reverse('api-me')).status_code, 200)
+
+        with mock.patch('django.db.models.Model.__init__', side_effect=AssertionError('model loaded')):
+            counts = bulk_apply(get_user_model().all_with_inactive.filter(email__iendswith='@acme.com'),
+                                'deactivate', chunk_size=1)
+
+        self.assertEqual(counts, {'updated': 2, 'revoked_tokens': 1})
+        self.assertEqual(get_user_model().objects.count(), 1)
+        self.assertEqual(get_user_model().all_with_inactive.get(pk=self.user.pk).token_version, 1)
+        self.assertEqual(user_client.get(reverse('api-me')).status_code, 401)
+
+    def test_bulk_endpoint(self):
+        # Test the endpoint dry runs, deactivates all but the caller and reactivates
+        body = {'action': 'deactivate', 'filters': {'gender': 'M'}}
+        res = self.client.post(reverse('api-bulk'), dict(body, dry_run=True), format='json')
+        self.assertEqual(res.data, {'matched': 1})
+        self.assertTrue(get_user_model().objects.filter(pk=self.user.pk).exists())
+
+        res = self.client.post(reverse('api-bulk'), body, format='json')
+        self.assertEqual(res.data, {'updated': 1, 'revoked_tokens': 1})
+
+        res = self.client.post(reverse('api-bulk'), {'action': 'reactivate', 'ids': [self.user.pk]}, format='json')
+        self.assertEqual(res.data['updated'], 1)
+        self.assertIsNone(get_user_model().objects.get(pk=self.user.pk).deactivated_at)
+
+    def test_bulk_update_fields(self):
+        # Test patches are validated against the model and bump the profile version
+        res = self.client.post(reverse('api-bulk'), {'action': 'update', 'filters': {'email_domain': 'acme.com'},
+                                                     'fields': {'last_name': 'Smith', 'is_staff': True}},
+                               format='json')
+
+        self.assertEqual(res.data['updated'], 2)
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual((user.last_name, user.is_staff, user.profile_version), ('Smith', True, 1))
+
+        for body in ({'action': 'update', 'ids': [self.user.pk], 'fields': {'email': 'x@acme.com'}},
+                     {'action': 'update', 'ids': [self.user.pk], 'fields': {'gender': 'X'}},
+                     {'action': 'deactivate', 'filters': {}}):
+            self.assertEqual(self.client.post(reverse('api-bulk'), body, format='json').status_code, 400)
+
+    def test_bulk_requires_admin(self):
+        # Test regular users can't run bulk actions
+        self.client.force_authenticate(self.user)
+        res = self.client.post(reverse('api-bulk'), {'action': 'deactivate', 'ids': [self.other.pk]}, format='json')
+
+        self.assertEqual(res.status_code, 403)
+
+
+'''
+    Email Filter Test Cases
+'''
+
+
+@override_settings(ACCOUNT_EMAIL_FILTER={'CAPACITY': 1000, 'REFRESH_INTERVAL': None})
+class EmailFilterTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+        self.filter = get_email_filter()
+        self.filter.build()
+        self.payload = {'email': 'm3n@gmail.com', 'first_name': 'Maen', 'last_name': 'Ibreigheith', 'gender': 'M',
+                        'password': 'pass123', 'confirm_password': 'pass123'}
+
+    def test_no_false_negatives(self):
+        # Test every added email is found and few others are
+        bloom = EmailFilter(capacity=1000, error_rate=0.01, refresh_interval=None)
+        bloom.ready = True
+        for i in range(1000):
+            bloom.add('user{}@example.com'.format(i))
+
+        self.assertTrue(all(bloom.might_contain('USER{}@example.com'.format(i)) for i in range(1000)))
+        false_positives = sum(bloom.might_contain('other{}@example.com'.format(i)) for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_signup_skips_uniqueness_query(self):
+        # Test a definite miss validates without a query and a taken email still goes to the database
+        with self.assertNumQueries(0):
+            self.assertTrue(CreateUserSerializer(data=self.payload).is_valid())
+        with self.assertNumQueries(1):
+            serializer = CreateUserSerializer(data=dict(self.payload, email='seif@gmail.com'))
+            self.assertFalse(serializer.is_valid())
+        self.assertIn('email', serializer.errors)
+
+    def test_created_users_are_added(self):
+        # Test signups are added as they are saved
+        self.assertFalse(self.filter.might_contain('m3n@gmail.com'))
+        self.client.post(reverse('api-create-user'), self.payload)
+
+        self.assertTrue(self.filter.might_contain('m3n@gmail.com'))
+
+    def test_stale_filter_falls_back_to_the_constraint(self):
+        # Test a user the filter missed is still rejected by the unique constraint, and picked up on catch up
+        get_user_model().objects.bulk_create([get_user_model()(email='m3n@gmail.com', first_name='Maen',
+                                                               last_name='Ibreigheith', gender='M')])
+
+        res = self.client.post(reverse('api-create-user'), self.payload)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data['email'], ['user with this email already exists.'])
+
+        with mock.patch.object(self.filter, 'refresh_interval', 0):
+            self.assertTrue(self.filter.might_contain('m3n@gmail.com'))
+
+    def test_stale_filter_on_update_is_a_bad_request(self):
+        # Test changing to an email the filter missed is rejected like a signup, not a server error
+        get_user_model().objects.bulk_create([get_user_model()(email='m3n@gmail.com', first_name='Maen',
+                                                               last_name='Ibreigheith', gender='M')])
+        self.client.force_authenticate(self.user)
+
+        res = self.client.patch(reverse('api-me'), {'email': 'm3n@gmail.com'})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.data['email'], ['user with this email already exists.'])
+        self.assertEqual(get_user_model().objects.get(pk=self.user.pk).email, 'seif@gmail.com')
+
+    def test_catch_up_sees_changed_emails(self):
+        # Test an email changed by another process, deactivated users' included, is picked up on catch up
+        get_user_model().all_with_inactive.filter(email='seif@gmail.com').update(
+            email='saif@gmail.com', is_active=False, profile_modified=timezone.now())
+        self.assertFalse(self.filter.might_contain('saif@gmail.com'))
+
+        with mock.patch.object(self.filter, 'refresh_interval', 0):
+            self.assertTrue(self.filter.might_contain('saif@gmail.com'))
+
+    def test_email_available(self):
+        # Test the endpoint answers misses from the filter and hits from the database
+        url = reverse('api-email-available')
+        with self.assertNumQueries(0):
+            res = self.client.get(url, {'email': 'm3n@gmail.com'})
+        self.assertEqual(res.data, {'email': 'm3n@gmail.com', 'available': True})
+        self.assertFalse(self.client.get(url, {'email': 'seif@gmail.com'}).data['available'])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+
+'''
+    Password Hasher Profile Test Cases
+'''
+
+
+class HasherProfileTests(TestCase):
+
+    def setUp(self):
+        get_login_guard().backend.reset()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='seif@gmail.com',
+            first_name='Seif',
+            last_name='Obied',
+            gender='M',
+            password='pass123'
+        )
+
+    def test_profile_sets_iterations(self):
+        # Test new hashes use the profile's iterations, ITERATIONS overrides it and unknown profiles are refused
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$600000$'))
+        with override_settings(ACCOUNT_PASSWORD_HASHING={'ITERATIONS': 100000}):
+            self.assertTrue(make_password('pass123').startswith('pbkdf2_sha256$100000$'))
+        with override_settings(ACCOUNT_PASSWORD_HASHING={'PROFILE': 'nope'}):
+            with self.assertRaises(ValueError):
+                profile_iterations()
+
+    @override_settings(ACCOUNT_PASSWORD_HASHING={'ITERATIONS': 100000})
+    def test_login_rehashes_outdated_hash(self):
+        # Test a successful login rewrites a hash of another cost once, a failed one leaves it alone
+        self.client.post(reverse('api-login'), {'email': self.user.email, 'password': 'wrong'})
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$600000$'))
+
+        res = self.client.post(reverse('api-login'), {'email': self.user.email, 'password': 'pass123'})
+        self.assertEqual(res.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$100000$'))
+        self.assertTrue(self.user.check_password('pass123'))
+
+        rehashed = self.user.password
+        self.client.post(reverse('api-login'), {'email': self.user.email, 'password': 'pass123'})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password, rehashed)
+
+    @override_settings(ACCOUNT_PASSWORD_HASHING={'ITERATIONS': 100000})
+    def test_async_login_rehashes_outdated_hash(self):
+        # Test the async login upgrades the hash like the sync one
+        res = self.client.post(reverse('async-login'), {'email': self.user.email, 'password': 'pass123'},
+                               format='json')
+
+        self.assertEqual(res.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$100000$'))
+
+    def test_hash_report(self):
+        # Test the report counts users per algorithm and cost and the hashes left to upgrade
+        hasher = PBKDF2SHA1PasswordHasher()
+        for email, password in (('sha1@gmail.com', hasher.encode('pass123', hasher.salt(), 1000)),
+                                ('unusable@gmail.com', make_password(None))):
+            get_user_model().objects.create(email=email, first_name='Maen', last_name='Ibreigheith', gender='M',
+                                            password=password)
+        out = io.StringIO()
+        call_command('hash_report', stdout=out)
+
+        output = out.getvalue()
+        self.assertRegex(output, r'pbkdf2_sha256\s+iterations=600000\s+1\s')
+        self.assertRegex(output, r'pbkdf2_sha1\s+iterations=1000\s+1\s')
+        self.assertRegex(output, r'unusable\s+1\s')
+        self.assertIn('1 of 3 users will be rehashed', output)
+
+    def test_calibrate(self):
+        # Test calibration scales the probe's cost to the target and doesn't go under the minimum
+        with mock.patch('account.hashers.time_hash', side_effect=lambda iterations, samples: iterations * 1e-6):
+            iterations, seconds = calibrate(0.25)
+            self.assertEqual((iterations, seconds), (250000, 0.25))
+            self.assertIsInstance(iterations, int)
+            self.assertEqual(calibrate(0.001)[0], MIN_ITERATIONS)
+
+
+'''
+    Audit Log Test Cases
+'''
+
+
+@override_settings(ACCOUNT_AUDIT_LOG={'FLUSH_INTERVAL': None})
+class AuditLogTests(TestCase):
+
+    def setUp(self):
+        get_login_guard().backend.reset()
+        get_token_cache().clear()
+        self.client = APIClient()
+        User = get_user_model()
+        self.user = User.objects.create_user(email='seif@gmail.com', first_name='Seif', last_name='Obied',
+                                             gender='M', password='pass123')
+        self.admin = User.objects.create_superuser(email='m3n@gmail.com', first_name='Maen',
+                                                   last_name='Ibreigheith', gender='M', password='pass123')
+        self.audit_log = get_audit_log()
+        # Events other test classes recorded, written outside their transactions when the override stopped their log
+        AuditEvent.objects.all().delete()
+
+    def test_account_changes_recorded(self):
+        # Test login, profile updates and password changes are buffered on commit and written by flush()
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(reverse('api-login'), {'email': 'seif@gmail.com', 'password': 'pass123',
+                                                          'device': 'phone'})
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + res.data['token'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('api-me'), {'first_name': 'Saif'})
+            self.client.put(reverse('api-change-password'), {'old_password': 'pass123', 'new_password': 'pass1234',
+                                                              'confirm_password': 'pass1234'})
+        self.assertFalse(AuditEvent.objects.exists())
+
+        self.assertEqual(self.audit_log.flush(), 3)
+        events = list(AuditEvent.objects.order_by('id').values_list('event', 'user_id', 'actor_id', 'ip', 'data'))
+        self.assertEqual(events, [
+            ('login', self.user.id, None, '127.0.0.1', {'device': 'phone'}),
+            ('profile_update', self.user.id, None, '127.0.0.1', {'fields': ['first_name']}),
+            ('password_change', self.user.id, None, '127.0.0.1', {}),
+        ])
+
+    def test_admin_actions_record_actor(self):
+        # Test deactivations and bulk operations by an admin record them as the actor
+        self.client.force_authenticate(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('api-detail', args=[self.user.id]))
+            self.client.post(reverse('api-bulk'), {'action': 'update', 'ids': [self.user.id],
+                                                   'fields': {'is_staff': True}}, format='json')
+        self.audit_log.flush()
+
+        deactivate, bulk = AuditEvent.objects.order_by('id')
+        self.assertEqual((deactivate.event, deactivate.user_id, deactivate.actor_id),
+                         ('deactivate', self.user.id, self.admin.id))
+        self.assertEqual((bulk.event, bulk.user_id, bulk.actor_id), ('bulk', None, self.admin.id))
+        self.assertEqual(bulk.data, {'action': 'update', 'fields': ['is_staff'], 'updated': 1, 'revoked_tokens': 0})
+
+    def test_full_buffer_drops_events(self):
+        # Test events over the buffer size are dropped and counted instead of blocking
+        audit_log = AuditLog(buffer_size=2, flush_interval=None)
+        added = [audit_log.add(AuditEvent(event='login', user_id=self.user.id)) for _ in range(3)]
+
+        self.assertEqual(added, [True, True, False])
+        self.assertEqual(audit_log.flush(), 2)
+        self.assertEqual(audit_log.stats(), {'enqueued': 2, 'written': 2, 'dropped': 1, 'failed': 0, 'pending': 0})
+
+    def test_writer_reopens_connection_after_failure(self):
+        # Test the writer thread checks its connection before a batch and again once writing it failed
+        audit_log = AuditLog(flush_interval=0.05)
+        audit_log._write = lambda batch: 0
+        with mock.patch('account.audit.close_old_connections') as close_old_connections:
+            audit_log.add(AuditEvent(event='login', user_id=self.user.id))
+            # Once the writer took the event, stop() waits for it to finish the batch
+            deadline = time.monotonic() + 5
+            while audit_log.stats()['pending'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            audit_log.stop()
+
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    def test_writer_batches_and_stop_drains(self):
+        # Test the writer thread writes full batches without waiting and stop() leaves nothing behind
+        batches = []
+        audit_log = AuditLog(batch_size=2, flush_interval=0.05)
+        audit_log._write = lambda batch: batches.append(batch) or len(batch)
+        for _ in range(5):
+            audit_log.add(AuditEvent(event='login', user_id=self.user.id))
+        audit_log.stop()
+
+        self.assertEqual(len(batches[0]), 2)
+        self.assertEqual(sum(len(batch) for batch in batches), 5)
+        self.assertFalse(audit_log._writer.is_alive())
+
+    def test_query_endpoints(self):
+        # Test the admin endpoint pages through every event newest first and users only see their own
+        now = timezone.now()
+        AuditEvent.objects.bulk_create(
+            [AuditEvent(created=now - timedelta(minutes=i), event='login', user_id=self.user.id) for i in range(3)]
+            + [AuditEvent(created=now, event='login', user_id=self.admin.id)])
+
+        self.client.force_authenticate(self.admin)
+        res = self.client.get(reverse('api-audit'), {'user': self.user.id, 'page_size': 2})
+        newest = AuditEvent.objects.filter(user_id=self.user.id).order_by('-created').values_list('id', flat=True)
+        self.assertEqual([event['id'] for event in res.data['results']], list(newest[:2]))
+        res = self.client.get(res.data['next'])
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIsNone(res.data['next'])
+        res = self.client.get(reverse('api-audit'), {'since': (now - timedelta(seconds=30)).isoformat()})
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertEqual(self.client.get(reverse('api-audit'), {'since': 'yesterday'}).status_code, 400)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(reverse('api-audit')).status_code, 403)
+        res = self.client.get(reverse('api-my-audit'))
+        self.assertEqual({event['user_id'] for event in res.data['results']}, {self.user.id})
+        self.assertEqual(len(res.data['results']), 3)
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'BACKEND': 'memory',
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'account:throttle:',
+    'MAX_KEYS': 100000,
+    'IP_RATE': '20/min',
+    'EMAIL_RATE': '5/min',
+    'LOCKOUT': 30,
+    'MAX_LOCKOUT': 3600,
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    # '20/min' -> (20, 60), same notation as DRF's DEFAULT_THROTTLE_RATES
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class MemoryBackend:
+    """
+    Per process state kept in an LRU bounded dict, every operation is a constant number of dict lookups
+    """
+
+    def __init__(self, max_keys=DEFAULTS['MAX_KEYS']):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._locks = OrderedDict()
+        self._mutex = threading.Lock()
+
+    def hit(self, key, window, now):
+        # Counts one attempt and returns the sliding window estimate including it
+        index = int(now // window)
+        with self._mutex:
+            start, current, previous = self._windows.pop(key, (index, 0, 0))
+            if start != index:
+                previous = current if start == index - 1 else 0
+                current = 0
+            current += 1
+            self._windows[key] = (index, current, previous)
+            self._trim(self._windows)
+        return _estimate(current, previous, now, window)
+
+    def locked_until(self, key):
+        with self._mutex:
+            entry = self._locks.get(key)
+        return entry[0] if entry else 0
+
+    def lock(self, key, base, maximum, now):
+        # Locks the key for base * 2 ** strikes seconds, strikes survive until twice the maximum lockout passed
+        with self._mutex:
+            until, strikes, forget_at = self._locks.pop(key, (0, 0, 0))
+            if forget_at < now:
+                strikes = 0
+            duration = min(base * 2 ** strikes, maximum)
+            self._locks[key] = (now + duration, strikes + 1, now + duration + 2 * maximum)
+            self._trim(self._locks)
+        return duration
+
+    def reset(self):
+        with self._mutex:
+            self._windows.clear()
+            self._locks.clear()
+
+    def _trim(self, entries):
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+
+
+class CacheBackend:
+    """
+    Shared state in one of Django's caches so every worker process sees the same counters, one get_many and
+    one incr per check
+    """
+
+    def __init__(self, cache, prefix=DEFAULTS['KEY_PREFIX']):
+        self.cache = cache
+        self.prefix = prefix
+
+    def hit(self, key, window, now):
+        index = int(now // window)
+        current_key = '{}w:{}:{}'.format(self.prefix, key, index)
+        previous_key = '{}w:{}:{}'.format(self.prefix, key, index - 1)
+        if not self.cache.add(current_key, 1, 2 * window):
+            try:
+                current = self.cache.incr(current_key)
+            except ValueError:
+                # Expired between add() and incr()
+                self.cache.set(current_key, 1, 2 * window)
+                current = 1
+        else:
+            current = 1
+        previous = self.cache.get(previous_key, 0)
+        return _estimate(current, previous, now, window)
+
+    def locked_until(self, key):
+        entry = self.cache.get('{}l:{}'.format(self.prefix, key))
+        return entry[0] if entry else 0
+
+    def lock(self, key, base, maximum, now):
+        lock_key = '{}l:{}'.format(self.prefix, key)
+        until, strikes = self.cache.get(lock_key, (0, 0))
+        duration = min(base * 2 ** strikes, maximum)
+        self.cache.set(lock_key, (now + duration, strikes + 1), duration + 2 * maximum)
+        return duration
+
+    def reset(self):
+        pass
+
+
+def _estimate(current, previous, now, window):
+    # Weights the previous fixed window by how much of it still overlaps the sliding one
+    elapsed = (now % window) / window
+    return current + previous * (1 - elapsed)
+
+
+class LoginGuard:
+    """
+    Sliding window limits on login attempts per client IP and per email, exceeding a limit locks that IP or
+    email out for an exponentially growing period. Rejections never reach the password hasher
+    """
+
+    def __init__(self, backend, ip_rate=DEFAULTS['IP_RATE'], email_rate=DEFAULTS['EMAIL_RATE'],
+                 lockout=DEFAULTS['LOCKOUT'], max_lockout=DEFAULTS['MAX_LOCKOUT']):
+        self.backend = backend
+        self.rates = {'ip': parse_rate(ip_rate), 'email': parse_rate(email_rate)}
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+
+    @classmethod
+    def from_settings(cls):
+        conf = dict(DEFAULTS, **getattr(settings, 'ACCOUNT_LOGIN_THROTTLE', {}))
+        if conf['BACKEND'] == 'cache':
+            backend = CacheBackend(caches[conf['CACHE_ALIAS']], conf['KEY_PREFIX'])
+        else:
+            backend = MemoryBackend(conf['MAX_KEYS'])
+        return cls(backend, conf['IP_RATE'], conf['EMAIL_RATE'], conf['LOCKOUT'], conf['MAX_LOCKOUT'])
+
+    def check(self, ip, email=None):
+        # Returns None when the attempt may go ahead, otherwise the number of seconds to wait
+        now = time.time()
+        keys = [('ip', 'ip:{}'.format(ip))]
+        if email:
+            keys.append(('email', 'email:{}'.format(email.strip().lower())))
+
+        wait = max(self.backend.locked_until(key) for kind, key in keys) - now
+        if wait > 0:
+            return wait
+
+        for kind, key in keys:
+            limit, window = self.rates[kind]
+            if self.backend.hit(key, window, now) > limit:
+                return self.backend.lock(key, self.lockout, self.max_lockout, now)
+        return None
+
+
+_login_guard = None
+
+
+def get_login_guard():
+    global _login_guard
+    if _login_guard is None:
+        _login_guard = LoginGuard.from_settings()
+    return _login_guard
+
+
+def _reload_login_guard(*args, **kwargs):
+    global _login_guard
+    if kwargs.get('setting') in ('ACCOUNT_LOGIN_THROTTLE', 'CACHES'):
+        _login_guard = None
+
+
+setting_changed.connect(_reload_login_guard)
+
+
+def client_ip(request):
+    """
+    The login guard's per IP key. DRF's get_ident trusts the whole X-Forwarded-For unless NUM_PROXIES is set, which
+    would let a client pick a fresh key for every attempt
+    """
+    if api_settings.NUM_PROXIES is None:
+        return request.META.get('REMOTE_ADDR') or ''
+    return BaseThrottle().get_ident(request)
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    DRF throttle for the login action, checked in initial() so before AuthTokenSerializer runs authenticate()
+    """
+
+    def allow_request(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        self.wait_time = get_login_guard().check(client_ip(request), email if isinstance(email, str) else None)
+        return self.wait_time is None
+
+    def wait(self):
+        return self.wait_time
@@ -1,5 +1,6 @@
 from django.urls import path, include
 from .views import UserRelatedView
+from . import async_views
 from rest_framework import routers
 
 router = routers.DefaultRouter()
@@ -7,5 +8,8 @@ router = routers.DefaultRouter()
 router.register(r'users', UserRelatedView, basename='api')
 
 urlpatterns = [
+    path('async/users/', async_views.user_list, name='async-list'),
+    path('async/users/me/', async_views.me, name='async-me'),
+    path('async/users/login/', async_views.login, name='async-login'),
     path('', include(router.urls)),
 ]
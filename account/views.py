@@ -1,15 +1,48 @@
-from django.shortcuts import get_object_or_404
-from rest_framework import authentication, permissions, mixins
-from rest_framework.authtoken.models import Token
+import io
+
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import exceptions, permissions, mixins
+from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
 from rest_framework.viewsets import GenericViewSet
-from .serializers import UserSerializer, AuthTokenSerializer, PasswordChangeSerializer, CreateUserSerializer, \
-    UpdateUserSerializer
-from .models import User
+from . import metrics
+from .audit import get_audit_log, parse_audit_filters, record
+from .bulk import bulk_apply, targets
+from .authentication import DeviceTokenAuthentication, SignedTokenAuthentication, get_or_create_token, \
+    get_token_cache, issue_device_token, issue_token_pair, read_signed_token
+from .caching import profile_response
+from .emailfilter import email_might_exist, get_email_filter
+from .pagination import AuditCursorPagination, UserCursorPagination
+from .renderers import FastJSONRenderer
+from .routers import pin_primary, recently_wrote
+from .exporting import CONTENT_TYPES, GZIP_CONTENT_TYPE, export_filename, iter_export, parse_filters
+from .storage import release
+from .throttling import LoginRateThrottle
+from .hashing import hash_passwords
+from .importing import MAX_REPORTED_ERRORS, guess_format, import_users, iter_rows
+from .serializers import PROJECTABLE_FIELDS, parse_fields, UserRowSerializer, UserSerializer, AuthTokenSerializer, \
+    PasswordChangeSerializer, CreateUserSerializer, UpdateUserSerializer, RefreshTokenSerializer, \
+    BulkActionSerializer, AuditEventSerializer
+from .models import AuditEvent, User
 from rest_framework.response import Response
 from rest_framework import status
 
 
+def current_user(request):
+    """
+    The request's user as the primary has it now. request.user may be a TokenCache copy up to its TTL old, saving
+    that would write back whatever changed since, e.g. an admin's is_active=False or a token_version bump
+    """
+    user = User.objects.filter(pk=request.user.pk).first()
+    if user is None:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return user
+
+
 class UserRelatedView(mixins.RetrieveModelMixin,
                       mixins.UpdateModelMixin,
                       mixins.DestroyModelMixin,
@@ -21,55 +54,244 @@ class UserRelatedView(mixins.RetrieveModelMixin,
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    authentication_classes = [authentication.TokenAuthentication, ]
     permission_classes = [permissions.IsAdminUser]
+    pagination_class = UserCursorPagination
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Reads right after the user's own PATCH /users/me/ or change_password are served by the primary
+        if recently_wrote(request.user):
+            pin_primary()
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.action not in ('list', 'retrieve') and not (self.action == 'me' and self.request.method == 'GET'):
+            return renderers
+        # Read responses are plain dicts and lists, which FastJSONRenderer dumps in one call
+        return [FastJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+
+    def list(self, request, *args, **kwargs):
+        # Reads just the needed columns through values() and shapes the rows like UserSerializer, ?fields=id,email
+        # narrows them further, the cursor needs the id either way
+        fields = parse_fields(request.query_params['fields']) if 'fields' in request.query_params \
+            else PROJECTABLE_FIELDS
+        serializer = UserRowSerializer(fields, request)
+        queryset = self.filter_queryset(self.get_queryset()).values(*set(fields + ['id']))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.rows(page))
+        return Response(serializer.rows(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        return profile_response(request, self.get_object())
+
+    def deactivate(self, user):
+        # Soft delete, the avatar reference is dropped so its blob can be garbage collected
+        previous_image = user.image.name
+        with transaction.atomic():
+            user.is_active = False
+            user.deactivated_at = timezone.now()
+            user.image = None
+            user.revoke_tokens()
+            user.save()
+            user.touch_profile()
+            release(previous_image)
+        get_token_cache().invalidate_user(user)
 
     def update(self, request, *args, **kwargs):
-        instance = get_object_or_404()
+        instance = self.get_object()
         serializer = UpdateUserSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
             serializer.update(instance=instance, validated_data=serializer.validated_data)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            get_token_cache().invalidate_user(instance)
+            record(AuditEvent.PROFILE_UPDATE, instance, request, request.user,
+                   fields=sorted(serializer.validated_data))
+            return Response(UpdateUserSerializer(instance, context={'request': request}).data,
+                            status=status.HTTP_200_OK)
         return Response('Wrong input, Please provide all the required fields',
                         status=status.HTTP_400_BAD_REQUEST)
 
     def partial_update(self, request, *args, **kwargs):
-        instance = get_object_or_404()
+        instance = self.get_object()
         serializer = UpdateUserSerializer(data=request.data, partial=True)
         if serializer.is_valid(raise_exception=True):
             serializer.update(instance=instance, validated_data=serializer.validated_data)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            get_token_cache().invalidate_user(instance)
+            record(AuditEvent.PROFILE_UPDATE, instance, request, request.user,
+                   fields=sorted(serializer.validated_data))
+            return Response(UpdateUserSerializer(instance, context={'request': request}).data,
+                            status=status.HTTP_200_OK)
         return Response('Wrong input, Please provide all the required fields',
                         status=status.HTTP_400_BAD_REQUEST)
 
     def destroy(self, request, *args, **kwargs):
-        instance = get_object_or_404()
-        instance.is_active = False
-        instance.save()
+        user = self.get_object()
+        self.deactivate(user)
+        record(AuditEvent.DEACTIVATE, user, request, request.user)
         return Response('Object deactivated successfully', status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
     def create_user(self, request):
         serializer = CreateUserSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
-            serializer.create(validated_data=serializer.validated_data)
+            serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
+    @action(detail=False, methods=['get'], permission_classes=[permissions.AllowAny])
+    def email_available(self, request):
+        # ?email= is free for a signup, answered from the email filter alone whenever it is a definite miss
+        email = request.query_params.get('email', '').strip()
+        if not email:
+            return Response('Please provide the email to check', status=status.HTTP_400_BAD_REQUEST)
+        available = not email_might_exist(email) or not User.all_with_inactive.with_email(email).exists()
+        return Response({'email': email, 'available': available})
+
+    @action(detail=False, methods=['post'])
+    def bulk_create_users(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response('Please upload the users as a CSV or JSONL file in the file field',
+                            status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('format_type') or guess_format(upload.name)
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        created = rejected = 0
+        errors = []
+        try:
+            # Hashed within the import share of the process' hashing pool, never a pool of its own per upload
+            for chunk_created, chunk_errors in import_users(iter_rows(stream, fmt), hash_many=hash_passwords):
+                created += chunk_created
+                rejected += len(chunk_errors)
+                # Only the first MAX_REPORTED_ERRORS are kept, a file of bad rows must not grow the response
+                errors.extend(chunk_errors[:MAX_REPORTED_ERRORS - len(errors)])
+        except (ValueError, UnicodeDecodeError) as exc:
+            return Response(str(exc), status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': created, 'rejected': rejected, 'errors': errors},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Deactivates, reactivates or patches every user matching `ids` and/or the export `filters`, in chunked
+        UPDATEs. {"action": "update", "filters": {"email_domain": "example.com"}, "fields": {"is_staff": false}}
+        """
+        serializer = BulkActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        queryset = User.all_with_inactive.filter(**data.get('filters', {}))
+        if data.get('ids'):
+            queryset = queryset.filter(pk__in=data['ids'])
+        if data['action'] == 'deactivate':
+            # An admin offboarding a whole domain keeps their own account
+            queryset = queryset.exclude(pk=request.user.pk)
+        if data['dry_run']:
+            return Response({'matched': targets(queryset, data['action']).count()})
+        counts = bulk_apply(queryset, data['action'], data.get('fields'))
+        # One event for the whole operation, not one per user
+        record(AuditEvent.BULK, None, request, request.user, action=data['action'],
+               fields=sorted(data.get('fields', {})), **counts)
+        return Response(counts)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # ?output=ndjson|csv&gzip=1 plus the is_active, gender, email_domain, joined_after and joined_before filters
+        fmt = request.query_params.get('output', 'ndjson')
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        try:
+            queryset = User.all_with_inactive.filter(**parse_filters(request.query_params))
+            chunks = iter_export(queryset, fmt, compress=compress)
+        except ValueError as exc:
+            return Response(str(exc), status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(chunks, content_type=GZIP_CONTENT_TYPE if compress else CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(export_filename(fmt, compress))
+        return response
+
+    @action(detail=False, methods=['get'])
+    def metrics(self, request):
+        # Per route latency histograms in the Prometheus text format, for scraping
+        cache_stats = get_token_cache().stats()
+        counters = [
+            ('account_token_cache_{}_total'.format(name), 'Token cache {}'.format(name.replace('_', ' ')),
+             cache_stats[name])
+            for name in ('hits', 'shared_hits', 'misses', 'evictions')
+        ]
+        email_filter = get_email_filter()
+        if email_filter is not None:
+            filter_stats = email_filter.stats()
+            counters += [
+                ('account_email_filter_{}_total'.format(name), 'Email filter {}'.format(name), filter_stats[name])
+                for name in ('negatives', 'positives')
+            ]
+        audit_log = get_audit_log()
+        if audit_log is not None:
+            audit_stats = audit_log.stats()
+            counters += [
+                ('account_audit_events_{}_total'.format(name), 'Audit events {}'.format(name), audit_stats[name])
+                for name in ('enqueued', 'written', 'dropped', 'failed')
+            ]
+        return HttpResponse(metrics.registry.render(counters), content_type='text/plain; version=0.0.4')
+
+    @action(detail=False, methods=['get'])
+    def audit(self, request):
+        # Every user's audit events newest first, ?user=<id>&event=login&since=&until= narrow them down
+        return self.audit_page(request, AuditEvent.objects.all())
+
+    @action(detail=False, methods=['get'], url_path='me/audit', permission_classes=[permissions.IsAuthenticated])
+    def my_audit(self, request):
+        # The authenticated user's own audit events, same filters
+        return self.audit_page(request, AuditEvent.objects.filter(user_id=request.user.pk))
+
+    def audit_page(self, request, queryset):
+        try:
+            queryset = queryset.filter(**parse_audit_filters(request.query_params))
+        except ValueError as exc:
+            return Response(str(exc), status=status.HTTP_400_BAD_REQUEST)
+        paginator = AuditCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(AuditEventSerializer(page, many=True).data)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny],
+            throttle_classes=[LoginRateThrottle])
     def login(self, request):
         serializer = AuthTokenSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        token, created = Token.objects.get_or_create(user=user)
-        return Response({'token': token.key, 'user_id': user.id})
+        user_logged_in.send(sender=user.__class__, request=request, user=user)
+        response = {'user_id': user.id}
+        # Issue whichever kinds of token the configured authentication classes accept
+        authenticators = self.get_authenticators()
+        if any(isinstance(authenticator, DeviceTokenAuthentication) for authenticator in authenticators):
+            response['token'] = issue_device_token(user, serializer.validated_data['device']).key
+        elif any(isinstance(authenticator, TokenAuthentication) for authenticator in authenticators):
+            response['token'] = get_or_create_token(user).key
+        if any(isinstance(authenticator, SignedTokenAuthentication) for authenticator in authenticators):
+            response.update(issue_token_pair(user))
+        get_token_cache().invalidate_user(user)
+        record(AuditEvent.LOGIN, user, request, device=serializer.validated_data['device'])
+        return Response(response)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
+    def refresh_token(self, request):
+        # Trades a refresh token for a new access/refresh pair, unless the user was deactivated or revoked it.
+        # Refresh tokens are not rotated: the one sent stays valid until REFRESH_TTL or the next token_version bump
+        serializer = RefreshTokenSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_id, version = read_signed_token(serializer.validated_data['refresh'], 'refresh')
+        user = User.objects.filter(pk=user_id, is_active=True, token_version=version).first()
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        return Response(dict(issue_token_pair(user), user_id=user.id))
 
     @action(detail=False, methods=['put'], permission_classes=[permissions.IsAuthenticated])
     def change_password(self, request):
-        instance = request.user
-        serializer = PasswordChangeSerializer(data=request.data)
+        instance = current_user(request)
+        serializer = PasswordChangeSerializer(data=request.data, context={'request': request, 'user': instance})
         serializer.is_valid(raise_exception=True)
         instance.set_password(serializer.data.get('new_password'))
-        instance.save()
+        instance.revoke_tokens()
+        instance.save(update_fields=['password'])
+        get_token_cache().invalidate_user(instance)
+        record(AuditEvent.PASSWORD_CHANGE, instance, request)
         response = {
             'status': 'success',
             'code': status.HTTP_200_OK,
@@ -85,17 +307,18 @@ class UserRelatedView(mixins.RetrieveModelMixin,
         user = self.request.user
 
         if request.method == 'GET':
-            serializer = UserSerializer(user)
-            if user is None:
-                return Response(UserSerializer.errors,
-                                status=status.HTTP_404_NOT_FOUND)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return profile_response(request, user)
+        # Unsafe methods are pinned to the primary, which is where this reads from
+        user = current_user(request)
 
         if request.method == 'PUT':
             serializer = UpdateUserSerializer(data=request.data)
             if serializer.is_valid(raise_exception=True):
                 serializer.update(instance=user, validated_data=serializer.validated_data)
-                return Response(serializer.validated_data, status=status.HTTP_200_OK)
+                get_token_cache().invalidate_user(user)
+                record(AuditEvent.PROFILE_UPDATE, user, request, fields=sorted(serializer.validated_data))
+                return Response(UpdateUserSerializer(user, context={'request': request}).data,
+                                status=status.HTTP_200_OK)
             return Response('Wrong input, Please provide all the required fields {}',
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -103,12 +326,15 @@ class UserRelatedView(mixins.RetrieveModelMixin,
             serializer = UpdateUserSerializer(data=request.data, partial=True)
             if serializer.is_valid(raise_exception=True):
                 serializer.update(instance=user, validated_data=serializer.validated_data)
-                return Response(serializer.validated_data, status=status.HTTP_200_OK)
+                get_token_cache().invalidate_user(user)
+                record(AuditEvent.PROFILE_UPDATE, user, request, fields=sorted(serializer.validated_data))
+                return Response(UpdateUserSerializer(user, context={'request': request}).data,
+                                status=status.HTTP_200_OK)
             return Response('Wrong input, Please provide all the required fields {}',
                             status=status.HTTP_400_BAD_REQUEST)
 
         if request.method == 'DELETE':
             if user:
-                user.is_active = False
-                user.save()
+                self.deactivate(user)
+                record(AuditEvent.DEACTIVATE, user, request)
                 return Response('User deactivated', status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,53 @@
+"""
+Work a worker would otherwise do while answering its first requests, run from Task1/wsgi.py and asgi.py at boot
+(APP_WARM_UP) so it is paid before the worker takes traffic
+"""
+
+import time
+
+from django.urls import resolve, reverse
+from django.utils import translation
+from rest_framework.settings import api_settings
+
+from .authentication import get_token_cache
+from .emailfilter import start_email_filter
+from .serializers import AuthTokenSerializer, CreateUserSerializer, PasswordChangeSerializer, UpdateUserSerializer, \
+    UserRowSerializer, UserSerializer
+from .throttling import get_login_guard
+
+# URL names resolved at boot, which imports the URLconf with every view and compiles the patterns on the way
+ROUTES = ('api-login', 'api-me', 'api-list', 'async-login', 'async-me', 'async-list')
+
+# DRF imports the classes named in its settings on first use
+API_SETTINGS = (
+    'DEFAULT_AUTHENTICATION_CLASSES',
+    'DEFAULT_PERMISSION_CLASSES',
+    'DEFAULT_RENDERER_CLASSES',
+    'DEFAULT_PARSER_CLASSES',
+    'DEFAULT_THROTTLE_CLASSES',
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS',
+    'DEFAULT_PAGINATION_CLASS',
+)
+
+SERIALIZERS = (UserSerializer, UpdateUserSerializer, CreateUserSerializer, AuthTokenSerializer,
+               PasswordChangeSerializer)
+
+
+def warm_up():
+    # Returns the seconds spent
+    started = time.perf_counter()
+    for name in ROUTES:
+        resolve(reverse(name))
+    for name in API_SETTINGS:
+        getattr(api_settings, name)
+    # Builds the fields from the model's _meta, which caches what it looked up along the way
+    for serializer_class in SERIALIZERS:
+        serializer_class().fields
+    UserRowSerializer()
+    # Loads the message catalogs of the default language
+    translation.gettext('Invalid token.')
+    get_token_cache()
+    get_login_guard()
+    # Loads in the background, signups query the database as before until it is ready
+    start_email_filter()
+    return time.perf_counter() - started
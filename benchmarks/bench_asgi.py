@@ -0,0 +1,124 @@
+"""
+Bursts of requests against the async views under ASGI (coroutines gathered on one event loop) and the sync views
+under WSGI (a pool of THREADS worker threads, like gunicorn --threads), both at most CONCURRENCY in flight. Latency
+is counted from the start of the burst, so it includes the time a request waited for a worker. The async ORM still
+runs its queries on asgiref's single thread sensitive executor, what the event loop saves is a thread per waiting
+request. Runs against a throw-away SQLite file, concurrent threads lock each other out of a shared in memory one.
+
+Django's own middleware (sessions, csrf, messages, ...) is sync under ASGI, each of its hooks is another hop through
+that executor. --lean runs both servers with only account's natively async middleware, to show what the stack costs
+
+    python -m benchmarks.bench_asgi [--requests 2000] [--concurrency 500] [--threads 32] [--lean]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Django is configured when benchmarks.common is imported, so DATABASE_NAME has to be in place first
+_directory = tempfile.TemporaryDirectory()
+os.environ.setdefault('DATABASE_NAME', os.path.join(_directory.name, 'bench_asgi.sqlite3'))
+
+from benchmarks.common import DEFAULT_PASSWORD, report, seed_users, summarize  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import AsyncClient, Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from account.authentication import get_token_cache, issue_device_token  # noqa: E402
+from account.models import User  # noqa: E402
+
+# Logins are PBKDF2 bound, a tenth of the burst keeps the run short
+LOGIN_SHARE = 10
+
+
+def endpoints(user, admin):
+    # (scenario, method, sync url, async url, token, body)
+    login = {'email': user.email, 'password': DEFAULT_PASSWORD}
+    return (
+        ('GET users/me/', 'get', reverse('api-me'), reverse('async-me'), issue_device_token(user).key, None),
+        ('GET users/?fields=id,email', 'get', reverse('api-list') + '?fields=id,email',
+         reverse('async-list') + '?fields=id,email', issue_device_token(admin).key, None),
+        ('POST users/login/', 'post', reverse('api-login'), reverse('async-login'), None, login),
+    )
+
+
+def run_wsgi(method, path, token, body, requests, threads):
+    headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+    data = json.dumps(body) if body is not None else None
+
+    def call(_):
+        response = getattr(Client(), method)(path, data, content_type='application/json', **headers)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        finished = list(pool.map(call, range(requests)))
+    return summarize([end - started for end in finished], time.perf_counter() - started)
+
+
+def run_asgi(method, path, token, body, requests, concurrency):
+    headers = {'Authorization': 'Token ' + token} if token else {}
+    data = json.dumps(body) if body is not None else None
+
+    async def burst():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with slots:
+                response = await getattr(AsyncClient(), method)(path, data, content_type='application/json',
+                                                                headers=headers)
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter()
+
+        started = time.perf_counter()
+        finished = await asyncio.gather(*(call() for _ in range(requests)))
+        return summarize([end - started for end in finished], time.perf_counter() - started)
+
+    return asyncio.run(burst())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--lean', action='store_true')
+    options = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+    # Rejected requests are asserted on, the per request warnings would only drown the report
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    seed_users(1000)
+    user = User.objects.order_by('id').first()
+    admin = User.objects.order_by('id').last()
+    User.objects.filter(pk=admin.pk).update(is_staff=True)
+
+    middleware = [path for path in settings.MIDDLEWARE if path.startswith('account.')] if options.lean \
+        else settings.MIDDLEWARE
+    results = {}
+    # The whole burst logs in as one user from one address, the test clients send Host: testserver
+    with override_settings(ACCOUNT_LOGIN_THROTTLE={'IP_RATE': '1000000/s', 'EMAIL_RATE': '1000000/s'},
+                           ALLOWED_HOSTS=['*'], MIDDLEWARE=middleware):
+        for name, method, sync_path, async_path, token, body in endpoints(user, admin):
+            requests = options.requests // LOGIN_SHARE if method == 'post' else options.requests
+            get_token_cache().clear()
+            results['WSGI ' + name] = run_wsgi(method, sync_path, token, body, requests, options.threads)
+            get_token_cache().clear()
+            results['ASGI ' + name] = run_asgi(method, async_path, token, body, requests, options.concurrency)
+
+    report('Bursts of {} requests ({} for login), {} in flight, {} WSGI threads, {} middleware'.format(
+        options.requests, options.requests // LOGIN_SHARE, options.concurrency, options.threads,
+        'lean' if options.lean else 'full'), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Login latency without an audit log, with an INSERT per login inside the request, and with account.audit's batched
+writer, against a file backed SQLite database (--memory for the in-memory test database). Passwords are hashed with
+--iterations PBKDF2 iterations so the hash doesn't drown out the difference
+
+    python -m benchmarks.bench_audit [--logins 2000] [--iterations 1000] [--memory]
+"""
+
+import argparse
+import os
+import tempfile
+from unittest import mock
+
+USERS = 100
+
+
+def insert_now(event, user, request=None, actor=None, **data):
+    # What logging inside the request would cost, one INSERT before the response
+    from account.models import AuditEvent
+
+    AuditEvent.objects.create(event=event, user_id=user.pk, ip=request.META.get('REMOTE_ADDR'), data=data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=1000, help='PBKDF2 iterations of the seeded hashes')
+    parser.add_argument('--memory', action='store_true', help='Use the in-memory test database')
+    options = parser.parse_args(argv)
+    if not options.memory:
+        # Read by Task1/database.py when benchmarks.common sets Django up
+        os.environ['DATABASE_NAME'] = os.path.join(tempfile.mkdtemp(), 'bench_audit.sqlite3')
+
+    from benchmarks.common import DEFAULT_PASSWORD, measure, report, seed_users, setup_test_database
+
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+    from rest_framework.test import APIRequestFactory
+
+    from account.audit import get_audit_log
+    from account.models import AuditEvent, User
+    from account.views import UserRelatedView
+
+    with override_settings(ACCOUNT_PASSWORD_HASHING={'ITERATIONS': options.iterations},
+                           ACCOUNT_LOGIN_THROTTLE={'IP_RATE': '1000000/s', 'EMAIL_RATE': '1000000/s'}):
+        if options.memory:
+            setup_test_database()
+        else:
+            call_command('migrate', verbosity=0)
+        seed_users(USERS)
+        emails = list(User.objects.values_list('email', flat=True))
+        factory = APIRequestFactory()
+        view = UserRelatedView.as_view({'post': 'login'}, **UserRelatedView.login.kwargs)
+        counter = iter(range(10 ** 9))
+
+        def login():
+            email = emails[next(counter) % len(emails)]
+            response = view(factory.post('/users/login/', {'email': email, 'password': DEFAULT_PASSWORD}))
+            assert response.status_code == 200, response.data
+
+        results = {}
+        with override_settings(ACCOUNT_AUDIT_LOG={'ENABLED': False}):
+            results['no audit log'] = measure(login, iterations=options.logins)
+        with mock.patch('account.views.record', insert_now):
+            results['INSERT in the request'] = measure(login, iterations=options.logins)
+        AuditEvent.objects.all().delete()
+        results['batched writer'] = measure(login, iterations=options.logins)
+
+        audit_log = get_audit_log()
+        audit_log.stop()
+        report('{} logins per scenario, {} PBKDF2 iterations, {}'.format(
+            options.logins, options.iterations, 'in memory' if options.memory else 'SQLite file'), results)
+        stats = audit_log.stats()
+        print('batched writer: {enqueued} enqueued, {written} written, {dropped} dropped, {failed} failed'.format(
+            **stats))
+        assert AuditEvent.objects.count() == stats['written']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Offboarding USERS users, each with a device token: UserRelatedView.deactivate on every loaded instance, as
+`DELETE users/{id}/` does it, against account.bulk.bulk_apply's chunked UPDATEs
+
+    python -m benchmarks.bench_bulk [users]
+"""
+
+import sys
+import time
+from datetime import timedelta
+
+from benchmarks.common import seed_users, setup_test_database
+
+from django.db import connection
+from django.utils import timezone
+
+from account.bulk import bulk_apply
+from account.models import DeviceToken, User
+from account.views import UserRelatedView
+
+DEFAULT_USERS = 5000
+
+
+def main(users=DEFAULT_USERS):
+    setup_test_database()
+    seed_users(users * 2)
+    expires = timezone.now() + timedelta(days=30)
+    DeviceToken.objects.bulk_create(
+        [DeviceToken(key=DeviceToken.generate_key(), user_id=user_id, expires=expires)
+         for user_id in User.objects.values_list('pk', flat=True)], batch_size=1000)
+    ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    view = UserRelatedView()
+
+    def per_object():
+        for user in User.objects.filter(pk__in=ids[:users]):
+            view.deactivate(user)
+
+    def bulk():
+        bulk_apply(User.all_with_inactive.filter(pk__in=ids[users:]), 'deactivate')
+
+    print('Deactivating {} users with a device token each'.format(users))
+    print('{:<12} {:>10} {:>10} {:>12}'.format('approach', 'seconds', 'queries', 'users/s'))
+    for name, fn in (('per object', per_object), ('bulk', bulk)):
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+        print('{:<12} {:>10.2f} {:>10} {:>12.0f}'.format(name, elapsed, len(queries), users / elapsed))
+
+    assert not User.objects.exists()
+    assert not DeviceToken.objects.filter(expires__gt=timezone.now()).exists()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_USERS)
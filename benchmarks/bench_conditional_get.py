@@ -0,0 +1,67 @@
+"""
+A client polling `GET /users/me/` whose profile changes once every CHANGE_EVERY polls: plain GETs, conditional
+GETs replaying the last ETag, and conditional GETs with the serialized payload cached. Reports latency and the
+response bytes per poll
+"""
+
+from benchmarks.common import measure, report, seed_users, setup_test_database
+
+from django.core.cache import caches
+from django.test import override_settings
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.test import APIRequestFactory
+
+from account.authentication import CachedTokenAuthentication, get_or_create_token, get_token_cache
+from account.models import User
+from account.views import UserRelatedView
+
+CHANGE_EVERY = 50
+
+
+def main(iterations=3000):
+    setup_test_database()
+    seed_users(1000)
+    user = User.objects.order_by('id').first()
+    header = 'Token ' + get_or_create_token(user).key
+    factory = APIRequestFactory()
+    view = UserRelatedView.as_view({'get': 'me'}, authentication_classes=[CachedTokenAuthentication],
+                                   permission_classes=[IsAuthenticated])
+    results = {}
+    sizes = {}
+
+    scenarios = (
+        ('plain GET', False, False),
+        ('conditional GET', True, False),
+        ('conditional GET + payload cache', True, True),
+    )
+    for name, conditional, payload_cache in scenarios:
+        state = {'polls': 0, 'etag': None, 'bytes': 0}
+
+        def poll():
+            state['polls'] += 1
+            if state['polls'] % CHANGE_EVERY == 0:
+                user.touch_profile()
+                get_token_cache().invalidate_user(user)
+            extra = {'HTTP_IF_NONE_MATCH': state['etag']} if conditional and state['etag'] else {}
+            response = view(factory.get('/users/me/', HTTP_AUTHORIZATION=header, **extra))
+            if hasattr(response, 'render'):
+                response.render()
+            assert response.status_code in (200, 304), response.status_code
+            state['etag'] = response['ETag']
+            state['bytes'] += len(response.content)
+
+        caches['default'].clear()
+        get_token_cache().clear()
+        with override_settings(ACCOUNT_PROFILE_CACHE={'PAYLOAD_CACHE': payload_cache}):
+            results[name] = measure(poll, iterations=iterations)
+        sizes[name] = state['bytes'] / state['polls']
+
+    report('GET /users/me/ polling, profile changes every {} polls ({} polls)'.format(CHANGE_EVERY, iterations),
+           results)
+    print()
+    for name, size in sizes.items():
+        print('{:<32} {:>10.1f} body bytes/poll'.format(name, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+account.emailfilter at scale: build time, memory, lookup cost and measured false positive rate of the Bloom filter
+for each --emails count (generated in memory, no database), then signup validation and email_available throughput
+against a database of --db-users users with the filter disabled and enabled. Signup validation is what
+create_user does before hashing; hashing the password is the same either way and left out
+
+    python -m benchmarks.bench_email_filter [--emails 1000000 10000000] [--db-users 1000000] [--requests 2000]
+"""
+
+import argparse
+import time
+
+from benchmarks.common import DEFAULT_PASSWORD, measure, report, seed_users, setup_test_database
+
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from account.emailfilter import EmailFilter, get_email_filter
+from account.serializers import CreateUserSerializer
+from account.views import UserRelatedView
+
+PROBES = 100000
+
+
+def bench_filter(emails):
+    bloom = EmailFilter(capacity=emails, refresh_interval=None)
+    started = time.perf_counter()
+    for i in range(emails):
+        bloom.add('user{}@example.com'.format(i))
+    built = time.perf_counter() - started
+    bloom.ready = True
+
+    started = time.perf_counter()
+    false_positives = sum(bloom.might_contain('other{}@example.com'.format(i)) for i in range(PROBES))
+    lookup_us = (time.perf_counter() - started) / PROBES * 1e6
+    stats = bloom.stats()
+    print('{:>12,} {:>10.1f} {:>10.1f} {:>8} {:>10.2f} {:>8.2%}'.format(
+        emails, built, stats['bytes'] / 2 ** 20, stats['hashes'], lookup_us, false_positives / PROBES))
+
+
+def bench_signups(db_users, requests):
+    setup_test_database()
+    seed_users(db_users)
+    factory = APIRequestFactory()
+    # The router passes the action's own permission_classes as initkwargs
+    available = UserRelatedView.as_view({'get': 'email_available'}, **UserRelatedView.email_available.kwargs)
+    counter = iter(range(10 ** 9))
+
+    def signup():
+        email = 'new{}@example.com'.format(next(counter))
+        serializer = CreateUserSerializer(data={'email': email, 'first_name': 'New', 'last_name': 'User',
+                                                'gender': 'M', 'password': DEFAULT_PASSWORD,
+                                                'confirm_password': DEFAULT_PASSWORD})
+        assert serializer.is_valid(), serializer.errors
+
+    def check():
+        response = available(factory.get('/users/email_available/', {'email': 'new{}@x.com'.format(next(counter))}))
+        assert response.data['available']
+
+    results = {}
+    for name, conf in (('no filter', {'ENABLED': False}), ('filter', {'REFRESH_INTERVAL': None})):
+        with override_settings(ACCOUNT_EMAIL_FILTER=conf):
+            email_filter = get_email_filter()
+            if email_filter is not None:
+                started = time.perf_counter()
+                email_filter.build()
+                print('filter built from {:,} users in {:.1f}s, {:.1f} MiB'.format(
+                    db_users, time.perf_counter() - started, email_filter.stats()['bytes'] / 2 ** 20))
+            results['signup validation, ' + name] = measure(signup, iterations=requests)
+            results['email_available, ' + name] = measure(check, iterations=requests)
+    report('{:,} users in the database, {} requests per scenario'.format(db_users, requests), results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--emails', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--db-users', type=int, default=1000000)
+    parser.add_argument('--requests', type=int, default=2000)
+    options = parser.parse_args(argv)
+
+    print('Bloom filter at 1% target false positives, {:,} probes of absent emails'.format(PROBES))
+    print('{:>12} {:>10} {:>10} {:>8} {:>10} {:>8}'.format('emails', 'build s', 'MiB', 'hashes', 'lookup us',
+                                                           'fp rate'))
+    for emails in options.emails:
+        bench_filter(emails)
+    print()
+    bench_signups(options.db_users, options.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Rows/sec and peak Python heap of the streaming users export in every format
+
+    python -m benchmarks.bench_export 200000
+"""
+
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import seed_users, setup_test_database
+
+from account.exporting import iter_export
+from account.models import User
+
+
+def main(size=100000):
+    setup_test_database()
+    seed_users(size)
+
+    print('{:<12} {:>12} {:>12} {:>10}'.format('format', 'rows/s', 'MiB out', 'peak MiB'))
+    for fmt, compress in (('ndjson', False), ('ndjson', True), ('csv', False), ('csv', True)):
+        begin = time.perf_counter()
+        written = sum(len(chunk) for chunk in iter_export(User.objects.all(), fmt, compress=compress))
+        elapsed = time.perf_counter() - begin
+        # Second, traced pass for memory, tracemalloc would skew the timing
+        tracemalloc.start()
+        for chunk in iter_export(User.objects.all(), fmt, compress=compress):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{:<12} {:>12.0f} {:>12.1f} {:>10.1f}'.format(
+            fmt + ('.gz' if compress else ''), size / elapsed, written / 1024.0 / 1024.0, peak / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+"""
+Login latency and throughput at increasing concurrency with inline hashing against the bounded hashing pool
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import DEFAULT_PASSWORD, seed_users, setup_test_database, summarize
+
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from account.models import User
+from account.views import UserRelatedView
+
+CONCURRENCY = (1, 2, 4, 8, 16)
+REQUESTS_PER_CLIENT = 4
+
+
+def run_level(view, factory, emails, concurrency):
+    def login(email):
+        request = factory.post('/users/login/', {'email': email, 'password': DEFAULT_PASSWORD})
+        begin = time.perf_counter()
+        response = view(request)
+        return time.perf_counter() - begin, response.status_code
+
+    work = [emails[i % len(emails)] for i in range(concurrency * REQUESTS_PER_CLIENT)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(login, work))
+    elapsed = time.perf_counter() - started
+    row = summarize([t for t, code in outcomes if code == 200], elapsed)
+    row['rejected'] = sum(1 for t, code in outcomes if code == 503)
+    return row
+
+
+def main():
+    setup_test_database()
+    seed_users(64)
+    emails = list(User.objects.values_list('email', flat=True))
+    factory = APIRequestFactory()
+    view = UserRelatedView.as_view({'post': 'login'}, permission_classes=[])
+    # Issue the tokens up front so every measured login is read only
+    for email in emails:
+        view(factory.post('/users/login/', {'email': email, 'password': DEFAULT_PASSWORD}))
+
+    print('{:<8} {:>6} {:>10} {:>10} {:>10} {:>9}'.format('mode', 'conc', 'req/s', 'p50 ms', 'p99 ms', 'rejected'))
+    for mode, conf in (('inline', {'POOL_ENABLED': False}),
+                       ('pool', {'POOL_ENABLED': True, 'MAX_PENDING': 64})):
+        with override_settings(ACCOUNT_HASHING=conf):
+            for concurrency in CONCURRENCY:
+                row = run_level(view, factory, emails, concurrency)
+                print('{:<8} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>9}'.format(
+                    mode, concurrency, row['rps'], row['p50_ms'], row['p99_ms'], row['rejected']))
+
+
+if __name__ == '__main__':
+    main()
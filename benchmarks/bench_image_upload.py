@@ -0,0 +1,73 @@
+"""
+`PATCH /users/me/` latency for a multi-MB JPEG upload, with Pillow validating and resizing inside the request
+(the old behaviour) against the sniff-and-queue pipeline in account.images
+"""
+
+import io
+import os
+import tempfile
+from unittest import mock
+
+from benchmarks.common import measure, report, seed_users, setup_test_database
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from account.images import process_image, shutdown_image_workers
+from account.models import User
+from account.views import UserRelatedView
+
+
+class InlineUpdateUserSerializer(serializers.ModelSerializer):
+    # What the request did before, Pillow verifies the upload and the variants are built before responding
+    class Meta:
+        model = User
+        exclude = ['password']
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        if validated_data.get('image'):
+            process_image(instance.image.name)
+        return instance
+
+
+def make_photo(width=3000, height=2000):
+    # Noise compresses badly, which gives a realistically large file
+    image = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def main(iterations=10):
+    setup_test_database()
+    seed_users(1)
+    user = User.objects.get()
+    photo = make_photo()
+    factory = APIRequestFactory()
+    view = UserRelatedView.as_view({'patch': 'me'}, permission_classes=[IsAuthenticated])
+
+    def upload():
+        request = factory.patch('/users/me/', {'image': SimpleUploadedFile('photo.jpg', photo)}, format='multipart')
+        force_authenticate(request, user=user)
+        response = view(request)
+        # Closes the uploaded temporary files like the WSGI handler would
+        request.close()
+        assert response.status_code == 200, response.data
+
+    results = {}
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        with mock.patch('account.views.UpdateUserSerializer', InlineUpdateUserSerializer):
+            results['inline pillow'] = measure(upload, iterations=iterations, warmup=1)
+        results['background pipeline'] = measure(upload, iterations=iterations, warmup=1)
+        shutdown_image_workers()
+
+    report('PATCH /users/me/ with a {:.1f} MiB JPEG'.format(len(photo) / 1024.0 / 1024.0), results)
+
+
+if __name__ == '__main__':
+    main()
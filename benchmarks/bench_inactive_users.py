@@ -0,0 +1,76 @@
+"""
+Cost of listing, counting and looking up active users as the share of deactivated rows grows, with and without
+the partial indexes on active users. The active user count stays fixed, deactivated users are interleaved with them
+
+    python -m benchmarks.bench_inactive_users 0 0.5 0.9 0.99
+"""
+
+import sys
+
+from benchmarks.common import measure, report, seed_users, setup_test_database
+
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from account.models import User
+from account.views import UserRelatedView
+
+ACTIVE = 10000
+ROUNDS = 10
+DEFAULT_SHARES = (0, 0.5, 0.9)
+PARTIAL_INDEXES = [index for index in User._meta.indexes if index.condition is not None]
+
+
+def seed(share):
+    # ROUNDS slices of active users each followed by their share of deactivated ones
+    inactive = int(ACTIVE * share / (1 - share))
+    for _ in range(ROUNDS):
+        seed_users(ACTIVE // ROUNDS)
+        seed_users(inactive // ROUNDS, is_active=False)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def main(shares):
+    setup_test_database()
+    admin = User.objects.create_superuser(email='admin@example.com', first_name='Admin', last_name='Admin',
+                                          gender='M', password='pass123')
+    factory = APIRequestFactory()
+    view = UserRelatedView.as_view({'get': 'list'})
+    request = factory.get('/users/', {'fields': 'id,email'})
+    force_authenticate(request, user=admin)
+    email = 'user{}@example.com'.format(ACTIVE)
+
+    def list_page():
+        response = view(request)
+        response.render()
+        assert response.status_code == 200, response.status_code
+
+    scenarios = (
+        ('GET /users/ page', list_page),
+        ('count active', lambda: User.objects.count()),
+        ('by date_joined', lambda: list(User.objects.filter(date_joined__year=2000))),
+        ('email lookup', lambda: User.objects.with_email(email).first()),
+    )
+
+    for share in shares:
+        User.all_with_inactive.exclude(pk=admin.pk).delete()
+        seed(share)
+        results = {}
+        for name, fn in scenarios:
+            results[name + ' [partial]'] = measure(fn, iterations=50, warmup=2)
+        with connection.schema_editor() as editor:
+            for index in PARTIAL_INDEXES:
+                editor.remove_index(User, index)
+        for name, fn in scenarios:
+            results[name + ' [no index]'] = measure(fn, iterations=50, warmup=2)
+        with connection.schema_editor() as editor:
+            for index in PARTIAL_INDEXES:
+                editor.add_index(User, index)
+
+        report('{:.0%} deactivated, {} rows'.format(share, User.all_with_inactive.count()), results)
+        print()
+
+
+if __name__ == '__main__':
+    main([float(share) for share in sys.argv[1:]] or DEFAULT_SHARES)
@@ -0,0 +1,44 @@
+"""
+Per request overhead of account.metrics.MetricsMiddleware, measured through the full middleware stack. Both stacks
+are run alternately for a few rounds and the best round of each is kept, so drift doesn't favour either
+"""
+
+from benchmarks.common import measure, report, seed_users, setup_test_database
+
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings
+
+from account.authentication import issue_device_token
+from account.models import User
+
+MIDDLEWARE = 'account.metrics.MetricsMiddleware'
+
+
+def main(iterations=2000, rounds=5):
+    setup_test_database()
+    seed_users(100)
+    token = issue_device_token(User.objects.order_by('id').first())
+    results = {}
+
+    without = [middleware for middleware in settings.MIDDLEWARE if middleware != MIDDLEWARE]
+    for _ in range(rounds):
+        for name, middleware in (('without metrics', without), ('with metrics', [MIDDLEWARE] + without)):
+            with override_settings(MIDDLEWARE=middleware):
+                client = Client(HTTP_AUTHORIZATION='Token ' + token.key)
+
+                def request():
+                    response = client.get('/users/me/')
+                    assert response.status_code == 200, response.status_code
+
+                row = measure(request, iterations=iterations, warmup=100)
+                if name not in results or row['mean_ms'] < results[name]['mean_ms']:
+                    results[name] = row
+
+    report('GET /users/me/ ({} requests)'.format(iterations), results)
+    print('overhead: {:.1f} us/request'.format(
+        (results['with metrics']['mean_ms'] - results['without metrics']['mean_ms']) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Reads/sec of the users list query spread over 0, 1 and 2 SQLite replicas through account.routers.ReplicaRouter,
+while a writer thread keeps updating users on the primary. Each layout runs in its own process since the
+databases are configured from the environment, the replicas are copies of the primary taken after seeding.
+Readers share one Python process, so beyond moving them off the writer's locks (most visible with
+DATABASE_SQLITE_TUNING=0) the numbers scale with the cores available to SQLite
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+READERS = 4
+DURATION = 3.0
+
+
+def run_layout():
+    # Runs in the child process, DATABASE_NAME and DATABASE_REPLICAS are already in the environment
+    from benchmarks.common import seed_users
+
+    from django.core.management import call_command
+    from django.db import connections
+    from django.utils import timezone
+
+    from account.models import User
+    from account.routers import primary
+
+    call_command('migrate', verbosity=0)
+    with primary():
+        seed_users(1000)
+    connections.close_all()
+    primary = sqlite3.connect(os.environ['DATABASE_NAME'])
+    for replica in filter(None, os.environ['DATABASE_REPLICAS'].split(',')):
+        with sqlite3.connect(replica) as target:
+            primary.backup(target)
+    primary.close()
+
+    counts = []
+    done = threading.Event()
+
+    def reader():
+        count = 0
+        while not done.is_set():
+            list(User.objects.order_by('id').values_list('id', 'email', 'first_name', 'last_name')[:100])
+            count += 1
+        counts.append(count)
+        connections.close_all()
+
+    def writer():
+        user_ids = list(User.objects.values_list('id', flat=True))
+        i = 0
+        while not done.is_set():
+            User.objects.filter(pk=user_ids[i % len(user_ids)]).update(last_login=timezone.now())
+            i += 1
+        connections.close_all()
+
+    threads = [threading.Thread(target=reader) for _ in range(READERS)] + [threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    time.sleep(DURATION)
+    done.set()
+    for thread in threads:
+        thread.join()
+    return {'replicas': len(connections.settings) - 1, 'reads_per_sec': round(sum(counts) / DURATION, 1)}
+
+
+def main():
+    results = []
+    for replicas in (0, 1, 2):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DATABASE_PROFILE='sqlite', DATABASE_NAME=os.path.join(directory, 'primary.sqlite3'),
+                       DATABASE_REPLICAS=','.join(os.path.join(directory, 'replica{}.sqlite3'.format(number))
+                                                  for number in range(1, replicas + 1)))
+            command = [sys.executable, '-m', 'benchmarks.bench_replica_reads', '--layout']
+            output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print('{} reader threads and one writer for {}s'.format(READERS, DURATION))
+    print('{:<10}{:>16}'.format('replicas', 'reads/sec'))
+    for result in results:
+        print('{replicas:<10}{reads_per_sec:>16}'.format(**result))
+
+
+if __name__ == '__main__':
+    if '--layout' in sys.argv:
+        print(json.dumps(run_layout()))
+    else:
+        main()
@@ -0,0 +1,56 @@
+"""
+Per object cost of the users read path at 10k objects: UserSerializer over model instances against
+UserRowSerializer over values() rows, JSONRenderer against FastJSONRenderer, and the two end to end from the query.
+Every user has an avatar and a variant, so the image URLs are part of the cost
+
+    python -m benchmarks.bench_serializers [objects]
+"""
+
+import sys
+
+from benchmarks.common import measure, seed_users, setup_test_database
+
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+
+from account.models import User
+from account.renderers import FastJSONRenderer
+from account.serializers import PROJECTABLE_FIELDS, UserRowSerializer, UserSerializer
+
+DEFAULT_OBJECTS = 10000
+
+
+def main(objects=DEFAULT_OBJECTS):
+    setup_test_database()
+    seed_users(objects, image='uploads/ab/ab12cd.jpg', image_variants={'thumb': 'uploads/ab/ab12cd_thumb.webp'})
+    request = RequestFactory().get('/users/')
+    instances = list(User.objects.order_by('id'))
+    rows = list(User.objects.order_by('id').values(*PROJECTABLE_FIELDS))
+    data = UserRowSerializer(request=request).rows(rows)
+    assert UserSerializer(instances, many=True, context={'request': request}).data == data
+
+    def before():
+        JSONRenderer().render(UserSerializer(User.objects.order_by('id'), many=True, context={'request': request}).data)
+
+    def after():
+        FastJSONRenderer().render(UserRowSerializer(request=request).rows(
+            User.objects.order_by('id').values(*PROJECTABLE_FIELDS)))
+
+    scenarios = (
+        ('serialize: UserSerializer', lambda: UserSerializer(instances, many=True, context={'request': request}).data),
+        ('serialize: UserRowSerializer', lambda: UserRowSerializer(request=request).rows(rows)),
+        ('render: JSONRenderer', lambda: JSONRenderer().render(data)),
+        ('render: FastJSONRenderer', lambda: FastJSONRenderer().render(data)),
+        ('query+serialize+render: before', before),
+        ('query+serialize+render: after', after),
+    )
+
+    print('Users read path, {} objects per run'.format(objects))
+    print('{:<34} {:>12} {:>12}'.format('scenario', 'us/object', 'ms/run'))
+    for name, fn in scenarios:
+        result = measure(fn, iterations=5, warmup=1)
+        print('{:<34} {:>12.2f} {:>12.1f}'.format(name, result['p50_ms'] * 1000 / objects, result['p50_ms']))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_OBJECTS)
@@ -0,0 +1,104 @@
+"""
+Concurrent login style writes (last_login update plus Token.get_or_create) against a file backed SQLite database,
+with SQLite's defaults and with the pragmas from Task1/database.py, while other threads keep reading the users
+table. Each profile runs in its own process since the pragmas are applied when a connection is created
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+WRITERS = 8
+READERS = 4
+WRITES_PER_THREAD = 200
+
+
+def run_profile(tuned):
+    # Runs in the child process, DATABASE_NAME and DATABASE_SQLITE_TUNING are already in the environment
+    from benchmarks.common import percentile, seed_users
+
+    from django.core.management import call_command
+    from django.db import OperationalError, connections, transaction
+    from django.utils import timezone
+    from rest_framework.authtoken.models import Token
+
+    from account.models import User
+
+    call_command('migrate', verbosity=0)
+    seed_users(WRITERS * 10)
+    user_ids = list(User.objects.values_list('id', flat=True))
+    connections.close_all()
+
+    timings = []
+    failures = []
+    done = threading.Event()
+
+    def writer(offset):
+        for i in range(WRITES_PER_THREAD):
+            user_id = user_ids[(offset + i * WRITERS) % len(user_ids)]
+            begin = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    # The UPDATE goes first so the transaction holds the write lock before it reads
+                    User.objects.filter(pk=user_id).update(last_login=timezone.now())
+                    Token.objects.get_or_create(user_id=user_id)
+            except OperationalError:
+                failures.append(1)
+            else:
+                timings.append(time.perf_counter() - begin)
+        connections.close_all()
+
+    def reader():
+        while not done.is_set():
+            with transaction.atomic():
+                list(User.objects.values_list('id', 'last_login')[:200])
+        connections.close_all()
+
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    begin = time.perf_counter()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    timings.sort()
+    return {
+        'profile': 'tuned' if tuned else 'default',
+        'writes_per_sec': round(len(timings) / elapsed, 1),
+        'locked_errors': len(failures),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+    }
+
+
+def main():
+    results = []
+    for tuned in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DATABASE_PROFILE='sqlite', DATABASE_NAME=os.path.join(directory, 'bench.sqlite3'),
+                       DATABASE_SQLITE_TUNING='1' if tuned else '0')
+            command = [sys.executable, '-m', 'benchmarks.bench_sqlite_writes', '--profile', str(int(tuned))]
+            output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE,
+                                    universal_newlines=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print('{} writer and {} reader threads, {} writes per writer'.format(WRITERS, READERS, WRITES_PER_THREAD))
+    print('{:<10}{:>16}{:>16}{:>12}{:>12}'.format('profile', 'writes/sec', 'locked errors', 'p50 ms', 'p99 ms'))
+    for result in results:
+        print('{profile:<10}{writes_per_sec:>16}{locked_errors:>16}{p50_ms:>12}{p99_ms:>12}'.format(**result))
+
+
+if __name__ == '__main__':
+    if '--profile' in sys.argv:
+        print(json.dumps(run_profile(sys.argv[sys.argv.index('--profile') + 1] == '1')))
+    else:
+        main()
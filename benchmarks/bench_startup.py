@@ -0,0 +1,118 @@
+"""
+Cold start of a worker for each APP_PROFILE, with and without the boot time warm up: a fresh interpreter imports
+Task1/wsgi.py and answers one authenticated GET /users/me/ and then a second one. Time to first response is counted
+from spawning the process, so it includes the interpreter's own startup. Exits non-zero when the api profile's
+median time to first response is over --budget-ms
+
+    python -m benchmarks.bench_startup [--runs 5] [--budget-ms 500]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules an api worker should never import while booting and answering an API request
+HEAVY_MODULES = ('coreapi', 'requests', 'yaml', 'PIL', 'django.contrib.sessions.backends.base',
+                 'rest_framework.documentation')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(token):
+    # Runs in the spawned worker, prints its timings as JSON
+    started = time.perf_counter()
+    from wsgiref.util import setup_testing_defaults
+
+    from Task1.wsgi import application
+    booted = time.perf_counter()
+
+    def request():
+        environ = {'PATH_INFO': '/users/me/', 'HTTP_AUTHORIZATION': 'Token ' + token}
+        setup_testing_defaults(environ)
+        statuses = []
+        body = application(environ, lambda status, headers: statuses.append(status))
+        b''.join(body)
+        body.close()
+        assert statuses[0].startswith('200'), statuses[0]
+
+    request()
+    first = time.perf_counter()
+    finished_at = time.time()
+    request()
+    second = time.perf_counter()
+    print(json.dumps({
+        'boot_ms': (booted - started) * 1000,
+        'first_ms': (first - booted) * 1000,
+        'second_ms': (second - first) * 1000,
+        'finished_at': finished_at,
+        'modules': len(sys.modules),
+        'heavy': [name for name in HEAVY_MODULES if sys.modules.get(name) is not None],
+    }))
+
+
+def spawn(token, profile, warm_up):
+    env = dict(os.environ, APP_PROFILE=profile, APP_WARM_UP='1' if warm_up else '0')
+    spawned_at = time.time()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child', token], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    result['ttfr_ms'] = (result.pop('finished_at') - spawned_at) * 1000
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=500,
+                        help='Most the api profile may take from spawn to its first response')
+    parser.add_argument('--child', metavar='TOKEN', help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    if options.child:
+        return child(options.child)
+
+    # The workers share a throw-away SQLite file seeded here, set before Django is configured
+    directory = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_NAME'] = os.path.join(directory.name, 'bench_startup.sqlite3')
+    from benchmarks.common import seed_users
+
+    from django.core.management import call_command
+
+    from account.authentication import issue_device_token
+    from account.models import User
+
+    call_command('migrate', verbosity=0)
+    seed_users(1)
+    token = issue_device_token(User.objects.get()).key
+
+    print('Worker cold start, median of {} runs'.format(options.runs))
+    print('{:<16} {:>9} {:>9} {:>9} {:>9} {:>8}  {}'.format(
+        'profile', 'boot ms', '1st ms', '2nd ms', 'ttfr ms', 'modules', 'heavy modules loaded'))
+    medians = {}
+    for profile in ('full', 'api'):
+        for warm_up in (False, True):
+            runs = [spawn(token, profile, warm_up) for _ in range(options.runs)]
+            name = profile + (' + warm up' if warm_up else '')
+            row = {key: statistics.median(run[key] for run in runs)
+                   for key in ('boot_ms', 'first_ms', 'second_ms', 'ttfr_ms', 'modules')}
+            medians[name] = row
+            print('{:<16} {:>9.0f} {:>9.1f} {:>9.1f} {:>9.0f} {:>8.0f}  {}'.format(
+                name, row['boot_ms'], row['first_ms'], row['second_ms'], row['ttfr_ms'], row['modules'],
+                ', '.join(runs[0]['heavy']) or '-'))
+    directory.cleanup()
+
+    # What an api worker boots with by default
+    ttfr = medians['api + warm up']['ttfr_ms']
+    if ttfr > options.budget_ms:
+        print('api profile time to first response {:.0f} ms is over the {:.0f} ms budget'.format(
+            ttfr, options.budget_ms))
+        sys.exit(1)
+    print('api profile time to first response {:.0f} ms, budget {:.0f} ms'.format(ttfr, options.budget_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Cost of a rejected login: the guard check on its own, the full DRF login view returning 429, and for scale the
+single password hash every unthrottled attempt pays
+"""
+
+from benchmarks.common import measure, report, setup_test_database
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from rest_framework.test import APIRequestFactory
+
+from account.throttling import CacheBackend, LoginGuard, LoginRateThrottle, MemoryBackend, get_login_guard
+from account.views import UserRelatedView
+
+
+def main(iterations=20000):
+    setup_test_database()
+    factory = APIRequestFactory()
+    view = UserRelatedView.as_view({'post': 'login'}, permission_classes=[], throttle_classes=[LoginRateThrottle])
+    results = {}
+
+    for name, backend in (('guard.check memory', MemoryBackend()),
+                          ('guard.check locmem cache', CacheBackend(caches['default']))):
+        guard = LoginGuard(backend, ip_rate='1/min', email_rate='1/min')
+        guard.check('10.0.0.1', 'victim@example.com')
+        guard.check('10.0.0.1', 'victim@example.com')
+        results[name] = measure(lambda: guard.check('10.0.0.1', 'victim@example.com'), iterations=iterations)
+
+    guard = get_login_guard()
+    for _ in range(100):
+        guard.check('127.0.0.1', 'victim@example.com')
+
+    def rejected_login():
+        response = view(factory.post('/users/login/', {'email': 'victim@example.com', 'password': 'guess'},
+                                     REMOTE_ADDR='127.0.0.1'))
+        assert response.status_code == 429, response.status_code
+
+    results['login view, rejected'] = measure(rejected_login, iterations=iterations // 10)
+    results['make_password (reference)'] = measure(lambda: make_password('guess'), iterations=5, warmup=1)
+    report('Rejected login cost', results)
+
+
+if __name__ == '__main__':
+    main()
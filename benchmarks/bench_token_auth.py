@@ -0,0 +1,55 @@
+"""
+Requests/sec of `GET /users/me/` with the stock TokenAuthentication, CachedTokenAuthentication,
+DeviceTokenAuthentication and the stateless SignedTokenAuthentication (with a warm user cache and with the cache
+cleared before every request)
+"""
+
+from benchmarks.common import measure, report, seed_users, setup_test_database
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from account.authentication import CachedTokenAuthentication, DeviceTokenAuthentication, \
+    SignedTokenAuthentication, get_token_cache, issue_device_token, issue_token_pair
+from account.models import User
+from account.views import UserRelatedView
+
+
+def main(iterations=2000):
+    setup_test_database()
+    seed_users(1000)
+    user = User.objects.order_by('id').first()
+    token = Token.objects.create(user=user)
+    device_token = issue_device_token(user)
+    access = issue_token_pair(user)['access']
+    factory = APIRequestFactory()
+    results = {}
+
+    scenarios = (
+        ('TokenAuthentication', TokenAuthentication, 'Token ' + token.key, False),
+        ('CachedTokenAuthentication', CachedTokenAuthentication, 'Token ' + token.key, False),
+        ('DeviceTokenAuthentication', DeviceTokenAuthentication, 'Token ' + device_token.key, False),
+        ('DeviceTokenAuthentication cold', DeviceTokenAuthentication, 'Token ' + device_token.key, True),
+        ('SignedTokenAuthentication', SignedTokenAuthentication, 'Bearer ' + access, False),
+        ('SignedTokenAuthentication cold', SignedTokenAuthentication, 'Bearer ' + access, True),
+    )
+    for name, auth_class, header, cold in scenarios:
+        view = UserRelatedView.as_view({'get': 'me'}, authentication_classes=[auth_class],
+                                       permission_classes=[IsAuthenticated])
+        get_token_cache().clear()
+
+        def request():
+            if cold:
+                get_token_cache().clear()
+            response = view(factory.get('/users/me/', HTTP_AUTHORIZATION=header))
+            assert response.status_code == 200, response.status_code
+
+        results[name] = measure(request, iterations=iterations)
+
+    report('GET /users/me/ ({} requests)'.format(iterations), results)
+
+
+if __name__ == '__main__':
+    main()
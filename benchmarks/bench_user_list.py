@@ -0,0 +1,68 @@
+"""
+Latency and peak Python heap of `GET /users/` at growing table sizes, comparing the old unpaginated list with the
+cursor paginated list and a ?fields=id,email projection
+
+    python -m benchmarks.bench_user_list 10000 100000 1000000
+
+The 1M run takes about 8 minutes and needs ~1 GiB for the unpaginated list
+"""
+
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import seed_users, setup_test_database
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from account.models import User
+from account.views import UserRelatedView
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+
+
+def call(view, request):
+    response = view(request)
+    response.render()
+    assert response.status_code == 200, response.status_code
+
+
+def run(view, request, repeat=3):
+    # Latency is the best of a few untraced runs, tracemalloc slows allocation heavy code down a lot
+    latencies = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        call(view, request)
+        latencies.append(time.perf_counter() - begin)
+
+    tracemalloc.start()
+    call(view, request)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(latencies) * 1000, peak / 1024.0 / 1024.0
+
+
+def main(sizes):
+    setup_test_database()
+    User.objects.create_superuser(email='admin@example.com', first_name='Admin', last_name='Admin', gender='M',
+                                  password='pass123')
+    admin = User.objects.get(email='admin@example.com')
+    factory = APIRequestFactory()
+    scenarios = (
+        ('unpaginated', UserRelatedView.as_view({'get': 'list'}, pagination_class=None), {}),
+        ('cursor page', UserRelatedView.as_view({'get': 'list'}), {}),
+        ('cursor page fields=id,email', UserRelatedView.as_view({'get': 'list'}), {'fields': 'id,email'}),
+    )
+
+    print('{:>9} {:<30} {:>12} {:>12}'.format('rows', 'scenario', 'latency ms', 'peak MiB'))
+    for size in sizes:
+        seed_users(size - User.objects.count())
+        for name, view, params in scenarios:
+            request = factory.get('/users/', params)
+            force_authenticate(request, user=admin)
+            latency, peak = run(view, request)
+            print('{:>9} {:<30} {:>12.1f} {:>12.1f}'.format(size, name, latency, peak))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,395 @@
+"""
+Load test of the account API: seeds users through the bulk fixture path, then drives create_user, login, me,
+change_password and the admin list at a fixed concurrency and writes throughput, latency percentiles, queries per
+request and peak memory to JSON so runs can be compared across commits
+
+    python -m benchmarks.loadtest --target wsgi --users 1000 --concurrency 8 --output before.json
+    python -m benchmarks.loadtest --target wsgi --users 1000 --concurrency 8 --compare before.json
+
+--target wsgi or asgi runs the app in process against a throw-away SQLite file. A URL such as
+http://127.0.0.1:8000 drives a running server instead; the users are then seeded into the database configured for
+this checkout, which has to be the one that server uses, and its login throttle has to allow the load
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+SCENARIOS = ('create_user', 'login', 'me', 'change_password', 'list')
+
+# URL name each scenario is recorded under by account.metrics.MetricsMiddleware
+ROUTES = {
+    'create_user': 'api-create-user',
+    'login': 'api-login',
+    'me': 'api-me',
+    'change_password': 'api-change-password',
+    'list': 'api-list',
+}
+
+ADMIN_EMAIL = 'loadtest-admin@example.com'
+METRIC_LINE = re.compile(r'^account_db_queries_(sum|count)\{route="([^"]+)"\} (\S+)$')
+
+
+class WsgiTransport:
+    # One django.test.Client per thread, requests go through the full middleware stack without a socket
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, data=None, token=None):
+        from django.test import Client
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client()
+        extra = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+        response = client.generic(method, path, json.dumps(data) if data is not None else '',
+                                  content_type='application/json', **extra)
+        return response.status_code, response.content
+
+    def close(self):
+        from django.db import connections
+
+        connections.close_all()
+
+
+class AsgiTransport(WsgiTransport):
+    # Through Django's ASGIHandler, sync views then run on its thread sensitive executor like under uvicorn
+
+    def request(self, method, path, data=None, token=None):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = AsyncClient()
+        # AsyncClient passes extra keyword arguments on as raw ASGI headers
+        extra = {'authorization': 'Token ' + token} if token else {}
+
+        async def call():
+            return await client.generic(method, path, json.dumps(data) if data is not None else '',
+                                        content_type='application/json', **extra)
+
+        response = async_to_sync(call)()
+        return response.status_code, response.content
+
+
+class HttpTransport:
+    # One keep-alive connection per thread to a running server
+
+    def __init__(self, base_url):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.netloc
+        self.prefix = parsed.path.rstrip('/')
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self._local = threading.local()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Token ' + token
+        body = json.dumps(data) if data is not None else None
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = self.connection_class(self.host, timeout=30)
+            try:
+                connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (ConnectionError, http.client.HTTPException):
+                # The server closed the kept alive connection, retry once on a fresh one
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def close(self):
+        pass
+
+
+def seed(users):
+    """
+    Bulk inserts the users with one shared hash, an admin and a token for each of them, returns
+    (admin token, [(email, token)])
+    """
+    from datetime import timedelta
+
+    from benchmarks.common import seed_users
+    from django.utils import timezone
+
+    from account.authentication import device_token_conf, issue_device_token
+    from account.models import DeviceToken, User
+
+    start = User.all_with_inactive.count()
+    seed_users(users)
+    User.objects.filter(email=ADMIN_EMAIL).delete()
+    admin = User.objects.create_superuser(email=ADMIN_EMAIL, first_name='Load', last_name='Test', gender='M',
+                                          password='pass123')
+    seeded = list(User.objects.order_by('id').values_list('id', 'email')[start:start + users])
+    DeviceToken.objects.filter(user_id__in=[user_id for user_id, email in seeded] + [admin.id]).delete()
+    expires = timezone.now() + timedelta(seconds=device_token_conf()['TTL'])
+    tokens = [DeviceToken(user_id=user_id, key=DeviceToken.generate_key(), expires=expires)
+              for user_id, email in seeded]
+    admin_token = issue_device_token(admin)
+    DeviceToken.objects.bulk_create(tokens, batch_size=1000)
+    return admin_token.key, [(email, token.key) for (user_id, email), token in zip(seeded, tokens)]
+
+
+def make_requests(scenario, accounts, run_id):
+    # Returns a function building the i-th request of the scenario as (method, path, data, token)
+    from benchmarks.common import DEFAULT_PASSWORD
+
+    if scenario == 'create_user':
+        return lambda i: ('POST', '/users/create_user/', {
+            'email': 'load-{}-{}@example.com'.format(run_id, i), 'first_name': 'Load', 'last_name': 'Test',
+            'gender': 'M', 'password': DEFAULT_PASSWORD, 'confirm_password': DEFAULT_PASSWORD}, None)
+    if scenario == 'login':
+        return lambda i: ('POST', '/users/login/',
+                          {'email': accounts[i % len(accounts)][0], 'password': DEFAULT_PASSWORD}, None)
+    if scenario == 'me':
+        return lambda i: ('GET', '/users/me/', None, accounts[i % len(accounts)][1])
+    if scenario == 'change_password':
+        # Sets the same password again, so the other scenarios keep working
+        return lambda i: ('PUT', '/users/change_password/', {
+            'old_password': DEFAULT_PASSWORD, 'new_password': DEFAULT_PASSWORD,
+            'confirm_password': DEFAULT_PASSWORD}, accounts[i % len(accounts)][1])
+    if scenario == 'list':
+        return lambda i: ('GET', '/users/', None, accounts.admin_token)
+    raise ValueError('Unknown scenario {}'.format(scenario))
+
+
+class Accounts(list):
+    admin_token = None
+
+
+def scrape_queries(transport, admin_token):
+    # (sum, count) of account_db_queries per route from the metrics endpoint
+    status, body = transport.request('GET', '/users/metrics/', token=admin_token)
+    values = {}
+    if status != 200:
+        return values
+    for line in body.decode().splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            kind, route, value = match.groups()
+            values.setdefault(route, [0.0, 0.0])[0 if kind == 'sum' else 1] = float(value)
+    return values
+
+
+def run_scenario(transport, build, requests, concurrency, start=0):
+    from benchmarks.common import percentile
+
+    timings = []
+    statuses = {}
+    lock = threading.Lock()
+    # Request numbers continue after the warmup's, create_user needs a fresh email every time
+    counter = iter(range(start, start + requests))
+
+    def worker():
+        local_timings = []
+        local_statuses = {}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            method, path, data, token = build(i)
+            begin = time.perf_counter()
+            try:
+                status = transport.request(method, path, data, token)[0]
+            except Exception as exc:
+                status = type(exc).__name__
+            local_timings.append(time.perf_counter() - begin)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        transport.close()
+        with lock:
+            timings.extend(local_timings)
+            for status, count in local_statuses.items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+    errors = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'status_codes': statuses,
+        'rps': round(len(timings) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0.0,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p90_ms': round(percentile(timings, 90) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3) if timings else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(options):
+    in_process = options.target in ('wsgi', 'asgi')
+    directory = None
+    if in_process and 'DATABASE_NAME' not in os.environ:
+        directory = tempfile.TemporaryDirectory()
+        os.environ['DATABASE_NAME'] = os.path.join(directory.name, 'loadtest.sqlite3')
+
+    # Django is configured on import, so only once DATABASE_NAME is in place
+    import django
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+
+    import benchmarks.common  # noqa: F401
+
+    if in_process:
+        call_command('migrate', verbosity=0)
+        transport = WsgiTransport() if options.target == 'wsgi' else AsgiTransport()
+        # Rejected requests are counted in the results, not logged one by one
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        # Every login comes from the same client IP here, and a handful of users log in over and over
+        settings_override = override_settings(
+            ACCOUNT_LOGIN_THROTTLE={'IP_RATE': '1000000/s', 'EMAIL_RATE': '1000000/s'},
+            ALLOWED_HOSTS=['*'])
+    else:
+        transport = HttpTransport(options.target)
+        settings_override = override_settings()
+
+    accounts = Accounts()
+    admin_token, seeded = seed(options.users)
+    accounts.extend(seeded)
+    accounts.admin_token = admin_token
+    run_id = int(time.time())
+
+    results = {}
+    with settings_override:
+        for scenario in options.scenarios:
+            build = make_requests(scenario, accounts, run_id)
+            # Warms connections, caches and imports so they aren't billed to the first requests
+            run_scenario(transport, build, options.warmup, options.concurrency)
+            before = scrape_queries(transport, admin_token)
+            result = run_scenario(transport, build, options.requests, options.concurrency, start=options.warmup)
+            after = scrape_queries(transport, admin_token)
+
+            route = ROUTES[scenario]
+            total, count = [a - b for a, b in zip(after.get(route, (0, 0)), before.get(route, (0, 0)))]
+            result['db_queries_per_request'] = round(total / count, 2) if count else None
+            # ru_maxrss is the peak of the whole process so far, in KiB on Linux
+            result['peak_rss_mib'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1) \
+                if in_process else None
+            results[scenario] = result
+            print_row(scenario, result)
+
+    transport.close()
+    if directory is not None:
+        directory.cleanup()
+
+    return {
+        'meta': {
+            'target': options.target,
+            'users': options.users,
+            'concurrency': options.concurrency,
+            'requests': options.requests,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'cpus': os.cpu_count(),
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+        'scenarios': results,
+    }
+
+
+def print_row(scenario, result):
+    if scenario is None:
+        print('{:<16} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8} {:>9}'.format(
+            'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'queries', 'peak MiB'))
+        return
+    print('{:<16} {:>9} {:>7} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {!s:>8} {!s:>9}'.format(
+        scenario, result['requests'], result['errors'], result['rps'], result['p50_ms'], result['p90_ms'],
+        result['p99_ms'], result['db_queries_per_request'], result['peak_rss_mib']))
+
+
+def compare(baseline, current, tolerance):
+    """
+    Prints the change of every scenario against the baseline run, returns the regressions: throughput down or p99
+    up by more than tolerance, or more queries per request
+    """
+    regressions = []
+    print('\nagainst {} ({})'.format(baseline['meta'].get('commit'), baseline['meta'].get('timestamp')))
+    for key in ('target', 'users', 'concurrency', 'cpus'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print('warning: {} differs, {} before and {} now'.format(
+                key, baseline['meta'].get(key), current['meta'].get(key)))
+    print('{:<16} {:>10} {:>10} {:>12}'.format('scenario', 'req/s', 'p99', 'queries'))
+    for scenario, result in current['scenarios'].items():
+        old = baseline['scenarios'].get(scenario)
+        if old is None:
+            continue
+        rps = (result['rps'] - old['rps']) / old['rps'] if old['rps'] else 0.0
+        p99 = (result['p99_ms'] - old['p99_ms']) / old['p99_ms'] if old['p99_ms'] else 0.0
+        queries = (result['db_queries_per_request'] or 0) - (old['db_queries_per_request'] or 0)
+        print('{:<16} {:>+10.1%} {:>+10.1%} {:>+12.2f}'.format(scenario, rps, p99, queries))
+        if rps < -tolerance:
+            regressions.append('{}: throughput {:+.1%}'.format(scenario, rps))
+        if p99 > tolerance:
+            regressions.append('{}: p99 latency {:+.1%}'.format(scenario, p99))
+        if queries > 0:
+            regressions.append('{}: {:+.2f} queries per request'.format(scenario, queries))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', default='wsgi', help='wsgi, asgi or the base URL of a running server')
+    parser.add_argument('--users', type=int, default=1000, help='Users seeded before the run')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--output', '-o', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative throughput or p99 change counted as a regression by --compare')
+    options = parser.parse_args(argv)
+
+    print_row(None, None)
+    results = run(options)
+    if options.output:
+        with open(options.output, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(json.load(f), results, options.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())